@@ -5,7 +5,7 @@ from typing import Any, Dict, List, Optional, Type, TypeVar, cast
 import pydantic
 import tortoise.exceptions
 import tortoise.models
-from base4.schemas.universal_table import UniversalTableGetRequest, UniversalTableResponse
+from base4.schemas.universal_table import UniversalTableGetRequest, UniversalTableResponse, UniversalTableResponseBaseSchema
 
 # from base4.schemas.crud import CreateItemParamsRequest
 from base4.service.base import BaseService
@@ -16,6 +16,72 @@ from fastapi.requests import Request
 
 BaseServiceClassType = TypeVar("BaseServiceClassType", bound=BaseService)
 
+# service instances shared by the generated routes, one per service class
+_services: Dict[Type[BaseService], BaseService] = {}
+
+
+def get_service(service_class: Type[BaseServiceClassType]) -> BaseServiceClassType:
+    """
+    Return the instance of service_class used by the generated routes, created on first use.
+
+    One instance (with its reflection results) serves every request instead of constructing a
+    service per call, concurrent requests run on the same instance. Per request state must not
+    live on the instance: services only set attributes in __init__, everything a call needs or
+    produces is passed as arguments and return values (mk_cache returns its timings, for example).
+    """
+    try:
+        return _services[service_class]
+    except KeyError:
+        service = _services[service_class] = service_class()
+        return service
+
+
+# service_name -> {profile: profile schema class}, see load_profile_schemas
+_profile_schemas: Dict[str, Dict[str, Type]] = {}
+
+
+def load_profile_schemas(service_name: str, default_profile: str = 'default') -> Dict[str, Type]:
+    """
+    Resolve the universal table profile schemas {Service}{Profile}Schema of services.{service_name}.schemas.
+
+    Called when the list route of the service is created, so a broken schemas module or a missing
+    default profile fails at startup instead of on the first list request.
+
+    Raises:
+        NameError: if the default profile schema does not exist
+    """
+    prefix = service_name.capitalize()
+
+    profiles = {}
+    for name, value in vars(importlib.import_module(f'services.{service_name}.schemas')).items():
+        if (
+            isinstance(value, type)
+            and issubclass(value, UniversalTableResponseBaseSchema)
+            and name.startswith(prefix)
+            and name.endswith('Schema')
+            and len(name) > len(prefix) + len('Schema')
+        ):
+            profiles[name[len(prefix) : -len('Schema')]] = value
+
+    if default_profile.capitalize() not in profiles:
+        raise NameError(f"Profile schema {prefix}{default_profile.capitalize()}Schema not found in services.{service_name}.schemas")
+
+    _profile_schemas[service_name] = profiles
+    return profiles
+
+
+def get_profile_schema(service_name: str, profile: str) -> Type:
+    """
+    Return the profile schema of a service resolved by load_profile_schemas.
+
+    Raises:
+        HTTPException: 400 if the profile does not exist
+    """
+    try:
+        return _profile_schemas[service_name][profile.capitalize()]
+    except KeyError:
+        raise HTTPException(status_code=400, detail={"code": "INVALID_PARAMETER", "parameter": "profile", "message": f"Unknown profile {profile}"})
+
 
 def create_endpoints(
     router: APIRouter,
@@ -27,7 +93,14 @@ def create_endpoints(
     functions: set = None,
     verify_token_method: Any = verify_token,
     verify_token_per_method: Optional[Dict[str, Any]] = None,
+    raw_json_response: bool = False,
 ):
+    """
+    Register the CRUD routes of the services in endpoints on router.
+
+    With raw_json_response set, list responses are encoded straight from the built rows
+    (orjson if installed, pydantic_core otherwise) instead of being validated against the response model.
+    """
     for path, config in endpoints.items():
         service_class: Type[BaseService] = cast(Type[BaseService], config['service'])
         schema_class = config['schema']
@@ -47,7 +120,7 @@ def create_endpoints(
                 schema_class=schema_class,
                 _session: DecodedToken = Depends(the_verify_token_method),
             ):
-                service = service_class()
+                service = get_service(service_class)
                 res = await service.get_single(_id, request)
                 return res
 
@@ -58,7 +131,7 @@ def create_endpoints(
             async def get_single_field(
                 _id: uuid.UUID, field: str, request: Request, service_class=service_class, _session: DecodedToken = Depends(the_verify_token_method)
             ):
-                service = service_class()
+                service = get_service(service_class)
                 res = await service.get_single_field(_id, field, request)
                 return res
 
@@ -74,10 +147,7 @@ def create_endpoints(
                 key_id: str = Query(None),
                 _session: DecodedToken = Depends(the_verify_token_method),
             ) -> Any:
-                try:
-                    service: service_class = service_class()
-                except Exception as e:
-                    raise
+                service: service_class = get_service(service_class)
 
                 # logged_user_id = uuid.UUID('00000000-0000-0000-0000-000000000000')
 
@@ -110,35 +180,50 @@ def create_endpoints(
             @router.patch(path + '/{item_id}/validate')
             async def validate(item_id: uuid.UUID, _request: Request, _session: DecodedToken = Depends(the_verify_token_method)) -> Dict:
 
-                service: service_class = service_class()
+                service: service_class = get_service(service_class)
 
                 return await service.validate(_session.user_id, item_id=item_id, request=_request)
 
+        if not functions or 'create_many' in functions:
+
+            the_verify_token_method = verify_token_per_method.get('create_many', verify_token_method) if verify_token_per_method else verify_token_method
+
+            @router.post(path + '/bulk')
+            async def create_many(
+                payloads: List[schema_class],
+                request: Request,
+                response: Response,
+                _session: DecodedToken = Depends(the_verify_token_method),
+            ) -> Any:
+                service: service_class = get_service(service_class)
+
+                try:
+                    res = await service.create_many(_session.user_id, payloads, request)
+                except tortoise.exceptions.IntegrityError as e:
+                    raise HTTPException(status_code=406, detail={"code": "NOT_ACCEPTABLE", "parameter": None, "message": f"Integrity error"})
+
+                response.status_code = 201
+                return res
+
         if not functions or 'get' in functions:
 
+            load_profile_schemas(service_name, default_table_profile)
+
             the_verify_token_method = verify_token_per_method.get('get', verify_token_method) if verify_token_per_method else verify_token_method
 
             @router.get(path, response_model=List[Dict] | Dict[str, Any] | UniversalTableResponse)
             async def get(request: Request, params: UniversalTableGetRequest = Depends(), _session: DecodedToken = Depends(the_verify_token_method)) -> Any:
-                service: service_class = service_class()
+                service: service_class = get_service(service_class)
 
                 if params.profile:
                     profile = params.profile.capitalize()
                 else:
                     profile = default_table_profile  # TODO: Use from params
 
-                sch = f'profiles.{service_name.capitalize()}{profile.capitalize()}Schema'
-
-                # DO NOT REMOVE THIS LINE - eval(sch) uses it
-
-                # modul = f'services.{service_name}.schemas.generated_{singular_object_name}_table'
-
-                modul = f'services.{service_name}.schemas'
-
-                profiles = importlib.import_module(modul)
+                profile_schema = get_profile_schema(service_name, profile)
 
                 try:
-                    res = await service.get_all(params, eval(sch), _request=request)
+                    res = await service.get_all(params, profile_schema, _request=request, raw_response=raw_json_response)
                     ...
                 except Exception as e:
                     raise
@@ -150,7 +235,7 @@ def create_endpoints(
 
             @router.patch(path + '/{_id}', response_model=Dict[str, Any])
             async def update(_id: uuid.UUID, payload: schema_class, request: Request, _session: DecodedToken = Depends(the_verify_token_method)) -> Any:
-                service = service_class()
+                service = get_service(service_class)
                 # logged_user_id = uuid.UUID('00000000-0000-0000-0000-000000000000')
 
                 updated = await service.update(_session.user_id, _id, payload, request)
@@ -161,7 +246,7 @@ def create_endpoints(
 
             @router.delete(path + '/{_id}', response_model=Dict[str, Any])
             async def delete(_id: uuid.UUID, request: Request, _session: DecodedToken = Depends(the_verify_token_method)) -> Dict:
-                service = service_class()
+                service = get_service(service_class)
                 # logged_user_id = uuid.UUID('00000000-0000-0000-0000-000000000000')
                 await service.delete(_session.user_id, _id, request)
                 return {'deleted': _id}
@@ -36,23 +36,80 @@ class BaseNoTenant:
     deleted_by = fields.UUIDField(null=True)
     deleted = fields.DatetimeField(null=True)
 
+    @staticmethod
+    def unique_id_candidates(count, prefix='?', alphabet='WERTYUPASFGHJKLZXCVNM2345679', total_length=10):
+        """Generate count distinct random unique ids (at most the whole id space), without checking the table."""
+        count = min(count, len(set(alphabet)) ** (total_length - len(prefix)))
+        candidates = set()
+        while len(candidates) < count:
+            candidates.add(prefix + ''.join(random.choices(alphabet, k=total_length - len(prefix))))
+        return candidates
+
+    @classmethod
+    async def gen_unique_id(cls, prefix='?', alphabet='WERTYUPASFGHJKLZXCVNM2345679', total_length=10, max_attempts=10, block_size=8):
+        """
+        Generate a unique id not present in the table.
+
+        A block of block_size candidates is checked with one IN query per attempt, so a
+        second round-trip is only needed if the whole block is taken.
+        """
+
+        return (await cls.gen_unique_ids(1, prefix, alphabet, total_length, max_attempts, block_size))[0]
+
     @classmethod
-    async def gen_unique_id(cls, prefix='?', alphabet='WERTYUPASFGHJKLZXCVNM2345679', total_length=10, max_attempts=10):
+    async def gen_unique_ids(cls, count, prefix='?', alphabet='WERTYUPASFGHJKLZXCVNM2345679', total_length=10, max_attempts=10, block_size=8):
+        """
+        Generate count distinct unique ids not present in the table.
 
+        Candidates are generated in blocks (at least block_size, twice the number of missing
+        ids for larger batches) and checked with a single IN query per attempt, instead of
+        a count query per candidate.
+        """
+
+        unique_ids = []
         for attempt in range(max_attempts):
-            unique_id = prefix + ''.join(random.choice(alphabet) for _ in range(total_length - len(prefix)))
-            if await cls.filter(unique_id=unique_id).count() == 0:
-                return unique_id
+            missing = count - len(unique_ids)
+            candidates = cls.unique_id_candidates(max(block_size, 2 * missing), prefix, alphabet, total_length)
+            candidates -= set(unique_ids)
+
+            taken = set(await cls.filter(unique_id__in=list(candidates)).values_list('unique_id', flat=True))
+            unique_ids.extend(list(candidates - taken)[:missing])
+
+            if len(unique_ids) >= count:
+                return unique_ids
 
         raise HTTPException(
             status_code=500,
             detail={
                 "code": "INTERNAL_SERVER_ERROR",
-                "debug": f'Failed to generate unique id in {max_attempts} attempts',
+                "debug": f'Failed to generate {count} unique ids in {max_attempts} attempts',
                 "message": "Failed to generate unique id",
             },
         )
 
+    @classmethod
+    async def unique_id_saturation(cls, prefix='?', alphabet='WERTYUPASFGHJKLZXCVNM2345679', total_length=10):
+        """
+        Report how much of the unique id space for prefix/alphabet/total_length is used.
+
+        Returns:
+            dict: space (number of possible ids), used (ids with the prefix in the table),
+                  saturation (used / space) and expected_attempts (random candidates needed
+                  on average to find a free id)
+        """
+
+        space = len(set(alphabet)) ** (total_length - len(prefix))
+        used = await cls.filter(unique_id__startswith=prefix).count()
+        saturation = used / space
+
+        return {
+            'prefix': prefix,
+            'space': space,
+            'used': used,
+            'saturation': saturation,
+            'expected_attempts': 1 / (1 - saturation) if saturation < 1 else None,
+        }
+
     # @classmethod
     # async def gen_random_id(cls):
     #     def generate_random_id(n):
@@ -0,0 +1,25 @@
+from tortoise import fields
+from tortoise.contrib.postgres.indexes import GinIndex
+
+
+class TSVectorField(fields.Field[str], str):
+    """
+    Full-text search document, TSVECTOR on postgres and TEXT (left empty) elsewhere.
+
+    The value is computed by the database (see BaseServiceSearchUtils.refresh), never
+    assigned from python.
+    """
+
+    SQL_TYPE = 'TEXT'
+
+    class _db_postgres:
+        SQL_TYPE = 'TSVECTOR'
+
+
+class SearchVectorIndex(GinIndex):
+    """GIN index over a TSVectorField, skipped by the schema generator on databases other than postgres."""
+
+    def get_sql(self, schema_generator, model, safe: bool) -> str:
+        if schema_generator.DIALECT != 'postgres':
+            return ''
+        return super().get_sql(schema_generator, model, safe)
@@ -1,11 +1,17 @@
-from typing import Any, Dict, List, Literal, Optional
+import json
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple
 
 import pydantic
+from base4.utilities.accessors import compile_accessor
+
+
+# response formats streamed as a file of all matched items instead of a page, see BaseService.export
+EXPORT_FORMATS = ('ndjson', 'csv')
 
 
 class UniversalTableGetRequest(pydantic.BaseModel):
     profile: Optional[None | str] = None
-    response_format: Optional[Literal['table', 'objects', 'key-value']] = 'objects'
+    response_format: Optional[Literal['table', 'objects', 'key-value', 'ndjson', 'csv']] = 'objects'
 
     key_value_response_format_key: Optional[None | str] = None
 
@@ -19,6 +25,8 @@ class UniversalTableGetRequest(pydantic.BaseModel):
     v3_filters: Optional[None | Any] = None
 
     search: Optional[None | str] = None
+    # language of the cache1n rows searched (BaseCache1n.language), None searches all languages
+    search_language: Optional[None | str] = None
 
     v3f_statuses: Optional[None | str] = None
     v3f_priorities: Optional[None | str] = None
@@ -35,6 +43,14 @@ class UniversalTableGetRequest(pydantic.BaseModel):
     page: Optional[int] = 1
     per_page: Optional[int] = 100
 
+    # keyset pagination, page is ignored when cursor is set or after/before is sent
+    cursor: Optional[bool] = False
+    after: Optional[None | str] = None
+    before: Optional[None | str] = None
+
+    # None means use profile count_mode() or 'exact'
+    count_mode: Optional[None | Literal['exact', 'window', 'estimated', 'none']] = None
+
 
 class Column(pydantic.BaseModel):
     field: str
@@ -48,11 +64,16 @@ class Column(pydantic.BaseModel):
 
 
 class Summary(pydantic.BaseModel):
-    count: int
+    count: Optional[int | None] = None
 
     page: int
     per_page: int
-    total_pages: int
+    total_pages: Optional[int | None] = None
+
+    has_next: Optional[bool | None] = None
+    next_cursor: Optional[str | None] = None
+    previous_cursor: Optional[str | None] = None
+    count_mode: Literal['exact', 'window', 'estimated', 'none'] = 'exact'
 
 
 class Header(pydantic.BaseModel):
@@ -67,56 +88,110 @@ class UniversalTableResponse(pydantic.BaseModel):
     data: List
 
 
+_compiled_accessors: Dict[Tuple[type, type], Tuple[Tuple[str, Callable[[Any], Any]], ...]] = {}
+_compiled_columns: Dict[type, Tuple[Tuple[Column, ...], bytes]] = {}
+_compiled_header_json: Dict[Tuple[type, str], Tuple[bytes, bytes]] = {}
+
+_columns_adapter = pydantic.TypeAdapter(List[Column])
+
+
 class UniversalTableResponseBaseSchema(pydantic.BaseModel):
     @classmethod
-    def build(cls, model_item, item_schema, request: UniversalTableGetRequest) -> Dict[str, Any] | List[Any]:
+    def compiled_accessors(cls, item_schema) -> Tuple[Tuple[str, Callable[[Any], Any]], ...]:
+        """
+        Return (field, getter) pairs for the profile columns, in order() order.
+
+        Getters are compiled from item_schema.model_loc() once per (profile, item_schema)
+        pair and reused for every row of every request.
+        """
+        key = (cls, item_schema)
+        try:
+            return _compiled_accessors[key]
+        except KeyError:
+            pass
+
         model_loc = item_schema.model_loc()
+        accessors = tuple((field, compile_accessor(model_loc[field])) for field in cls.order())
+        _compiled_accessors[key] = accessors
+        return accessors
 
-        if request.response_format == 'objects':
-            res = {}
-            for field in cls.order():
-                try:
-                    res[field] = eval(f'model_item.{model_loc[field]}')
-                except Exception as e:
-                    raise
-        elif request.response_format == 'key-value':
-            res = {}
-            for field in cls.order():
-                res[field] = eval(f'model_item.{model_loc[field]}')
+    @classmethod
+    def build(cls, model_item, item_schema, request: UniversalTableGetRequest) -> Dict[str, Any] | List[Any]:
+        accessors = cls.compiled_accessors(item_schema)
 
+        if request.response_format in ('objects', 'key-value'):
+            res = {field: getter(model_item) for field, getter in accessors}
         elif request.response_format == 'table':
-            res = []
-            for field in cls.order():
-                res.append(eval(f'model_item.{model_loc[field]}'))
+            res = [getter(model_item) for _, getter in accessors]
         else:
             raise NameError(f"Unknown response_format: {request.response_format}")
 
         return res
 
-    @classmethod
-    def header(cls, request: UniversalTableGetRequest, summary: Summary, response_format: Literal['objects', 'table', 'key-value'] = 'objects'):
-
-        res = Header(columns=[], summary=summary, response_format=response_format)
-        widths = cls.column2width()
-        justify = cls.column2justify()
-        titles = cls.column2title()
+    @staticmethod
+    def columns_definition() -> Optional[Tuple[Dict[str, Any], ...]]:
+        """
+        Static column metadata (Column keyword arguments in order() order).
 
-        for field in cls.order():
-            try:
-                type_ = cls.model_fields[field].annotation.__name__
+        Profiles generated by gen_tables.py return a module constant, None makes
+        compiled_columns() derive it from the profile methods.
+        """
+        return None
 
-                column = Column(
+    @classmethod
+    def compiled_columns(cls) -> Tuple[Tuple[Column, ...], bytes]:
+        """
+        Return the header columns of the profile and their JSON encoding.
+
+        Built once per profile, header() and header_json() only add the summary.
+        """
+        try:
+            return _compiled_columns[cls]
+        except KeyError:
+            pass
+
+        definition = cls.columns_definition()
+        if definition is None:
+            widths = cls.column2width()
+            justify = cls.column2justify()
+            titles = cls.column2title()
+
+            definition = tuple(
+                dict(
                     name=field,
                     field=field,
-                    type=cls.column_data_type(field) or type_,
+                    type=cls.column_data_type(field) or cls.model_fields[field].annotation.__name__,
                     sortable=cls.sortable(field),
                     filterable=cls.filter_properties(field),
                     widths=widths[field] if field in widths else None,
                     align_text=justify[field] if field in justify else 'start',
                     display_name=titles[field],
                 )
-                res.columns.append(column)
-            except Exception as e:
-                raise
+                for field in cls.order()
+            )
 
-        return res
+        columns = tuple(Column(**column) for column in definition)
+        columns_json = _columns_adapter.dump_json(list(columns))
+
+        _compiled_columns[cls] = (columns, columns_json)
+        return columns, columns_json
+
+    @classmethod
+    def header(cls, request: UniversalTableGetRequest, summary: Summary, response_format: Literal['objects', 'table', 'key-value'] = 'objects'):
+        columns, _ = cls.compiled_columns()
+
+        # columns are validated once in compiled_columns, the list is shared between responses
+        return Header.model_construct(columns=list(columns), summary=summary, response_format=response_format)
+
+    @classmethod
+    def header_json(cls, summary: Summary, response_format: Literal['objects', 'table', 'key-value'] = 'objects') -> bytes:
+        """JSON encoding of header(), the only part serialized per request is the summary."""
+        key = (cls, response_format)
+        try:
+            prefix, suffix = _compiled_header_json[key]
+        except KeyError:
+            _, columns_json = cls.compiled_columns()
+            prefix, suffix = b'{"columns":' + columns_json + b',"summary":', b',"response_format":' + json.dumps(response_format).encode() + b'}'
+            _compiled_header_json[key] = (prefix, suffix)
+
+        return prefix + summary.model_dump_json().encode() + suffix
@@ -0,0 +1,93 @@
+import asyncio
+import datetime
+import json
+import time
+import uuid
+from typing import Any, Dict, List
+
+from base4.schemas.universal_table import Summary, UniversalTableResponse, UniversalTableResponseBaseSchema
+from base4.utilities.http import response
+from base4.utilities.http.response import table_response
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+ROWS = 1000
+REPEAT = 20
+
+
+class BenchDefaultSchema(UniversalTableResponseBaseSchema):
+    id: Any
+    display_name: str
+    priority: int
+    created: Any
+    tags: Any
+
+    @staticmethod
+    def columns_definition():
+        return tuple(
+            dict(name=field, field=field, type=type_, sortable=False, filterable=False, widths=[100, 100, 100], align_text='start', display_name=field)
+            for field, type_ in (('id', 'uuid'), ('display_name', 'str'), ('priority', 'int'), ('created', 'datetime'), ('tags', 'list'))
+        )
+
+
+def mk_page():
+    now = datetime.datetime.now(datetime.timezone.utc)
+    data = [
+        {'id': uuid.uuid4(), 'display_name': f'Item {i}', 'priority': i % 5, 'created': now - datetime.timedelta(minutes=i), 'tags': ['a', 'b', str(i)]}
+        for i in range(ROWS)
+    ]
+    summary = Summary(count=ROWS * 10, page=1, per_page=ROWS, total_pages=10, has_next=True)
+    return data, summary
+
+
+async def do_async():
+    data, summary = mk_page()
+
+    # the response model of the generated list route
+    field = create_model_field(name='Response_get', type_=List[Dict] | Dict[str, Any] | UniversalTableResponse, mode='serialization')
+
+    async def pydantic_path():
+        content = UniversalTableResponse(data=data, header=BenchDefaultSchema.header(None, summary, response_format='objects'))
+        return JSONResponse(await serialize_response(field=field, response_content=content)).body
+
+    async def raw_path():
+        return table_response(data, BenchDefaultSchema.header_json(summary, response_format='objects')).body
+
+    encoders = [('response_model', pydantic_path), (f'raw ({"orjson" if response.orjson else "pydantic_core"})', raw_path)]
+
+    if response.orjson:
+
+        async def raw_pydantic_core_path():
+            orjson, response.orjson = response.orjson, None
+            try:
+                return table_response(data, BenchDefaultSchema.header_json(summary, response_format='objects')).body
+            finally:
+                response.orjson = orjson
+
+        encoders.append(('raw (pydantic_core)', raw_pydantic_core_path))
+
+    bodies = {}
+    for name, encode in encoders:
+        await encode()
+
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            body = await encode()
+        elapsed = (time.perf_counter() - start) / REPEAT
+
+        bodies[name] = json.loads(body)
+        print(f'{name:>20} | {ROWS} rows | {elapsed * 1e3:>8.2f} ms/page | {len(body):>8} bytes')
+
+    expected = bodies['response_model']
+    for name, body in bodies.items():
+        if body != expected:
+            print(f'WARNING: {name} response differs from the response_model one')
+
+
+def do():
+    asyncio.run(do_async())
+
+
+if __name__ == '__main__':
+    do()
@@ -0,0 +1,117 @@
+import asyncio
+import os
+import time
+
+import fakeredis
+import redis
+import redis.asyncio
+import ujson as json
+from base4.utilities.db.redis import AsyncRedisClientHandler, RedisClientHandler, redis_host
+
+REQUESTS = 200
+CONCURRENCY = 20
+TICK = 0.001
+
+# database used on a real Redis server, keys written by the benchmark are deleted afterwards
+BENCHMARK_DB = int(os.getenv('REDIS_BENCHMARK_DB', 15))
+KEY_PREFIX = 'benchmark:cache:'
+
+RESPONSE = {'items': [{'id': i, 'name': f'item {i}'} for i in range(50)]}
+
+
+def connect():
+    """
+    (name, sync client, async client) of the Redis server to benchmark against.
+
+    The local Redis server if it answers, so commands make real round-trips. Otherwise an in
+    process fakeredis server, which answers without any network I/O: the results then show the
+    client overhead only, not how long a cached GET blocks the event loop in production.
+    """
+    host, port = redis_host(), int(os.getenv('REDIS_PORT', 6379))
+    try:
+        redis.StrictRedis(host=host, port=port, db=BENCHMARK_DB, socket_connect_timeout=1).ping()
+    except redis.exceptions.ConnectionError:
+        server = fakeredis.FakeServer()
+        return 'fakeredis (no network)', fakeredis.FakeStrictRedis(server=server), fakeredis.FakeAsyncRedis(server=server)
+
+    pool = redis.asyncio.ConnectionPool(host=host, port=port, db=BENCHMARK_DB, max_connections=CONCURRENCY)
+    return f'redis {host}:{port}/{BENCHMARK_DB}', redis.StrictRedis(host=host, port=port, db=BENCHMARK_DB), redis.asyncio.StrictRedis(connection_pool=pool)
+
+
+async def sync_cached_get(handler: RedisClientHandler, key: str):
+    # the api decorator cache path before: blocking get / setex inside the async handler
+    cached = handler.redis_client.get(key)
+    if not cached:
+        handler.redis_client.setex(key, 60, json.dumps(RESPONSE))
+
+
+async def async_cached_get(handler: AsyncRedisClientHandler, key: str):
+    if await handler.get(key) is None:
+        await handler.setex(key, 60, RESPONSE)
+
+
+async def measure(cached_get, handler):
+    """Run REQUESTS cached GETs, CONCURRENCY at a time, while a ticker records how late the loop wakes it up."""
+    stalls = []
+    running = True
+
+    async def ticker():
+        while running:
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            stalls.append(time.perf_counter() - start - TICK)
+
+    tick_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def request(i):
+        async with semaphore:
+            await cached_get(handler, f'{KEY_PREFIX}GET/api/items?page={i % 20}')
+
+    start = time.perf_counter()
+    await asyncio.gather(*[request(i) for i in range(REQUESTS)])
+    elapsed = time.perf_counter() - start
+
+    running = False
+    await tick_task
+
+    return elapsed, max(stalls), sum(stalls)
+
+
+def clear(client):
+    keys = client.keys(f'{KEY_PREFIX}*')
+    if keys:
+        client.delete(*keys)
+
+
+def do():
+    server, sync_client, async_client = connect()
+
+    async def run():
+        try:
+            for name, cached_get, handler in (
+                ('sync', sync_cached_get, RedisClientHandler(sync_client)),
+                ('async', async_cached_get, AsyncRedisClientHandler(async_client)),
+            ):
+                # every run starts with the same misses
+                clear(sync_client)
+
+                elapsed, max_stall, total_stall = await measure(cached_get, handler)
+                print(
+                    f'{name:>6} | {server} | {REQUESTS} GETs, {CONCURRENCY} concurrent | '
+                    f'total: {elapsed * 1000:>7.1f}ms | max loop stall: {max_stall * 1000:>6.1f}ms | summed stall: {total_stall * 1000:>7.1f}ms'
+                )
+        finally:
+            await async_client.aclose()
+
+    try:
+        asyncio.run(run())
+    finally:
+        clear(sync_client)
+        sync_client.close()
+
+
+if __name__ == '__main__':
+    do()
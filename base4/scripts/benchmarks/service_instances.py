@@ -0,0 +1,70 @@
+import time
+
+from base4.api.crud import _services, get_service
+from base4.models.base import Base, BaseCache11, BaseCache1n
+from base4.service.base import BaseService, _cache_relations
+from tortoise import fields
+from tortoise.models import Model
+
+REQUESTS = 10_000
+EXTRA_COLUMNS = 60
+
+
+def mk_models():
+    # wide cache models, as generated for real services, so fields_map walks cost what they do there
+    columns = {f'column_{i}': fields.CharField(64, null=True) for i in range(EXTRA_COLUMNS)}
+
+    item = type('BenchItem', (Base, Model), {'__module__': __name__, 'Meta': type('Meta', (), {'table': 'bench_item', 'app': 'bench'})})
+    c11 = type(
+        'BenchItemC11',
+        (BaseCache11, Model),
+        {
+            '__module__': __name__,
+            'Meta': type('Meta', (), {'table': 'bench_item_c11', 'app': 'bench'}),
+            'item': fields.OneToOneField('bench.BenchItem', related_name='cache11'),
+            **columns,
+        },
+    )
+    c1n = type(
+        'BenchItemC1N',
+        (BaseCache1n, Model),
+        {
+            '__module__': __name__,
+            'Meta': type('Meta', (), {'table': 'bench_item_c1n', 'app': 'bench'}),
+            'item': fields.ForeignKeyField('bench.BenchItem', related_name='cache1n'),
+            **columns,
+        },
+    )
+    return item, c11, c1n
+
+
+def do():
+    item, c11, c1n = mk_models()
+
+    class BenchService(BaseService):
+        def __init__(self):
+            super().__init__(None, item, 'conn_bench', c11=c11, c1n=c1n)
+
+    for name, get in (
+        # per request construction, reflection cache cleared before every request as it was before
+        ('construct + reflect', lambda: (_cache_relations.clear(), BenchService())),
+        ('construct', lambda: BenchService()),
+        ('registry', lambda: get_service(BenchService)),
+    ):
+        _cache_relations.clear()
+        _services.clear()
+        BaseService.reflection_count = 0
+
+        start = time.perf_counter()
+        for _ in range(REQUESTS):
+            get()
+        elapsed = time.perf_counter() - start
+
+        print(
+            f'{name:>20} | {REQUESTS} requests | {elapsed / REQUESTS * 1e6:>8.2f} us/request | '
+            f'fields_map walks: {BaseService.reflection_count:>6} ({BaseService.reflection_count / REQUESTS:.4f}/request)'
+        )
+
+
+if __name__ == '__main__':
+    do()
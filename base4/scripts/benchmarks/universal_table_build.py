@@ -0,0 +1,72 @@
+import time
+from types import SimpleNamespace
+
+from base4.schemas.universal_table import UniversalTableGetRequest, UniversalTableResponseBaseSchema
+
+WIDTH = 40
+ROWS = 100
+PAGES = 200
+
+COLUMNS = [f'column_{i}' for i in range(WIDTH)]
+
+
+class WideItemSchema:
+    @staticmethod
+    def model_loc():
+        return {c: f'cache11.{c}' if i % 2 else c for i, c in enumerate(COLUMNS)}
+
+
+class WideProfileSchema(UniversalTableResponseBaseSchema):
+    @staticmethod
+    def order():
+        return COLUMNS
+
+
+def legacy_build(cls, model_item, item_schema, request: UniversalTableGetRequest):
+    # per-cell eval, as UniversalTableResponseBaseSchema.build used to do it
+    model_loc = item_schema.model_loc()
+
+    if request.response_format in ('objects', 'key-value'):
+        res = {}
+        for field in cls.order():
+            res[field] = eval(f'model_item.{model_loc[field]}')
+    else:
+        res = []
+        for field in cls.order():
+            res.append(eval(f'model_item.{model_loc[field]}'))
+
+    return res
+
+
+def mk_items():
+    items = []
+    for r in range(ROWS):
+        values = {c: f'{r}-{c}' for c in COLUMNS}
+        items.append(SimpleNamespace(cache11=SimpleNamespace(**values), **values))
+    return items
+
+
+def measure(build, items, request):
+    start = time.perf_counter()
+    for _ in range(PAGES):
+        for item in items:
+            build(item, WideItemSchema, request)
+    return ROWS * PAGES / (time.perf_counter() - start)
+
+
+def do():
+    items = mk_items()
+
+    for response_format in ('objects', 'key-value', 'table'):
+        request = UniversalTableGetRequest(response_format=response_format, key_value_response_format_key=COLUMNS[0])
+
+        assert legacy_build(WideProfileSchema, items[0], WideItemSchema, request) == WideProfileSchema.build(items[0], WideItemSchema, request)
+
+        before = measure(lambda item, schema, req: legacy_build(WideProfileSchema, item, schema, req), items, request)
+        after = measure(WideProfileSchema.build, items, request)
+
+        print(f'{response_format:>10} | {WIDTH} columns | eval: {before:>10.0f} rows/sec | compiled: {after:>10.0f} rows/sec | x{after / before:.1f}')
+
+
+if __name__ == '__main__':
+    do()
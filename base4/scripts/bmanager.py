@@ -36,6 +36,7 @@ def gen4svc(svc_name, location, gen=None):
         gen_model.save(
             project_root + f'/{location}/yaml_sources/{svc_name}_model.yaml',
             project_root + f'/{location}/models/generated_{svc_name}_model.py',
+            project_root + f'/{location}/yaml_sources/{svc_name}_table.yaml',
         )
     if 'schemas' in gen:
         gen_schemas.save(
@@ -2,9 +2,75 @@ import datetime
 import os
 
 import yaml
+from base4.scripts.gen_tables import is_indexed
+
+
+def gen_search_config(search):
+    """
+    Normalize the __search definition of a table into the search_config used by BaseServiceSearchUtils.
+
+    __search:
+        columns: [display_name, description]  # or {display_name: A, description: B}, listed columns get weights A, B, C, D
+        language: english                     # text search configuration, cache1n rows use the one of their language
+        languages: {sr: serbian}              # cache1n language -> configuration, added to the built-in ones
+        index: true                           # GIN index on search_vector (postgres)
+    """
+    columns = search['columns']
+    if not isinstance(columns, dict):
+        columns = {column: 'ABCD'[min(i, 3)] for i, column in enumerate(columns)}
+
+    config = {'columns': columns, 'language': search.get('language', 'simple')}
+    if 'languages' in search:
+        config['languages'] = search['languages']
+
+    return config
+
+
+def profile_sort_columns(tables_definition):
+    """
+    Columns ordered by in the universal table profiles, per model.
+
+    Returns:
+        {model name: set of order_map() targets of the sortable columns ('cache11__column' for cache columns)}
+    """
+    res = {}
+    for profile in (tables_definition or {}).get('profiles', {}).values():
+        columns = res.setdefault(profile['model'], set())
+        for column in profile['columns']:
+            name = list(column.keys())[0]
+            properties = column[name] or {}
+            if isinstance(properties, dict) and properties.get('sortable'):
+                columns.add(properties.get('order_by', name).replace('.', '__'))
+    return res
+
+
+def suggest_indexes(tbl, columns, ctable=False):
+    """
+    Composite indexes serving the list queries ordering tbl by columns.
+
+    get_all orders by the column and id (the tie-breaker), so (column, id) lets the database read a
+    page straight from the index. Base tables are ordered by created if no order_by is requested.
+    Cache tables are joined to the base table, a single column index is suggested there.
+    Columns which are indexed or lead a declared __meta.indexes entry are skipped.
+    """
+    declared = {index[0] for index in tbl.get('__meta', {}).get('indexes', [])}
 
+    columns = set(columns or ())
+    if not ctable:
+        columns.add('created')
+
+    res = []
+    for column in sorted(columns):
+        if '__' in column or column == 'id' or column in declared:
+            continue
+        if isinstance(tbl.get(column), dict) and is_indexed(tbl[column].get('field', '')):
+            continue
+        res.append((column,) if ctable else (column, 'id'))
+
+    return res
 
-def gen_model(tbl, tbl_name, ctable=False, parent_class_name='', parent_types=None):
+
+def gen_model(tbl, tbl_name, ctable=False, parent_class_name='', parent_types=None, sorted_columns=None):
     cls_name = tbl["__meta"].get("model_name")
     if not cls_name:
         cls_name = tbl_name.capitalize() if tbl_name.lower() == tbl_name else tbl_name
@@ -24,11 +90,26 @@ def gen_model(tbl, tbl_name, ctable=False, parent_class_name='', parent_types=No
         if 'unique_together' in tbl['__meta']:
             res += '\t\tunique_together = {}\n'.format(tbl['__meta']['unique_together'])
 
+        indexes = [repr(tuple(index)) for index in tbl['__meta'].get('indexes', [])]
+        if '__search' in tbl and tbl['__search'].get('index', True):
+            indexes.append('SearchVectorIndex(fields=("search_vector",))')
+        if indexes:
+            res += f'\t\tindexes = ({", ".join(indexes)},)\n'
+
+        suggested = suggest_indexes(tbl, sorted_columns, ctable)
+        if suggested:
+            print(f'SUGGESTION: {tbl["__meta"]["table_name"]}: add {suggested} to __meta.indexes for the sortable columns of the table profiles')
+            res += f'\t\t# suggested __meta.indexes for sorting: {suggested}\n'
+
         app_name = tbl['__meta']['app']
 
     if '__mk_cache_order' in tbl:
         res += f'\n\tmk_cache_order = {tbl["__mk_cache_order"]}\n'
 
+    if '__search' in tbl:
+        res += f'\n\tsearch_vector = TSVectorField(null=True)\n'
+        res += f'\tsearch_config = {gen_search_config(tbl["__search"])}\n'
+
     res += '\n'
 
     added_c_idx = set()
@@ -99,12 +180,9 @@ def gen_model(tbl, tbl_name, ctable=False, parent_class_name='', parent_types=No
     if mk_cache_rules:
         if '__mk_cache_order' in tbl:
             mk_cache_order = tbl['__mk_cache_order']
-            reordered = []
-            for f in mk_cache_order:
-                if f in mk_cache_rules:
-                    reordered.append(m)
+            reordered = [r for f in mk_cache_order for r in mk_cache_rules if r['column'] == f]
             if reordered:
-                mk_cache_rules = reordered
+                mk_cache_rules = reordered + [r for r in mk_cache_rules if r not in reordered]
 
     res += f'\n\tmk_cache_rules = {mk_cache_rules}\n\n'
 
@@ -128,15 +206,31 @@ def gen_model(tbl, tbl_name, ctable=False, parent_class_name='', parent_types=No
 
     for c in ('cache11', 'cache1n'):
         if f'__{c}' in tbl:
-            res += '\n' + gen_model(tbl[f'__{c}'], cls_name.capitalize() + f'C1{c[-1].upper()}', ctable=True, parent_class_name=cls_name, parent_types=types)
+            c_sorted_columns = {column[len(c) + 2 :] for column in sorted_columns or () if column.startswith(f'{c}__')}
+            res += '\n' + gen_model(
+                tbl[f'__{c}'],
+                cls_name.capitalize() + f'C1{c[-1].upper()}',
+                ctable=True,
+                parent_class_name=cls_name,
+                parent_types=types,
+                sorted_columns=c_sorted_columns,
+            )
 
     return res
 
 
-def gen_models(fname):
+def gen_models(fname, tables_fname=None):
     with open(fname, 'rt') as f:
         model_definition = yaml.safe_load(f)
 
+    # profiles of the tables yaml, used to suggest indexes for their sortable columns
+    tables_definition = None
+    if tables_fname and os.path.exists(tables_fname):
+        with open(tables_fname, 'rt') as f:
+            tables_definition = yaml.safe_load(f)
+
+    model_sorted_columns = profile_sort_columns(tables_definition)
+
     res = f'''# THIS IS AN AUTO-GENERATED AND PROTECTED FILE. PLEASE USE
 # THE gen_model.py SCRIPT TO GENERATE THIS FILE. DO NOT EDIT DIRECTLY
 # AS IT CAN BE OVERWRITTEN. 
@@ -146,6 +240,7 @@ def gen_models(fname):
 import tortoise
 from tortoise import fields
 from base4.models.base import *
+from base4.models.fields import SearchVectorIndex, TSVectorField
 from tortoise.models import Model
 from tortoise.fields import CASCADE, RESTRICT
 import datetime
@@ -153,13 +248,13 @@ import datetime
 '''
 
     for tbl_name in list(model_definition.keys()):
-        res += gen_model(model_definition[tbl_name], tbl_name)
+        res += gen_model(model_definition[tbl_name], tbl_name, sorted_columns=model_sorted_columns.get(tbl_name))
 
     return res
 
 
-def save(input_yaml, gen_fname):
-    res = gen_models(input_yaml)
+def save(input_yaml, gen_fname, tables_yaml=None):
+    res = gen_models(input_yaml, tables_yaml)
 
     os.system(f'rm -rf {gen_fname}')
 
@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+from base4.utilities.parsers import str2q
+
+
+def do():
+    """
+    Generate the standalone filter parser module, str2q.get_parser() uses it instead of building the parser with Lark.
+
+    The module has to be regenerated whenever the grammar in str2q.py changes.
+    """
+    target = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(str2q.__file__), 'str2q_standalone.py')
+
+    with tempfile.NamedTemporaryFile('wt', suffix='.lark', delete=False) as f:
+        f.write(str2q.grammar)
+        grammar_fname = f.name
+
+    try:
+        with open(target, 'w') as out:
+            subprocess.run([sys.executable, '-m', 'lark.tools.standalone', grammar_fname], stdout=out, check=True)
+    except subprocess.CalledProcessError:
+        # a partly written module would be imported by str2q.get_parser()
+        os.remove(target)
+        raise
+    finally:
+        os.remove(grammar_fname)
+
+    print(f'{target} generated')
+
+
+if __name__ == '__main__':
+    do()
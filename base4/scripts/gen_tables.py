@@ -4,6 +4,12 @@ import os
 import yaml
 
 
+def is_indexed(db_field_type):
+    """True if a column defined as db_field_type (tortoise field source) has an index of its own."""
+    db_field_type = db_field_type.replace(' ', '')
+    return any(x in db_field_type for x in ('index=True', 'unique=True', 'pk=True', 'ForeignKeyField', 'OneToOneField'))
+
+
 def gen_profile(table, profile_name, profile, model_definition):
     schema_name = f'{table.capitalize()}{profile_name.capitalize()}Schema'
 
@@ -23,12 +29,24 @@ def gen_profile(table, profile_name, profile, model_definition):
             model_columns[field] = _field
 
     get_fields(model_definition)
+    base_columns = set(model_columns)
+
     if '__cache11' in model_definition:
         get_fields(model_definition['__cache11'])
 
+    # columns of the cache11 table only, ordered by through the cache11 relation
+    cache11_columns = set(model_columns) - base_columns
+
     if '__cache1n' in model_definition:
         get_fields(model_definition['__cache1n'])
 
+    # leading columns of the composite indexes declared in __meta.indexes (see gen_model.py)
+    composite_indexed = set()
+    for definition in (model_definition, model_definition.get('__cache11', {}), model_definition.get('__cache1n', {})):
+        composite_indexed.update(index[0] for index in definition.get('__meta', {}).get('indexes', []))
+
+    columns_constant = f'{table.upper()}_{profile_name.upper()}_COLUMNS'
+
     res = f'class {schema_name}(UniversalTableResponseBaseSchema):\n'
 
     order = []
@@ -38,6 +56,7 @@ def gen_profile(table, profile_name, profile, model_definition):
     column2width = {}
     column2justify = {}
     column2title = {}
+    field_types = {}
 
     meta = {}
 
@@ -46,6 +65,16 @@ def gen_profile(table, profile_name, profile, model_definition):
         res += f'\tasync def post_get(svc, data, request, _request: Request):\n'
         res += f'\t\treturn await getattr(svc,\"{profile["__post_get"]}\")(data, request, _request)\n\n'
 
+    if '__strict_filters' in profile:
+        res += f'\n\t@staticmethod\n'
+        res += f'\tdef strict_filters():\n'
+        res += f'\t\treturn {bool(profile["__strict_filters"])}\n\n'
+
+    if '__count_mode' in profile:
+        res += f'\n\t@staticmethod\n'
+        res += f'\tdef count_mode():\n'
+        res += f'\t\treturn {repr(profile["__count_mode"])}\n\n'
+
     for _field in profile['columns']:
 
         _field_name = _field
@@ -67,11 +96,20 @@ def gen_profile(table, profile_name, profile, model_definition):
 
                 if 'order_by' in _field[field_name]:
                     order_map[field_name] = _field[field_name]['order_by']
+                elif field_name in cache11_columns:
+                    order_map[field_name] = f'cache11.{field_name}'
                 else:
                     order_map[field_name] = field_name
 
+                order_column = order_map[field_name].replace('.', '__').split('__')[-1]
+                if order_column != 'id' and order_column not in composite_indexed and not is_indexed(model_columns.get(order_column, '')):
+                    print(f'WARNING: {table}.{profile_name}: sortable column {field_name} is not indexed, see the index suggestions of gen_model.py')
+
             if 'filterable' in _field[field_name] and _field[field_name]['filterable']:
                 filterable.add(field_name)
+
+                if not is_indexed(db_field_type):
+                    print(f'WARNING: {table}.{profile_name}: filterable column {field_name} is not indexed')
             if 'widths' in _field[field_name]:
                 widths = _field[field_name]['widths']
 
@@ -94,6 +132,36 @@ def gen_profile(table, profile_name, profile, model_definition):
 
         res += f'\t{field_name} : {field_type}\n'
         order.append(field_name)
+        field_types[field_name] = field_type
+
+    filter_properties = {}
+    data_types = {}
+    for i in profile['columns']:
+        k = list(i.keys())[0]
+        if 'filterable' in i[k] and i[k]['filterable']:
+            filter_properties[k] = {'enabled': i[k]['filterable']} if isinstance(i[k]['filterable'], bool) else i[k]['filterable']
+        if 'type' in i[k] and i[k]['type']:
+            data_types[k] = i[k]['type']
+
+    # header columns are static for a profile, emitted once so they are not rebuilt per request
+    columns = tuple(
+        dict(
+            name=field_name,
+            field=field_name,
+            type=data_types.get(field_name) or field_types[field_name],
+            sortable=field_name in sortable,
+            filterable=filter_properties.get(field_name, False),
+            widths=column2width[field_name],
+            align_text=column2justify[field_name],
+            display_name=column2title[field_name],
+        )
+        for field_name in order
+    )
+    res = f'{columns_constant} = {columns!r}\n\n\n' + res
+
+    res += f'\n\t@staticmethod\n'
+    res += f'\tdef columns_definition():\n'
+    res += f'\t\treturn {columns_constant}\n\n'
 
     res += f'\n\t@staticmethod\n'
     res += f'\tdef order():\n'
@@ -116,25 +184,12 @@ def gen_profile(table, profile_name, profile, model_definition):
 
     res += f'\n\t@staticmethod\n'
     res += f'\tdef filter_properties(field:str):\n'
-    m = {}
-    for i in profile['columns']:
-        k = list(i.keys())[0]
-        if 'filterable' in i[k] and i[k]['filterable']:
-            if isinstance(i[k]['filterable'], bool):
-                m[k] = {'enabled': i[k]['filterable']}
-            else:
-                m[k] = i[k]['filterable']
-    res += f'\t\tm = {m}\n\n'
+    res += f'\t\tm = {filter_properties}\n\n'
     res += f'\t\treturn m.get(field,False)\n\n'
 
     res += f'\n\t@staticmethod\n'
     res += f'\tdef column_data_type(field:str):\n'
-    m = {}
-    for i in profile['columns']:
-        k = list(i.keys())[0]
-        if 'type' in i[k] and i[k]['type']:
-            m[k] = i[k]['type']
-    res += f'\t\tm = {m}\n\n'
+    res += f'\t\tm = {data_types}\n\n'
     res += f'\t\treturn m.get(field)\n\n'
 
     res += f'\n\t@staticmethod\n'
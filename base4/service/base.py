@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import importlib
 import uuid
@@ -11,12 +12,21 @@ from base4.debug import debug_info
 from base4.models.utils import find_field_in_q
 from base4.schemas.base import NOT_SET
 from base4.utilities.db.base import BaseServiceDbUtils
+from base4.utilities.common import split_list
+from base4.utilities.http.response import EXPORT_MEDIA_TYPES, RawJSONResponse, csv_lines, ndjson_lines, table_response
 from base4.utilities.logging.setup import class_exception_traceback_logging, get_logger
-from base4.utilities.parsers.str2q import transform_filter_param_to_Q
-from base4.utilities.service.base import BaseServiceUtils
+from base4.utilities.parsers.str2q import compile_filter
+from base4.utilities.service.base import BaseServiceUtils, response_cache
 from base4.utilities.service.base_pre_and_post import BaseServicePreAndPostUtils
+from base4.utilities.service.build_plan import build_prefetched, get_build_plan
+from base4.utilities.service.metrics import BaseServiceMetricsUtils
+from base4.utilities.service.mk_cache import BaseServiceMkCacheUtils
+from base4.utilities.service.pagination import BaseServicePaginationUtils
+from base4.utilities.service.response_cache import ResponseCache
+from base4.utilities.service.search import SEARCH_RANK_ANNOTATION, BaseServiceSearchUtils
 from base4.utilities.ws import emit, sio_client_manager
 from fastapi import HTTPException, Response
+from fastapi.responses import StreamingResponse
 from fastapi.requests import Request
 from tortoise.queryset import Q
 from tortoise.transactions import in_transaction
@@ -32,9 +42,39 @@ logger = get_logger()
 
 sio_connection = sio_client_manager(write_only=True)
 
+# columns ordered by through the cache11 relation when a profile maps them to themselves
+CACHE11_ORDER_COLUMNS = ('sla_deadline_for_open', 'sla_deadline_for_resolve')
+
+# (c11, c1n) -> (c11_related_to, c1n_related_to), see BaseService.cache_relations
+_cache_relations: Dict[tuple, tuple] = {}
 
 
 class BaseService[ModelType]:
+    """
+    CRUD, listing and caching of a model, shared by all requests (see base4.api.crud.get_service).
+
+    Attributes are set in __init__ only, per request state is passed as arguments and return values.
+    """
+
+    # seconds, None means no limit; a mk_cache rule can override it with its own 'timeout' key
+    mk_cache_rule_timeout = None
+
+    # create_many: rows per bulk insert and hooks / cache rules evaluated at once
+    bulk_batch_size = 500
+    bulk_concurrency = 16
+
+    # number of times cache model relations were looked up in fields_map, see cache_relations
+    reflection_count = 0
+
+    # unique ids reserved ahead in Redis per service, 0 disables the pool (see BaseServiceUidUtils.allocate)
+    uid_redis_pool_size = 0
+    uid_redis_reservation_ttl = 3600
+
+    # rows read, built and sent at once by export (ndjson / csv response_format)
+    export_chunk_size = 1000
+
+    # get_all / export: rows whose post_process_method runs concurrently
+    build_concurrency = 16
 
     def __init__(
         self,
@@ -57,6 +97,32 @@ class BaseService[ModelType]:
         self.conn_name = conn_name
         self.sio_connection = sio_connection
 
+        self.base_table_name = self.model.Meta.table
+
+        self.c11_related_to, self.c1n_related_to = BaseService.cache_relations(self.c11, self.c1n)
+
+        # relations fetched together with the items by get_all
+        self.prefetch_related = [name for name, model in (('cache11', self.c11), ('cache1n', self.c1n)) if model]
+
+        ...
+
+    ...
+
+    @staticmethod
+    def cache_relations(c11: Type[C11Type], c1n: Type[C1NType]) -> tuple[str | None, str | None]:
+        """
+        Names of the fields relating the c11 and c1n cache models to the base model.
+
+        fields_map of the cache models is walked once per (c11, c1n) pair, further services
+        using the same cache models reuse the result.
+        """
+        try:
+            return _cache_relations[(c11, c1n)]
+        except KeyError:
+            pass
+
+        BaseService.reflection_count += 1
+
         # type(field), type(field) == field_type),
         def find_field_types(_model, field_type, related_name):
             return [
@@ -65,50 +131,60 @@ class BaseService[ModelType]:
                 if isinstance(field, field_type) and getattr(field, 'related_name', None) == related_name
             ]
 
-        self.c11_related_to = None
-        self.c1n_related_to = None
-
-        self.base_table_name = self.model.Meta.table
+        c11_related_to = None
+        c1n_related_to = None
 
         try:
-            if self.c11:
-                one_to_one_fields = find_field_types(self.c11, tortoise.fields.relational.OneToOneFieldInstance, 'cache11')
+            if c11:
+                one_to_one_fields = find_field_types(c11, tortoise.fields.relational.OneToOneFieldInstance, 'cache11')
 
                 if len(one_to_one_fields) != 1:
-                    raise Exception(f"Expected exactly one OneToOneField in {self.c11.__name__} model.")
+                    raise Exception(f"Expected exactly one OneToOneField in {c11.__name__} model.")
 
-                self.c11_related_to = one_to_one_fields[0]
+                c11_related_to = one_to_one_fields[0]
 
-            if self.c1n:
-                many_to_many_fields = find_field_types(self.c1n, tortoise.fields.relational.ManyToManyFieldInstance, 'cache1n')
+            if c1n:
+                many_to_many_fields = find_field_types(c1n, tortoise.fields.relational.ManyToManyFieldInstance, 'cache1n')
                 if not many_to_many_fields:
-                    many_to_many_fields = find_field_types(self.c1n, tortoise.fields.relational.ForeignKeyFieldInstance, 'cache1n')
+                    many_to_many_fields = find_field_types(c1n, tortoise.fields.relational.ForeignKeyFieldInstance, 'cache1n')
 
                 if len(many_to_many_fields) != 1:
-                    raise Exception(f"Expected exactly one ManyToManyField in {self.c1n.__name__} model.")
+                    raise Exception(f"Expected exactly one ManyToManyField in {c1n.__name__} model.")
 
-                self.c1n_related_to = many_to_many_fields[0]
+                c1n_related_to = many_to_many_fields[0]
 
         except Exception as e:
             print(e)
             raise
 
-        ...
-
-    ...
+        _cache_relations[(c11, c1n)] = (c11_related_to, c1n_related_to)
+        return c11_related_to, c1n_related_to
 
+    @BaseServiceMetricsUtils.timed('get_all')
     async def get_all(
-        self, request: UniversalTableGetRequest, profile_schema: pydantic.BaseModel, _request: Request, post_process_method=None
-    ) -> List | Dict | UniversalTableResponse:
+        self,
+        request: UniversalTableGetRequest,
+        profile_schema: pydantic.BaseModel,
+        _request: Request,
+        post_process_method=None,
+        raw_response: bool = False,
+        post_process_many=None,
+    ) -> List | Dict | UniversalTableResponse | RawJSONResponse | StreamingResponse:
         """
         Get all items from the table
         :param request: UniversalTableGetRequest object with parameters for filtering, sorting, pagination and response format
         :param profile_schema: Schema for the response format
+        :param post_process_method: awaited with each item before its row is built, up to build_concurrency items at once
+        :param post_process_many: awaited once with all items of the page before the rows are built
+        :param raw_response: return the result as a RawJSONResponse encoded directly from the built rows
         :return: List of items or UniversalTableResponse object
         """
 
         # Basic error handling
 
+        if request.response_format in universal_table.EXPORT_FORMATS:
+            return await self.export(request, profile_schema, _request, post_process_method=post_process_method, post_process_many=post_process_many)
+
         # TODO: Vrati table kad budes sredio metu
 
         request.response_format = 'objects'
@@ -131,18 +207,148 @@ class BaseService[ModelType]:
                 status_code=400, detail={"code": "INVALID_PARAMETER", "message": "parameter only_data can be used only with objects response_format"}
             )
 
+        try:
+            count_mode = BaseServicePaginationUtils.resolve_count_mode(request, profile_schema)
+        except NameError as e:
+            raise HTTPException(status_code=400, detail={"code": "INVALID_PARAMETER", "parameter": "count_mode", "message": str(e)})
+
+        if request.after and request.before:
+            raise HTTPException(status_code=400, detail={"code": "INVALID_PARAMETER", "parameter": "before", "message": "after and before can not be used together"})
+
+        cursor_mode = BaseServicePaginationUtils.is_cursor_mode(request)
+
+        # window counts only what is past the cursor, so count the filtered query instead
+        if cursor_mode and count_mode == 'window':
+            count_mode = 'exact'
+
         # setup prefetch_related if needed
 
-        prefetch_related = []
-        if self.c11:
-            prefetch_related.append('cache11')
-        if self.c1n:
-            prefetch_related.append('cache1n')
+        prefetch_related = self.prefetch_related
 
         # calculate offset based on page and per_page
 
         offset = (request.page - 1) * request.per_page
 
+        with BaseServiceMetricsUtils.phase('filters'):
+            filters = await self.build_filters(request, profile_schema)
+
+        try:
+            # build query
+
+            query = self.model
+            query = query.filter(filters) if filters else query.filter()
+            query = query.prefetch_related(*prefetch_related)
+
+            # full-text search over the search_config tables (cache1n rows in search_language), ranked on postgres
+
+            ranked = False
+            if request.search:
+                query, ranked = BaseServiceSearchUtils.apply(self, query, request.search, request.search_language)
+
+            # save this state without offset and limit for counting total items if header is requested
+            cquery = query
+
+            order_by = self.resolve_order_by(request, profile_schema, ranked=ranked and not cursor_mode)
+
+            query = BaseServicePaginationUtils.apply_count_mode(query, count_mode)
+
+            if cursor_mode:
+                # seek past the cursor instead of skipping rows, offset is not used
+                try:
+                    query, backward = BaseServicePaginationUtils.apply_keyset(query, request, order_by)
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail={"code": "INVALID_PARAMETER", "parameter": "after" if request.after else "before", "message": str(e)})
+                query = query.limit(BaseServicePaginationUtils.page_limit(request.per_page, count_mode, cursor_mode))
+            else:
+                # apply offset and limit, id keeps rows with equal order_by values in the same order on every page
+                query = query.order_by(*BaseServicePaginationUtils.ordering(order_by))
+                query = query.offset(offset).limit(BaseServicePaginationUtils.page_limit(request.per_page, count_mode))
+
+            with BaseServiceMetricsUtils.phase('query') as span:
+                items = await query.all()
+                span.add_rows(len(items))
+
+            has_next = None
+            next_cursor, previous_cursor = None, None
+            if cursor_mode:
+                items, has_more = BaseServicePaginationUtils.split_page(items, request.per_page)
+                if backward:
+                    items.reverse()
+                next_cursor, previous_cursor = BaseServicePaginationUtils.cursors(
+                    items, order_by, has_more=has_more, backward=backward, from_cursor=bool(request.after or request.before)
+                )
+                has_next = next_cursor is not None
+            elif count_mode == 'none':
+                items, has_next = BaseServicePaginationUtils.split_page(items, request.per_page)
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail={"code": "INTERNAL_SERVER_ERROR", "debug": debug_info(str(e)), "message": "Internal server error."})
+
+        # extract window of items in response format
+
+        try:
+            with BaseServiceMetricsUtils.phase('build'):
+                _data = await self.build_rows(items, profile_schema, request, post_process_method=post_process_method, post_process_many=post_process_many)
+        except Exception as e:
+            raise
+
+        # if only_data is requested, return only data
+
+        if hasattr(profile_schema, 'post_get'):
+            try:
+                with BaseServiceMetricsUtils.phase('post_get'):
+                    _data = await profile_schema.post_get(svc=self, data=_data, request=request, _request=_request)
+            except Exception as e:
+                raise
+
+        if request.only_data:
+            return RawJSONResponse(_data) if raw_response else _data
+
+        # calculate total items count and total pages
+
+        with BaseServiceMetricsUtils.phase('count'):
+            count = await BaseServicePaginationUtils.count(cquery, items, count_mode, offset)
+
+        if has_next is None and count is not None:
+            has_next = offset + len(items) < count
+
+        summary = universal_table.Summary(
+            count=count,
+            page=request.page,
+            per_page=request.per_page,
+            total_pages=BaseServicePaginationUtils.total_pages(count, request.per_page),
+            has_next=has_next,
+            next_cursor=next_cursor,
+            previous_cursor=previous_cursor,
+            count_mode=count_mode,
+        )
+
+        if request.response_format == 'key-value':
+            try:
+                _data = {str(item[request.key_value_response_format_key]): item for item in _data}
+            except Exception as e:
+                raise
+            return RawJSONResponse(_data) if raw_response else _data
+
+        with BaseServiceMetricsUtils.phase('response'):
+            if raw_response:
+                return table_response(_data, profile_schema.header_json(summary, response_format=request.response_format))
+
+            _header = profile_schema.header(request, summary, response_format=request.response_format)
+
+            return UniversalTableResponse(data=_data, header=_header)
+
+    async def build_filters(self, request: UniversalTableGetRequest, profile_schema: pydantic.BaseModel) -> Q:
+        """
+        Q selecting the items listed for request: the filters string (checked against the profile),
+        is_deleted=False unless filtered on, specific_table_filtering and is_valid=True.
+
+        Raises:
+            HTTPException: 400 if the filters are invalid or not allowed by the profile
+        """
+
         # setup filters if filters are requested
 
         filters = None
@@ -150,19 +356,27 @@ class BaseService[ModelType]:
             try:
                 # convert filters string to Q object
 
-                filters = transform_filter_param_to_Q(request.filters)
+                compiled_filter = compile_filter(request.filters)
             except Exception as e:
                 raise HTTPException(
                     status_code=400, detail={"code": "INVALID_PARAMETER", "parameter": "filters", "message": f"Invalid filter parameters {request.filters}"}
                 )
 
+            # only columns the profile allows can be filtered with operators / dotted paths (any lookup with strict_filters)
+
+            try:
+                compiled_filter.check(profile_schema, strict=profile_schema.strict_filters() if hasattr(profile_schema, 'strict_filters') else False)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail={"code": "INVALID_PARAMETER", "parameter": "filters", "message": str(e)})
+
+            filters = compiled_filter.as_q()
+
         # if deleted not presented in filters, add it as deleted=False
 
         if not filters:
             # TODO: Tenant
             filters = Q(is_deleted=False)
         else:
-            filters = eval(filters)
             d = find_field_in_q(filters, 'is_deleted')
             if not d:
                 filters &= Q(is_deleted=False)
@@ -179,190 +393,158 @@ class BaseService[ModelType]:
 
         filters &= Q(is_valid=True)
 
-        #
-
-        if request.search:
+        return filters
 
-            # if there is search file in c1n - force it with specific language
-            # TODO:...
+    @staticmethod
+    def resolve_order_by(request: UniversalTableGetRequest, profile_schema: pydantic.BaseModel = None, ranked: bool = False) -> str:
+        """
+        Column the listed items are ordered by, prefixed with '-' for descending order.
 
-            # if there is search file in c11 - foree it
-            # TODO:...
+        A requested order_by has to be sortable() in the profile and is mapped to the column to
+        order by with order_map(). CACHE11_ORDER_COLUMNS which are not mapped to a relation are
+        ordered by through cache11, as they always were. Without order_by items are ordered by
+        search rank if ranked, by created otherwise. id is added as the tie-breaker by BaseServicePaginationUtils.ordering.
 
-            # if there is search_term file in base table - use it
-            # TODO:...
+        Raises:
+            HTTPException: 400 if the profile does not allow ordering by the requested column
+        """
 
-            # if noone of above, use default search
-            # check if there is display_name and use it
+        if not request.order_by:
+            return f'-{SEARCH_RANK_ANNOTATION}' if ranked else 'created'
 
-            if 'display_name' in self.model._meta.fields_map.keys():
-                filters &= Q(display_name__icontains=request.search)
+        field, descending = BaseServicePaginationUtils.split_order_by(request.order_by)
+        prefix = '-' if descending else ''
 
-        try:
-            # build query
+        # profiles not generated by gen_tables have no sortable columns declared
+        if hasattr(profile_schema, 'sortable'):
+            if not profile_schema.sortable(field):
+                raise HTTPException(status_code=400, detail={"code": "INVALID_PARAMETER", "parameter": "order_by", "message": f"Ordering by {field} is not allowed"})
 
-            query = self.model
-            query = query.filter(filters) if filters else query.filter()
-            query = query.prefetch_related(*prefetch_related)
+            order_map = profile_schema.order_map() if hasattr(profile_schema, 'order_map') else {}
+            field = order_map.get(field, field).replace('.', '__')
 
-            # save this state without offset and limit for counting total items if header is requested
-            cquery = query
+        # profiles generated before gen_tables mapped cache11 columns to cache11.<column> map them to themselves
+        if field in CACHE11_ORDER_COLUMNS:
+            field = f'cache11__{field}'
 
-            if request.order_by:
+        return prefix + field
 
-                # TODO: Ovde nekako doci do profila i onda irkosiriti order_by metod da dobijemo koji je
+    async def build_row(self, item: ModelType, profile_schema: pydantic.BaseModel, request: UniversalTableGetRequest, post_process_method=None):
+        """Build the profile row of item, with the meta columns of the profile."""
+        if post_process_method:
+            await post_process_method(item)
+        res = profile_schema.build(item, self.schema, request)
 
-                order_by = request.order_by
+        if profile_schema.meta():
+            meta = {}
+            for key in profile_schema.meta()['__meta']:
+                meta[key] = eval(profile_schema.meta()['__meta'][key])
+            res['meta'] = meta
+            # res['meta'] = {'id': item.id, 'link': {'url': f'/admin/ticket/v2/{item.id}'}}
 
-                # FIX - za sada
+        return res
 
-                minus = False
-                if '-' in order_by:
-                    minus = True
-                    order_by = order_by[1:]
+    async def build_rows(
+        self, items: List[ModelType], profile_schema: pydantic.BaseModel, request: UniversalTableGetRequest, post_process_method=None, post_process_many=None
+    ) -> List:
+        """
+        Build the profile rows of items, in order.
 
-                if order_by in ('sla_deadline_for_open', 'sla_deadline_for_resolve'):
-                    order_by = f'cache11__{order_by}'
+        post_process_many enriches all items at once (e.g. with one query for the page). Items are
+        then post processed with post_process_method and built concurrently, at most build_concurrency
+        at a time, so I/O in post_process_method overlaps instead of running item after item.
+        """
+        if post_process_many:
+            await post_process_many(items)
 
-                if minus:
-                    order_by = f'-{order_by}'
+        if not post_process_method:
+            # nothing to wait for, building in order is cheaper than scheduling a task per row
+            return [await self.build_row(item, profile_schema, request) for item in items]
 
-                query = query.order_by(order_by)
-            else:
-                query = query.order_by('created')
-            # apply offset and limit
-            query = query.offset(offset).limit(request.per_page)
+        semaphore = asyncio.Semaphore(self.build_concurrency)
 
-            items = await query.all()
+        async def build(item):
+            async with semaphore:
+                return await self.build_row(item, profile_schema, request, post_process_method=post_process_method)
 
-        except Exception as e:
-            raise HTTPException(status_code=500, detail={"code": "INTERNAL_SERVER_ERROR", "debug": debug_info(str(e)), "message": "Internal server error."})
+        return list(await asyncio.gather(*[build(item) for item in items]))
 
-        # extract window of items in response format
+    async def export(
+        self, request: UniversalTableGetRequest, profile_schema: pydantic.BaseModel, _request: Request, post_process_method=None, post_process_many=None
+    ) -> StreamingResponse:
+        """
+        Stream all items matched by request as NDJSON or CSV (request.response_format).
 
-        async def ps_build(item, post_process_method=None):
-            if post_process_method:
-                await post_process_method(item)
-            res = profile_schema.build(item, self.schema, request)
+        Filters, specific_table_filtering, search and order_by are applied as in get_all, page and
+        per_page are ignored. Items are read in keyset chunks of export_chunk_size rows, each chunk
+        is built with the profile schema, encoded and sent before the next one is read.
+        """
+        response_format = request.response_format
 
-            if profile_schema.meta():
-                meta = {}
-                for key in profile_schema.meta()['__meta']:
-                    meta[key] = eval(profile_schema.meta()['__meta'][key])
-                res['meta'] = meta
-                # res['meta'] = {'id': item.id, 'link': {'url': f'/admin/ticket/v2/{item.id}'}}
+        filters = await self.build_filters(request, profile_schema)
 
-            return res
+        query = self.model.filter(filters).prefetch_related(*self.prefetch_related)
+        if request.search:
+            # rank can not be seeked past, matches are exported in order_by / created order
+            query, _ = BaseServiceSearchUtils.apply(self, query, request.search, request.search_language)
 
-        try:
-            _data = [await ps_build(item=item, post_process_method=post_process_method) for item in items]
-        except Exception as e:
-            raise
+        order_by = self.resolve_order_by(request, profile_schema)
 
-        # if only_data is requested, return only data
+        # rows are built as objects, csv takes the values of the profile columns
+        row_request = request.model_copy(update={'response_format': 'objects'})
+        columns = profile_schema.order()
 
-        if hasattr(profile_schema, 'post_get'):
-            try:
-                _data = await profile_schema.post_get(svc=self, data=_data, request=request, _request=_request)
-            except Exception as e:
-                raise
+        async def stream():
+            if response_format == 'csv':
+                yield csv_lines([columns])
 
-        if request.only_data:
-            return _data
+            async for items in BaseServicePaginationUtils.chunks(query, order_by, self.export_chunk_size):
+                rows = await self.build_rows(items, profile_schema, row_request, post_process_method=post_process_method, post_process_many=post_process_many)
 
-        # calculate total items count and total pages
+                if hasattr(profile_schema, 'post_get'):
+                    rows = await profile_schema.post_get(svc=self, data=rows, request=row_request, _request=_request)
 
-        count = await cquery.count()
+                if response_format == 'csv':
+                    yield csv_lines([[row.get(column) for column in columns] for row in rows])
+                else:
+                    yield ndjson_lines(rows)
 
-        summary = universal_table.Summary(
-            count=count,
-            page=request.page,
-            per_page=request.per_page,
-            total_pages=(await cquery.count() + request.per_page - 1) // request.per_page,
+        return StreamingResponse(
+            stream(),
+            media_type=EXPORT_MEDIA_TYPES[response_format],
+            headers={'Content-Disposition': f'attachment; filename="{self.base_table_name}.{response_format}"'},
         )
 
-        if request.response_format == 'key-value':
-            try:
-                return {str(item[request.key_value_response_format_key]): item for item in _data}
-            except Exception as e:
-                raise
-
-        _header = profile_schema.header(request, summary, response_format=request.response_format)
-
-        return UniversalTableResponse(data=_data, header=_header)
-
     @staticmethod
     async def _build(model, item):
         """
-        Recursive build dict from model and item
+        Build dict from model and item
 
+        All relations needed by the schema (including nested lists) are fetched with a single
+        fetch_related call, following the plan computed once per schema class.
         """
 
-        model_loc = {}
-        try:
-            schema_class_loc = model.schema_class_loc()
-
-            if hasattr(model, 'model_loc'):
-                model_loc = model.model_loc()
-
-        except Exception as e:
-            raise
-
-        res = {}
-
-        for field in model.model_fields:
+        plan = get_build_plan(model)
+        if plan.prefetch:
+            await item.fetch_related(*plan.prefetch)
 
-            if field in schema_class_loc:
-                cls = schema_class_loc[field]
+        return build_prefetched(model, item)
 
-                if get_origin(cls) == list:
-                    res[field] = []
-                    try:
-                        await item.fetch_related(field)
-                    except Exception as e:
-                        raise
-
-                    for _item in eval(f'item.{model_loc[field]}'):
-                        try:
-                            res[field].append(await BaseService._build(cls.__args__[0], _item))
-                        except Exception as e:
-                            raise
+    @staticmethod
+    async def build_many(model, items: List[Any]) -> List[Dict[str, Any]]:
+        """
+        Build dicts for many items with a fixed number of queries, one per relation in the plan,
+        regardless of the number of items.
+        """
 
-                elif cls not in (str, bool, int, float, uuid.UUID, dict, datetime.date, datetime.datetime):
-                    try:
-                        if not BaseServiceUtils.has_attribute(item, model_loc[field]):
-                            continue
-                        try:
-                            pl = await BaseService._build(cls, item)
-                        except Exception as e:
-                            raise e
-                        if set(pl.values()) == {None}:  # ako su svi None, preskoci
-                            continue
-
-                        res[field] = cls(**pl)
-                    except Exception as e:
-                        raise
+        plan = get_build_plan(model)
+        if items and plan.prefetch:
+            await type(items[0]).fetch_for_list(items, *plan.prefetch)
 
-                else:
-                    # primitivan tip, uzima se direktno iz itema
-                    if field in model_loc:
-                        if not BaseServiceUtils.has_attribute(item, model_loc[field]):
-                            continue
-                        try:
-                            res[field] = eval(f'item.{model_loc[field]}')
-                        except Exception as e:
-                            raise
-                    else:
-                        raise
-
-        return res
+        return [build_prefetched(model, item) for item in items]
 
     async def get_single_model(self, item_id, request: Request) -> ModelType:
-        prefetch_related = []
-        if self.c11:
-            prefetch_related.append('cache11')
-        if self.c1n:
-            prefetch_related.append('cache1n')
+        prefetch_related = self.prefetch_related
 
         item = await self.model.filter(id=item_id, is_deleted=False).prefetch_related(*prefetch_related).get_or_none()
 
@@ -382,6 +564,7 @@ class BaseService[ModelType]:
 
         return res
 
+    @BaseServiceMetricsUtils.timed('get_single')
     async def get_single(self, item_id: uuid.UUID, request: Request) -> SchemaType:
         """
         Get single item from the table
@@ -389,17 +572,20 @@ class BaseService[ModelType]:
         """
 
         try:
-            item = await self.get_single_model(item_id, request)
+            with BaseServiceMetricsUtils.phase('query'):
+                item = await self.get_single_model(item_id, request)
         except Exception as e:
             raise
 
         if hasattr(self.schema, 'post_get'):
             try:
-                await self.schema.post_get(svc=self, item=item, request=request)
+                with BaseServiceMetricsUtils.phase('post_get'):
+                    await self.schema.post_get(svc=self, item=item, request=request)
             except Exception as e:
                 raise
 
-        return await self.mk_single_model(item)
+        with BaseServiceMetricsUtils.phase('build'):
+            return await self.mk_single_model(item)
 
     async def get_single_and_extract_field(self, item_id: uuid.UUID, field: str, request: Request):
         """
@@ -448,6 +634,7 @@ class BaseService[ModelType]:
 
             return await self.update(logged_user_id, item.id, payload, request, return_db_item=True)
 
+    @BaseServiceMetricsUtils.timed('create')
     async def create(
         self,
         logged_user_id: uuid.UUID,
@@ -494,19 +681,27 @@ class BaseService[ModelType]:
 
         m2m_relations = {}
 
-        await BaseServicePreAndPostUtils.create_pre_save_hook(service_instance=self, payload=payload, request=request, body=body)
+        with BaseServiceMetricsUtils.phase('pre_save'):
+            await BaseServicePreAndPostUtils.create_pre_save_hook(service_instance=self, payload=payload, request=request, body=body)
 
         try:
-            item = await BaseServiceDbUtils.db_operations(
-                base_service_instance=self, request=request, body=body, payload=payload, logged_user_id=logged_user_id, m2m_relations=m2m_relations, _conn=conn
-            )
+            with BaseServiceMetricsUtils.phase('save'):
+                item = await BaseServiceDbUtils.db_operations(
+                    base_service_instance=self, request=request, body=body, payload=payload, logged_user_id=logged_user_id, m2m_relations=m2m_relations, _conn=conn
+                )
         except Exception as e:
             raise
 
-        post_commit_result = await BaseServicePreAndPostUtils.create_post_save_hook(service_instance=self, payload=payload, request=request, item=item)
+        with BaseServiceMetricsUtils.phase('search'):
+            await BaseServiceSearchUtils.refresh(self, [item.id], conn)
+
+        with BaseServiceMetricsUtils.phase('post_save'):
+            post_commit_result = await BaseServicePreAndPostUtils.create_post_save_hook(service_instance=self, payload=payload, request=request, item=item)
 
         await self.validate(logged_user_id, item.id, request, quiet=True)
 
+        await self.invalidate_responses([item.id])
+
         await self.create_activity_log(item=item, handler=request)
 
         if return_db_object:
@@ -521,6 +716,106 @@ class BaseService[ModelType]:
 
         return res
 
+    @BaseServiceMetricsUtils.timed('create_many')
+    async def create_many(self, logged_user_id: uuid.UUID, payloads: List[SchemaType], request: Request) -> List[Dict[str, Any]]:
+        """
+        Create many items at once
+
+        Unique ids are allocated for the whole batch, base, cache11 and cache1n rows are inserted
+        with bulk_create inside one transaction and hooks run concurrently in batches of
+        bulk_concurrency. As create, the created items are re-read and built with the service
+        schema, in batches of bulk_batch_size through build_many (a fixed number of queries per batch),
+        errors building them are raised.
+
+        :return: list of created items ({'id': ..., 'action': 'created'} for items deleted before they are re-read) in payload order,
+                 extended with post_commit results
+        """
+
+        if not payloads:
+            return []
+
+        for payload in payloads:
+            BaseServiceUtils.update_payload_with_user_data(payload, logged_user_id)
+
+        ids = await BaseServiceUtils.update_payloads_with_ids(base_service_instance=self, payloads=payloads)
+
+        bodies = []
+        for _id, payload in zip(ids, payloads):
+            body = {
+                'id': _id,
+                'created_by': payload.created_by,
+                'last_updated_by': payload.last_updated_by,
+            }
+            BaseServiceUtils.update_body_with_timestamps(payload, body)
+            bodies.append(body)
+
+        for batch in split_list(list(zip(payloads, bodies)), self.bulk_concurrency):
+            await asyncio.gather(
+                *[BaseServicePreAndPostUtils.create_pre_save_hook(service_instance=self, payload=payload, request=request, body=body) for payload, body in batch]
+            )
+
+        async with in_transaction(self.conn_name) as conn:
+            items = await BaseServiceDbUtils.bulk_db_operations(
+                base_service_instance=self,
+                request=request,
+                bodies=bodies,
+                payloads=payloads,
+                logged_user_id=logged_user_id,
+                _conn=conn,
+                batch_size=self.bulk_batch_size,
+            )
+
+            for batch in split_list(items, self.bulk_batch_size):
+                await BaseServiceSearchUtils.refresh(self, [item.id for item in batch], conn)
+
+        post_commit_results = []
+        for batch in split_list(list(zip(payloads, items)), self.bulk_concurrency):
+            post_commit_results += await asyncio.gather(
+                *[BaseServicePreAndPostUtils.create_post_save_hook(service_instance=self, payload=payload, request=request, item=item) for payload, item in batch]
+            )
+
+        # default validate only flags the item as valid, that can be done for many items at once
+        if type(self).validate is BaseService.validate:
+            for batch in split_list(items, self.bulk_batch_size):
+                await self.model.filter(id__in=[item.id for item in batch]).update(is_valid=True)
+        else:
+            for batch in split_list(items, self.bulk_concurrency):
+                await asyncio.gather(*[self.validate(logged_user_id, item.id, request, quiet=True) for item in batch])
+
+        await self.invalidate_responses([item.id for item in items])
+
+        for batch in split_list(items, self.bulk_concurrency):
+            await asyncio.gather(*[self.create_activity_log(item=item, handler=request) for item in batch])
+
+        built = {}
+        for batch in split_list(items, self.bulk_batch_size):
+            created = await self.model.filter(id__in=[item.id for item in batch], is_deleted=False).prefetch_related(*self.prefetch_related)
+            for obj, pl in zip(created, await BaseService.build_many(self.schema, created)):
+                built[obj.id] = self.schema(**pl).model_dump()
+
+        res = []
+        for item, post_commit_result in zip(items, post_commit_results):
+            r = built.get(item.id, {'id': item.id})
+            r['action'] = 'created'
+            if post_commit_result and isinstance(post_commit_result, dict):
+                r.update(post_commit_result)
+            res.append(r)
+
+        return res
+
+    async def invalidate_responses(self, ids: List[uuid.UUID]):
+        """
+        Drop cached api responses tagged with this service's table or with one of the items (see ResponseCache).
+        Nothing to do for tables without cached responses (see ResponseCache.track).
+        """
+        if not response_cache.tracks(self.base_table_name):
+            return
+        await response_cache.invalidate(ResponseCache.table_tags(self.base_table_name, ids))
+
+    async def uid_saturation(self) -> Dict[str, Any]:
+        """how much of the unique id space configured for this service is already used"""
+        return await self.model.unique_id_saturation(prefix=self.uid_prefix, alphabet=self.uid_alphabet, total_length=self.uid_total_length)
+
     async def create_activity_log(self, item: ModelType, handler: Request):
         """this method should create an activity log, and should be overridden in child classes to customize behavior"""
 
@@ -537,6 +832,7 @@ class BaseService[ModelType]:
             "last_updated_by_display_name": item.last_updated_by_display_name,
         }
 
+    @BaseServiceMetricsUtils.timed('validate')
     async def validate(
         self,
         logged_user_id: uuid.UUID,
@@ -573,17 +869,21 @@ class BaseService[ModelType]:
         res = await self.update(logged_user_id, existing.id, payload, request)
         return res
 
+    @BaseServiceMetricsUtils.timed('update')
     async def update(self, logged_user_id: uuid.UUID, item_id: uuid.UUID, payload: SchemaType, request: Request, return_db_item=False):
 
-        model_item = await self.get_single_model(item_id, request)
+        with BaseServiceMetricsUtils.phase('query'):
+            model_item = await self.get_single_model(item_id, request)
 
-        schem_item = await self.mk_single_model(model_item)
+        with BaseServiceMetricsUtils.phase('build'):
+            schem_item = await self.mk_single_model(model_item)
 
         model_loc = self.schema.model_loc()
 
         payload.last_updated_by = logged_user_id
 
-        await BaseServicePreAndPostUtils.update_pre_save_hook(service_instance=self, payload=payload, request=request, item=model_item)
+        with BaseServiceMetricsUtils.phase('pre_save'):
+            await BaseServicePreAndPostUtils.update_pre_save_hook(service_instance=self, payload=payload, request=request, item=model_item)
 
         if (
             updated := await BaseServiceUtils.update_db_entity_instance(
@@ -596,7 +896,8 @@ class BaseService[ModelType]:
                 logged_user_id=logged_user_id,
             )
         ) != {}:
-            await model_item.save()
+            with BaseServiceMetricsUtils.phase('save'):
+                await model_item.save()
 
             await self.validate(logged_user_id, item_id, request, quiet=False)
 
@@ -609,6 +910,11 @@ class BaseService[ModelType]:
                 ...
                 # TODO: Update cache for c1n
 
+            with BaseServiceMetricsUtils.phase('search'):
+                await BaseServiceSearchUtils.refresh(self, [model_item.id])
+
+            await self.invalidate_responses([model_item.id])
+
             await BaseServiceUtils.update_updated_fields(
                 request=request, model_item=model_item, updated=updated, schem_item=schem_item, service_instance=self, logged_user_id=logged_user_id
             )
@@ -634,6 +940,7 @@ class BaseService[ModelType]:
 
         return res
 
+    @BaseServiceMetricsUtils.timed('delete')
     async def delete(self, logged_user_id: uuid.UUID, item_id: uuid.UUID, request: Request):
 
         model_item = await self.get_single_model(item_id, request)
@@ -644,153 +951,47 @@ class BaseService[ModelType]:
 
         await model_item.save()
 
+        await self.invalidate_responses([model_item.id])
+
         return
 
-    async def mk_cache(self, request: Request, cache_type, citem, item, conn=None, ):
+    @BaseServiceMetricsUtils.timed('mk_cache')
+    async def mk_cache(self, request: Request, cache_type, citem, item, conn=None, save=True):
+        """
+        Evaluate mk_cache_rules of the cache item and save it if any column changed.
+        With save=False the cache item is only updated in memory (used for bulk inserts).
 
-        from base4.project_specifics import lookups_module
+        Rules are compiled once per cache model (see BaseServiceMkCacheUtils.plans) and
+        independent rules run concurrently, stage by stage. Rule expressions are evaluated
+        with this module's globals plus shared.ipc as ipc. With metrics enabled all rules are
+        recorded as one 'rules' phase, the returned timings have the stage of every rule.
 
-        import shared.ipc as ipc  # DO NOT REMOVE THIS IMPORT, IT IS USED BY EVAL FUNCTION
+        :return: per rule timings of this call, {column: {'method', 'stage', 'seconds', 'timed_out'}}
+        """
 
-        # lookups = lookups_module.Lookups
+        from base4.project_specifics import lookups_module
 
+        # order of BaseServiceMkCacheUtils SCOPE
+        scope = (self, request, cache_type, citem, item, conn, lookups_module)
 
+        timings = {}
         updated = set()
-        for c in citem.mk_cache_rules:
-            if 'column' not in c:
-                continue
-            if 'method' not in c:
-                continue
-
-            current = getattr(citem, c['column'])
-
-            if c['method'] == 'copy_from_base_table':
-                if 'source_column' not in c:
-                    continue
-
-                new_value = getattr(item, c['source_column'])
-
-                if current != new_value:
-                    setattr(citem, c['column'], new_value)
-                    updated.add(c['column'])
-
-            elif c['method'] == 'copy_from_service_table':
-                if 'service_module' not in c:
-                    raise NameError("service_module must be used")
-
-                if 'service_class' not in c:
-                    raise NameError("service_class must be used")
-
-                if 'service_class_method' not in c:
-                    raise NameError("service_class_method source must be used")
-
-                if 'args' not in c:
-                    raise NameError("args must be used")
-
-                try:
-                    service_module = importlib.import_module(c['service_module'])
-                    service_class = getattr(service_module, c['service_class'])
-                    service_class_method = getattr(service_class, c['service_class_method'])
-
-                    args = [eval(x) for x in c['args']]
-                    new_value = await service_class_method(*args)
-
-                    if current != new_value:
-                        setattr(citem, c['column'], new_value)
-                        updated.add(c['column'])
-
-                except Exception as e:
-
-                    raise
-
-            elif c['method'] == 'async_method':
-                if 'function' not in c:
-                    raise NameError("Function must be used")
-
-                try:
-                    new_value = await eval(c['function'])
-                except Exception as e:
-                    raise
-
-                if current != new_value:
-                    if current != new_value:
-                        setattr(citem, c['column'], new_value)
-                        updated.add(c['column'])
-
-            elif c['method'] == 'lookup':
-                if 'target' not in c:
-                    raise NameError("Target must be used")
-                if 'source' not in c:
-                    raise NameError("Source must be used")
-
-                rlookup = lookups_module.LookupsReversed.get_instance()
-
-                if getattr(citem, c['source']):
-                    try:
-                        lkp = rlookup[str(getattr(citem, c['source']))]
-                    except Exception as e:
-                        raise
-
-                    if c['target'] not in ('code',):
-                        raise NameError(f"Invalid target {c['target']}")
-
-                    new_value = lkp[c['target']]
-                else:
-                    new_value = None
-
-                if current != new_value:
-                    setattr(citem, c['column'], new_value)
-                    updated.add(c['column'])
-
-            elif c['method'] == 'ipc':
-                if 'ipc' not in c:
-                    raise NameError("IPC must be used")
+        with BaseServiceMetricsUtils.phase('rules'):
+            for stage, plans in enumerate(BaseServiceMkCacheUtils.plans(type(citem), globals())):
+                results = await asyncio.gather(
+                    *[BaseServiceMkCacheUtils.run_timed(plan, scope, stage, timings, timeout=self.mk_cache_rule_timeout) for plan in plans]
+                )
 
-                if 'condition' in c:
-                    if not eval(c['condition']):
+                for plan, (skip, new_value) in zip(plans, results):
+                    if skip:
                         continue
 
-                try:
-                    #                    breakpoint()
-                    new_value = await eval(c['ipc'])
-                    ...
-                except Exception as e:
-                    new_value = None
-                    raise
-
-                if 'extract_key' in c and isinstance(new_value, dict):
-                    try:
-                        new_value = new_value[c['extract_key']] if c['extract_key'] in new_value else None
-                    except Exception as e:
-                        raise
-
-                if current != new_value:
-                    setattr(citem, c['column'], new_value)
-                    updated.add(c['column'])
-
-            # TODO: REMOVE THIS AND REPLACE WITH IPC
-            elif c['method'] == 'svc_get':
-                if 'service' not in c:
-                    raise NameError("Service must be used")
-                if 'uri' not in c and 'ipc' not in c:
-                    raise NameError("Either uri or ipc must be used")
-                if 'uri' in c and 'ipc' in c:
-                    raise NameError("Only one of uri or ipc can be used")
-                if 'source' not in c:
-                    raise NameError("Source must be used")
-
-                if not eval(c['source']):
-                    new_value = None
-                elif 'ipc' in c:
-                    try:
-                        new_value = await eval(c['ipc'])
-                    except Exception as e:
-                        raise
-
-                if current != new_value:
-                    setattr(citem, c['column'], new_value)
-                    updated.add(c['column'])
+                    if getattr(citem, plan.column) != new_value:
+                        setattr(citem, plan.column, new_value)
+                        updated.add(plan.column)
 
-        if updated:
-            await citem.save(using_db=conn)
+        if updated and save:
+            with BaseServiceMetricsUtils.phase('save'):
+                await citem.save(using_db=conn)
 
+        return timings
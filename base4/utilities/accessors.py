@@ -0,0 +1,36 @@
+import builtins
+import operator
+import re
+from typing import Any, Callable, Dict
+
+_ATTRIBUTE_PATH = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$')
+
+_compiled: Dict[str, Callable[[Any], Any]] = {}
+
+
+def compile_accessor(path: str) -> Callable[[Any], Any]:
+    """
+    Compile a model_loc path into a getter callable.
+
+    Plain dotted paths such as 'display_name' or 'cache11.sla_deadline_for_open' become
+    operator.attrgetter instances. Anything else (indexing, calls, ...) is compiled once into
+    a code object, preserving the eval(f'item.{path}') semantics it replaces.
+
+    :param path: attribute path relative to the model item
+    :return: callable taking the model item and returning the value
+    """
+    try:
+        return _compiled[path]
+    except KeyError:
+        pass
+
+    if _ATTRIBUTE_PATH.match(path):
+        getter = operator.attrgetter(path)
+    else:
+        code = compile(f'item.{path}', f'<accessor {path}>', 'eval')
+
+        def getter(item, code=code):
+            return eval(code, {'__builtins__': builtins, 'item': item})
+
+    _compiled[path] = getter
+    return getter
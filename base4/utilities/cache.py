@@ -1,19 +1,66 @@
+import asyncio
 import functools
+import hashlib
 import os
 import pickle
 import shutil
+import sqlite3
+import threading
 import time
-from collections import defaultdict
+from collections import OrderedDict, namedtuple
 
-from base4.utilities.common import list_files_in_directory, make_hashable
+from base4.utilities.common import make_hashable
 
 HDD_MEMOIZE_CACHE_FOLDER = '/tmp/io2cache/memoize'
 
+# bytes of pickled results kept in the hdd_memoize store, shared by all functions and workers
+HDD_MEMOIZE_MAX_BYTES = int(os.getenv('HDD_MEMOIZE_MAX_BYTES', 256 * 1024 * 1024))
+
+
+# entries kept per memoized function unless memoize(maxsize=...) says otherwise
+MEMOIZE_MAXSIZE = int(os.getenv('MEMOIZE_MAXSIZE', 1024))
+
+MemoizeInfo = namedtuple('MemoizeInfo', ['hits', 'misses', 'maxsize', 'currsize', 'evictions', 'expirations', 'coalesced'])
+
+
+def memoize(ttl, maxsize=MEMOIZE_MAXSIZE):
+    """
+    Cache results of an async function for ttl seconds, per arguments.
+
+    At most maxsize results are kept (None for no limit), the least recently used one is evicted
+    to make room. Expired results are dropped when requested and by a sweep over all results run
+    at most once per ttl, so results of arguments never requested again do not pile up.
+    Concurrent calls with the same arguments await one call of the function.
+
+    The wrapped function gets cache_info() and cache_clear(), as functools.lru_cache ones do.
+    Arguments which can not be hashed (after make_hashable) are not cached.
+    """
 
-def memoize(ttl):
     def decorator(func):
-        cache = {}
-        cache_times = defaultdict(lambda: 0)
+        # key -> (expires, result), least recently used first
+        cache = OrderedDict()
+        inflight = {}
+        stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'coalesced': 0}
+        last_sweep = time.monotonic()
+
+        def sweep(now):
+            nonlocal last_sweep
+            last_sweep = now
+            for key in [key for key, (expires, _) in cache.items() if expires <= now]:
+                del cache[key]
+                stats['expirations'] += 1
+
+        def store(key, result):
+            now = time.monotonic()
+            if now - last_sweep >= ttl:
+                sweep(now)
+
+            cache[key] = (now + ttl, result)
+            cache.move_to_end(key)
+
+            while maxsize is not None and len(cache) > maxsize:
+                cache.popitem(last=False)
+                stats['evictions'] += 1
 
         @functools.wraps(func)
         async def wrapped(*args, **kwargs):
@@ -22,78 +69,268 @@ def memoize(ttl):
             # return await func(*args, **kwargs)
 
             key = (make_hashable(args), make_hashable(kwargs))
-            current_time = time.time()
+            try:
+                entry = cache.get(key)
+            except TypeError:
+                return await func(*args, **kwargs)
 
-            # Invalidate cache if TTL has expired
-            if key in cache and (current_time - cache_times[key]) > ttl:
-                del cache[key]
-                del cache_times[key]
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    cache.move_to_end(key)
+                    stats['hits'] += 1
+                    return entry[1]
 
-            # Return cached value if available and valid
-            if key in cache:
-                return cache[key]
+                del cache[key]
+                stats['expirations'] += 1
+
+            # a call for the same arguments is already running, share its result
+            while key in inflight:
+                future = inflight[key]
+                stats['coalesced'] += 1
+                try:
+                    return await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    if not future.cancelled():
+                        raise
+
+            stats['misses'] += 1
+
+            future = asyncio.get_running_loop().create_future()
+            inflight[key] = future
+            try:
+                result = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_exception(e)
+                future.exception()
+                raise
+            else:
+                future.set_result(result)
+            finally:
+                del inflight[key]
 
-            # Compute new value and update cache
-            result = await func(*args, **kwargs)
-            cache[key] = result
-            cache_times[key] = current_time
+            store(key, result)
             return result
 
+        def cache_info():
+            return MemoizeInfo(currsize=len(cache), maxsize=maxsize, **stats)
+
+        def cache_clear():
+            nonlocal last_sweep
+            cache.clear()
+            for name in stats:
+                stats[name] = 0
+            last_sweep = time.monotonic()
+
+        wrapped.cache_info = cache_info
+        wrapped.cache_clear = cache_clear
+
         return wrapped
 
     return decorator
 
 
-def hdd_memoize_clear_cache_folder():
-    shutil.rmtree(HDD_MEMOIZE_CACHE_FOLDER, ignore_errors=True)
-    os.makedirs(HDD_MEMOIZE_CACHE_FOLDER, exist_ok=True)
+HddMemoizeInfo = namedtuple('HddMemoizeInfo', ['hits', 'misses', 'expirations', 'coalesced', 'errors', 'currsize', 'bytes'])
 
+_hdd_local = threading.local()
+_hdd_generation = 0
 
-def hdd_memoize(ttl):
-    def decorator(func):
 
-        global HDD_MEMOIZE_CACHE_FOLDER
-        os.makedirs(HDD_MEMOIZE_CACHE_FOLDER, exist_ok=True)
+def _hdd_connection():
+    """SQLite connection of the current thread to the store in HDD_MEMOIZE_CACHE_FOLDER, opened on first use."""
+    conn = getattr(_hdd_local, 'conn', None)
+    if conn is not None and _hdd_local.generation == _hdd_generation:
+        return conn
+    if conn is not None:
+        conn.close()
 
-        @functools.wraps(func)
-        async def wrapped(*args, **kwargs):
+    os.makedirs(HDD_MEMOIZE_CACHE_FOLDER, exist_ok=True)
+    conn = sqlite3.connect(f'{HDD_MEMOIZE_CACHE_FOLDER}/memoize.sqlite3', timeout=10, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS memoize ('
+        'key BLOB PRIMARY KEY, func TEXT NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL, value BLOB NOT NULL)'
+    )
+    conn.execute('CREATE INDEX IF NOT EXISTS memoize_func ON memoize (func)')
+    conn.execute('CREATE INDEX IF NOT EXISTS memoize_expires ON memoize (expires)')
+    conn.execute('CREATE INDEX IF NOT EXISTS memoize_accessed ON memoize (accessed)')
+
+    _hdd_local.conn, _hdd_local.generation = conn, _hdd_generation
+    return conn
+
+
+def _hdd_load(key):
+    """(expires, pickled result) of an entry or None, access time of a live entry is refreshed for the LRU eviction."""
+    conn = _hdd_connection()
+    now = time.time()
+    row = conn.execute('SELECT expires, value FROM memoize WHERE key = ?', (key,)).fetchone()
+    if row is not None and row[0] > now:
+        conn.execute('UPDATE memoize SET accessed = ? WHERE key = ?', (now, key))
+    return row
+
+
+def _hdd_store(key, func_name, value, ttl, max_bytes):
+    """
+    Write an entry in one transaction, so other workers see either the previous entry or this one.
+
+    Expired entries are dropped, then the least recently accessed ones until the store fits in max_bytes.
+    """
+    conn = _hdd_connection()
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('DELETE FROM memoize WHERE expires <= ?', (now,))
+        conn.execute(
+            'INSERT OR REPLACE INTO memoize (key, func, expires, accessed, size, value) VALUES (?, ?, ?, ?, ?, ?)',
+            (key, func_name, now + ttl, now, len(value), value),
+        )
+        if max_bytes is not None and conn.execute('SELECT total(size) FROM memoize').fetchone()[0] > max_bytes:
+            conn.execute(
+                'DELETE FROM memoize WHERE key IN ('
+                'SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY accessed DESC, key) AS kept FROM memoize) WHERE kept > ?)',
+                (max_bytes,),
+            )
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def _hdd_execute(sql, *params):
+    conn = _hdd_connection()
+    return conn.execute(sql, params).fetchone()
+
+
+def _stable_repr(obj):
+    """repr of obj which does not depend on the process: dict items and set members are sorted."""
+    if isinstance(obj, (tuple, list)):
+        return f'{type(obj).__name__}({", ".join(_stable_repr(e) for e in obj)})'
+    if isinstance(obj, dict):
+        return f'dict({", ".join(sorted(f"{_stable_repr(k)}: {_stable_repr(v)}" for k, v in obj.items()))})'
+    if isinstance(obj, (set, frozenset)):
+        return f'{type(obj).__name__}({", ".join(sorted(_stable_repr(e) for e in obj))})'
+    return repr(obj)
+
+
+def hdd_memoize_key(func_name, args, kwargs):
+    """
+    Digest of a call, the same in every worker and after restarts (unlike hash(), salted per process).
+
+    Arguments are told apart by their repr, so arguments with the default object repr (which
+    includes the id) are only found again by the same object in the same process.
+    """
+    key = _stable_repr((func_name, make_hashable(args), make_hashable(kwargs)))
+    return hashlib.sha256(key.encode()).digest()
 
-            # DISABLE MEMOIZE
-            # return func(*args, **kwargs)
 
-            key = (make_hashable(args), make_hashable(kwargs))
+def hdd_memoize_clear_cache_folder():
+    global _hdd_generation
+    _hdd_generation += 1
+    shutil.rmtree(HDD_MEMOIZE_CACHE_FOLDER, ignore_errors=True)
+    os.makedirs(HDD_MEMOIZE_CACHE_FOLDER, exist_ok=True)
 
-            fname = '_'.join([func.__module__, func.__name__]).replace('.', '_')
-            fname += '.' + str(hash(key))
 
-            current_time = int(time.time() * 1000)
+def hdd_memoize(ttl, max_bytes=HDD_MEMOIZE_MAX_BYTES):
+    """
+    Cache pickled results of an async function for ttl seconds, per arguments, in a SQLite store.
 
-            target = HDD_MEMOIZE_CACHE_FOLDER + '/' + f'{fname}.*.pickle'
+    The store (HDD_MEMOIZE_CACHE_FOLDER/memoize.sqlite3, in WAL mode) is shared by all memoized
+    functions and by all workers on the host, and survives restarts. Entries are keyed by
+    hdd_memoize_key(), written atomically, and evicted least recently used first once the store
+    holds more than max_bytes (None for no limit; the last decorated function's limit applies
+    when they differ). Disk I/O runs in a thread, not on the event loop.
 
-            cache_files = list_files_in_directory(target)
+    Concurrent calls with the same arguments in one process await one call of the function.
+    Store errors are printed and the function is called as if nothing was cached.
+    The wrapped function gets cache_info() and cache_clear() (which drops its entries only).
+    """
 
-            for cf in cache_files[::-1]:
+    def decorator(func):
+        func_name = f'{func.__module__}.{func.__qualname__}'
+        stats = {'hits': 0, 'misses': 0, 'expirations': 0, 'coalesced': 0, 'errors': 0}
+        inflight = {}
 
-                file_in_fname_time = int(cf.split('.')[-2])
+        @functools.wraps(func)
+        async def wrapped(*args, **kwargs):
 
-                if (current_time - file_in_fname_time) > ttl * 1000:
-                    os.unlink(HDD_MEMOIZE_CACHE_FOLDER + '/' + cf)
-                    continue
-                else:
-                    with open(HDD_MEMOIZE_CACHE_FOLDER + '/' + cf, 'rb') as f:
-                        return pickle.load(f)
+            # DISABLE MEMOIZE
+            # return await func(*args, **kwargs)
 
-            # Compute new value and update cache
-            result = await func(*args, **kwargs)
+            key = hdd_memoize_key(func_name, args, kwargs)
 
             try:
-                with open(f'{HDD_MEMOIZE_CACHE_FOLDER}/{fname}.{current_time}.pickle', 'wb') as f:
-                    pickle.dump(result, f)
+                entry = await asyncio.to_thread(_hdd_load, key)
+            except sqlite3.Error as e:
+                print(f'hdd_memoize {func_name}: read failed: {e}')
+                stats['errors'] += 1
+                entry = None
+
+            # expired entries are replaced below, or dropped by the next write
+            if entry is not None and entry[0] <= time.time():
+                stats['expirations'] += 1
+            elif entry is not None:
+                try:
+                    result = pickle.loads(entry[1])
+                except Exception as e:
+                    print(f'hdd_memoize {func_name}: can not unpickle cached result: {e}')
+                    stats['errors'] += 1
+                else:
+                    stats['hits'] += 1
+                    return result
+
+            # a call for the same arguments is already running in this process, share its result
+            while key in inflight:
+                future = inflight[key]
+                stats['coalesced'] += 1
+                try:
+                    return await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    if not future.cancelled():
+                        raise
+
+            stats['misses'] += 1
+
+            future = asyncio.get_running_loop().create_future()
+            inflight[key] = future
+            try:
+                # Compute new value and update cache
+                result = await func(*args, **kwargs)
+
+                value = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+                try:
+                    await asyncio.to_thread(_hdd_store, key, func_name, value, ttl, max_bytes)
+                except sqlite3.Error as e:
+                    print(f'hdd_memoize {func_name}: write failed: {e}')
+                    stats['errors'] += 1
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
             except Exception as e:
+                future.set_exception(e)
+                future.exception()
                 raise
+            else:
+                future.set_result(result)
+            finally:
+                del inflight[key]
 
             return result
 
+        def cache_info():
+            currsize, size = _hdd_execute('SELECT count(*), total(size) FROM memoize WHERE func = ? AND expires > ?', func_name, time.time())
+            return HddMemoizeInfo(currsize=currsize, bytes=int(size), **stats)
+
+        def cache_clear():
+            _hdd_execute('DELETE FROM memoize WHERE func = ?', func_name)
+            for name in stats:
+                stats[name] = 0
+
+        wrapped.cache_info = cache_info
+        wrapped.cache_clear = cache_clear
+
         return wrapped
 
     return decorator
@@ -3,6 +3,7 @@ from base4.utilities.files import get_project_root
 
 dotenv.load_dotenv(get_project_root() / '.env')
 
+import asyncio
 import inspect
 import os
 import uuid
@@ -10,6 +11,7 @@ from typing import Any, Dict, List, TypeVar
 
 from base4.utilities.config import load_yaml_config
 from fastapi import HTTPException, Request
+from pypika import Table
 from tortoise import Tortoise
 
 SchemaType = TypeVar('SchemaType')
@@ -49,6 +51,106 @@ class BaseServiceDbUtils:
 
         return item
 
+    @staticmethod
+    async def bulk_db_operations(
+        base_service_instance,
+        request: Request,
+        bodies: List[dict],
+        payloads: List[SchemaType],
+        logged_user_id: uuid.UUID,
+        _conn,
+        batch_size: int = 500,
+    ):
+        """
+        Perform database operations for creating many items at once.
+
+        Same steps as db_operations, but base, cache11 and cache1n rows are inserted with
+        bulk_create and m2m through rows with multi-row inserts, in batches of batch_size. Cache
+        rules are evaluated before the cache rows are inserted.
+
+        List fields of the payloads (related items created through their service) and post_save
+        hooks still run one payload at a time, a query or more per related item.
+        """
+        _conn = BaseServiceDbUtils._get_connection(_conn)
+
+        m2m_relations = [{} for _ in payloads]
+        for payload, body, item_m2m_relations in zip(payloads, bodies, m2m_relations):
+            await BaseServiceDbUtils._process_schema_fields(base_service_instance, payload, body, item_m2m_relations, logged_user_id, request, _conn)
+
+        created = [base_service_instance.model(logged_user_id, **body) for body in bodies]
+
+        await base_service_instance.model.bulk_create(created, batch_size=batch_size, using_db=_conn)
+
+        # bulk_create returns nothing and leaves the instances unsaved for the ORM, related rows
+        # can only refer to saved ones, so read the inserted rows back (ids are assigned up front)
+        items = await BaseServiceDbUtils._fetch_by_ids(base_service_instance.model, [item.id for item in created], _conn, batch_size)
+
+        await BaseServiceDbUtils._handle_bulk_m2m_relations(base_service_instance.model, items, m2m_relations, _conn, batch_size)
+
+        await BaseServiceDbUtils._handle_bulk_caching(base_service_instance, items, request, _conn, batch_size)
+
+        for payload, body in zip(payloads, bodies):
+            await BaseServiceDbUtils._execute_post_save_hook(payload, base_service_instance, body, request)
+
+        return items
+
+    @staticmethod
+    async def _fetch_by_ids(model, ids: List[Any], _conn, batch_size: int) -> List[Any]:
+        """Items of model with ids, in the order of ids, read batch_size at a time."""
+        by_id = {}
+        for i in range(0, len(ids), batch_size):
+            for item in await model.filter(id__in=ids[i : i + batch_size]).using_db(_conn):
+                by_id[item.id] = item
+
+        return [by_id[_id] for _id in ids]
+
+    @staticmethod
+    async def _handle_bulk_m2m_relations(model, items: List[Any], m2m_relations: List[dict], _conn, batch_size: int):
+        """
+        Insert the m2m through rows of all items, batch_size rows per query.
+
+        Items were just created and have no relations yet, so unlike ManyToManyRelation.add
+        existing rows are not looked up first.
+        """
+        db = _conn or model._meta.db
+        for key in dict.fromkeys(key for item_m2m_relations in m2m_relations for key in item_m2m_relations):
+            field = model._meta.fields_map[key]
+
+            # (forward, backward) pairs, an item related twice to the same item gets one row
+            rows = {}
+            for item, item_m2m_relations in zip(items, m2m_relations):
+                pk_b = model._meta.pk.to_db_value(item.pk, item)
+                for related in item_m2m_relations.get(key, ()):
+                    rows[(type(related)._meta.pk.to_db_value(related.pk, related), pk_b)] = None
+
+            through_table = Table(field.through)
+            rows = list(rows)
+            for i in range(0, len(rows), batch_size):
+                query = db.query_class.into(through_table).columns(through_table[field.forward_key], through_table[field.backward_key])
+                for row in rows[i : i + batch_size]:
+                    query = query.insert(*row)
+                await db.execute_query(str(query))
+
+    @staticmethod
+    async def _handle_bulk_caching(base_service_instance, items: List[Any], request: Request, _conn, batch_size: int):
+        """Build cache rows for all items and insert them with bulk_create."""
+        if base_service_instance.c11:
+            cache11_items = [base_service_instance.c11(**{base_service_instance.c11_related_to: item}) for item in items]
+
+            semaphore = asyncio.Semaphore(base_service_instance.bulk_concurrency)
+
+            async def mk_cache(cache11, item):
+                async with semaphore:
+                    await base_service_instance.mk_cache(request, 'c11', cache11, item, _conn, save=False)
+
+            await asyncio.gather(*[mk_cache(cache11, item) for cache11, item in zip(cache11_items, items)])
+
+            await base_service_instance.c11.bulk_create(cache11_items, batch_size=batch_size, using_db=_conn)
+
+        if base_service_instance.c1n:
+            cache1n_items = [base_service_instance.c1n(language='en', **{base_service_instance.c1n_related_to: item}) for item in items]
+            await base_service_instance.c1n.bulk_create(cache1n_items, batch_size=batch_size, using_db=_conn)
+
     @staticmethod
     def _get_connection(_conn):
         """Determine the appropriate database connection."""
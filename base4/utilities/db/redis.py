@@ -1,10 +1,18 @@
 import os
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional
 
-# import redis.asyncio as redis
 import redis
+import redis.asyncio
 import ujson as json
 
+# connections kept by the asyncio pool of a process, REDIS_MAX_CONNECTIONS overrides it
+DEFAULT_MAX_CONNECTIONS = 50
+
+
+def redis_host() -> str:
+    # host = "localhost" if os.getenv('V4INSTALLATION', "localhost") not in ('docker', 'docker-monolith') else 'redis'
+    return "localhost" if os.getenv('APPLICATION_RUN_MODE', "localhost") not in ('docker', 'docker-monolith') else 'redis'
+
 
 class RedisClientHandler:
     def __init__(self, redis_instance: Optional[redis.StrictRedis] = None, port: int = 6379, db: int = 0):
@@ -17,9 +25,7 @@ class RedisClientHandler:
         if redis_instance:
             self.redis_client = redis_instance
         else:
-            # host = "localhost" if os.getenv('V4INSTALLATION', "localhost") not in ('docker', 'docker-monolith') else 'redis'
-            host = "localhost" if os.getenv('APPLICATION_RUN_MODE', "localhost") not in ('docker', 'docker-monolith') else 'redis'
-            self.redis_client = redis.StrictRedis(host=host, port=port, db=db)
+            self.redis_client = redis.StrictRedis(host=redis_host(), port=port, db=db)
 
     @staticmethod
     def get_redis_client(redis_instance: Optional[redis.StrictRedis] = None, port: int = 6379, db: int = 0) -> 'RedisClientHandler':
@@ -127,6 +133,225 @@ class RedisClientHandler:
             return []
 
 
+
+class AsyncRedisClientHandler:
+    """
+    asyncio counterpart of RedisClientHandler, with the same method surface awaited.
+
+    Commands go through a redis.asyncio connection pool of max_connections connections,
+    so cache reads and writes in request handlers do not block the event loop.
+    """
+
+    def __init__(self, redis_instance: Optional[redis.asyncio.StrictRedis] = None, port: int = 6379, db: int = 0, max_connections: Optional[int] = None):
+        """
+        Initialize the Redis client.
+
+        :param redis_instance: existing asyncio client (e.g. fakeredis.FakeAsyncRedis), used as is
+        :param port: Redis server port
+        :param db: Redis database number
+        :param max_connections: connection pool size, REDIS_MAX_CONNECTIONS or DEFAULT_MAX_CONNECTIONS if not set
+        """
+        if redis_instance:
+            self.redis_client = redis_instance
+        else:
+            if max_connections is None:
+                max_connections = int(os.getenv('REDIS_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS))
+
+            pool = redis.asyncio.ConnectionPool(host=redis_host(), port=port, db=db, max_connections=max_connections)
+            self.redis_client = redis.asyncio.StrictRedis(connection_pool=pool)
+
+    @staticmethod
+    def get_redis_client(
+        redis_instance: Optional[redis.asyncio.StrictRedis] = None, port: int = 6379, db: int = 0, max_connections: Optional[int] = None
+    ) -> 'AsyncRedisClientHandler':
+        return AsyncRedisClientHandler(redis_instance, port, db, max_connections)
+
+    def pipeline(self, transaction: bool = False):
+        """
+        Pipeline sending queued commands in one round-trip.
+
+        Commands are queued without awaiting, the pipeline is executed with await pipe.execute().
+        """
+        return self.redis_client.pipeline(transaction=transaction)
+
+    async def set(self, key: str, value: Any, ex: Optional[int] = None) -> bool:
+        """
+        Set a key-value pair in Redis.
+
+        :param key: Key
+        :param value: Value
+        :param ex: Expiration in seconds, no expiration if not set
+        :return: True if successful, False otherwise
+        """
+        try:
+            await self.redis_client.set(key, json.dumps(value), ex=ex)
+            return True
+        except Exception as e:
+            print(f"Error setting key {key}: {e}")
+            raise Exception("FAILED TO SET REDIS KEY")
+
+    async def setex(self, key: str, ttl: int, value: Any) -> bool:
+        """
+        Set a key-value pair in Redis expiring after ttl seconds.
+
+        :param key: Key
+        :param ttl: Expiration in seconds
+        :param value: Value
+        :return: True if successful, False otherwise
+        """
+        return await self.set(key, value, ex=ttl)
+
+    async def get(self, key: str) -> Any:
+        """
+        Get a value from Redis.
+
+        :param key: Key
+        :return: Value if found, None otherwise
+        """
+        try:
+            value = await self.redis_client.get(key)
+            return json.loads(value) if value else None
+        except Exception as e:
+            print(f"Error getting key {key}: {e}")
+            raise Exception("FAILED TO GET REDIS KEY")
+
+    async def mget(self, keys: List[str]) -> List[Any]:
+        """
+        Get several values from Redis in one round-trip.
+
+        :param keys: Keys
+        :return: Values in key order, None for keys not found
+        """
+        if not keys:
+            return []
+
+        try:
+            values = await self.redis_client.mget(keys)
+            return [json.loads(value) if value else None for value in values]
+        except Exception as e:
+            print(f"Error getting keys {keys}: {e}")
+            raise Exception("FAILED TO GET REDIS KEYS")
+
+    async def mset(self, mapping: Dict[str, Any], ex: Optional[int] = None) -> bool:
+        """
+        Set several key-value pairs in Redis in one round-trip.
+
+        :param mapping: Keys and values
+        :param ex: Expiration in seconds applied to every key, no expiration if not set
+        :return: True if successful, False otherwise
+        """
+        if not mapping:
+            return True
+
+        try:
+            if ex is None:
+                await self.redis_client.mset({key: json.dumps(value) for key, value in mapping.items()})
+            else:
+                # MSET has no expiration, pipeline SET EX instead
+                pipe = self.pipeline()
+                for key, value in mapping.items():
+                    pipe.set(key, json.dumps(value), ex=ex)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            print(f"Error setting keys {list(mapping)}: {e}")
+            raise Exception("FAILED TO SET REDIS KEYS")
+
+    async def delete(self, *keys: str) -> int:
+        """
+        Delete keys from Redis.
+
+        :param keys: Keys
+        :return: Number of keys deleted
+        """
+        if not keys:
+            return 0
+
+        try:
+            return await self.redis_client.delete(*keys)
+        except Exception as e:
+            print(f"Error deleting keys {keys}: {e}")
+            raise Exception("FAILED TO DELETE REDIS KEYS")
+
+    async def push_message(self, queue_name: str, message: Any) -> bool:
+        """
+        Push a message to a specified Redis queue.
+
+        :param queue_name: Name of the queue
+        :param message: Message to be pushed (will be JSON serialized)
+        :return: True if successful, False otherwise
+        """
+        try:
+            serialized_message = json.dumps(message, default=str)
+            await self.redis_client.rpush(queue_name, serialized_message)
+            return True
+        except Exception as e:
+            print(f"Error pushing message to queue {queue_name}: {e}")
+            raise Exception("FAILED TO SEND REDIS MESSAGE")
+
+    async def read_message(self, queue_name: str, timeout: int = 0) -> Optional[Any]:
+        """
+        Read a message from a specified Redis queue.
+
+        Waiting for a message holds one pool connection, but not the event loop.
+
+        :param queue_name: Name of the queue
+        :param timeout: Time to wait for a message (0 means indefinite)
+        :return: Deserialized message if available, None otherwise
+        """
+        try:
+            # BRPOP returns a tuple (queue_name, message)
+            result = await self.redis_client.brpop([queue_name], timeout)
+            if result:
+                message = result[1]  # Get the message part
+                return json.loads(message)
+            return None
+        except Exception as e:
+            print(f"Error reading message from queue {queue_name}: {e}")
+            raise Exception("FAILED TO READ REDIS MESSAGE FROM QUEUE")
+
+    async def get_queue_length(self, queue_name: str) -> int:
+        """
+        Get the current length of a queue.
+
+        :param queue_name: Name of the queue
+        :return: Length of the queue
+        """
+        return await self.redis_client.llen(queue_name)
+
+    async def clear_queue(self, queue_name: str) -> bool:
+        """
+        Clear all messages from a queue.
+
+        :param queue_name: Name of the queue
+        :return: True if successful, False otherwise
+        """
+        try:
+            await self.redis_client.delete(queue_name)
+            return True
+        except Exception as e:
+            print(f"Error clearing queue {queue_name}: {e}")
+            raise Exception("FAILED TO  CLEAR REDIS QUEUE")
+
+    async def get_all_messages(self, queue_name: str) -> List[Any]:
+        """
+        Get all messages from a queue without removing them.
+
+        :param queue_name: Name of the queue
+        :return: List of all messages in the queue
+        """
+        try:
+            messages = await self.redis_client.lrange(queue_name, 0, -1)
+            return [json.loads(message) for message in messages]
+        except Exception as e:
+            print(f"Error getting all messages from queue {queue_name}: {e}")
+            return []
+
+    async def close(self):
+        """Close the client and disconnect the connection pool."""
+        await self.redis_client.aclose()
+
+
 # Usage example
 if __name__ == "__main__":
     import dotenv
@@ -0,0 +1,102 @@
+import csv
+import datetime
+import decimal
+import enum
+import io
+import uuid
+from typing import Any, Iterable, List
+
+import pydantic
+import pydantic_core
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+EXPORT_MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def default(obj: Any) -> Any:
+    """Encode values the JSON libraries do not handle themselves, as pydantic does for response models."""
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, datetime.datetime):
+        res = obj.isoformat()
+        return res[:-6] + 'Z' if res.endswith('+00:00') else res
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    if isinstance(obj, pydantic.BaseModel):
+        return obj.model_dump(mode='json')
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Encode obj as JSON bytes with orjson if it is installed, with pydantic_core otherwise.
+
+    Both encode UUIDs and dates natively, other values go through default(). ujson is not
+    used here, calling default() for every UUID and datetime makes it slower than pydantic.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+    return pydantic_core.to_json(obj, fallback=default)
+
+
+class RawJSONResponse(Response):
+    """
+    JSON response rendered with dumps(), bytes content is sent as is.
+
+    Returned from a route it skips FastAPI's response_model validation and serialization.
+    """
+
+    media_type = 'application/json'
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
+
+
+def table_response(data: Any, header_json: bytes) -> RawJSONResponse:
+    """UniversalTableResponse encoded from rows and the header encoded by UniversalTableResponseBaseSchema.header_json()."""
+    return RawJSONResponse(b'{"header":' + header_json + b',"data":' + dumps(data) + b'}')
+
+
+def ndjson_lines(rows: Iterable[Any]) -> bytes:
+    """Rows encoded as newline delimited JSON, one line per row."""
+    return b''.join(dumps(row) + b'\n' for row in rows)
+
+
+def csv_value(value: Any) -> Any:
+    """Cell value for csv.writer: empty for None, JSON for nested values, strings for UUIDs, dates and decimals."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, (dict, list, tuple, set, frozenset, pydantic.BaseModel)):
+        return dumps(value).decode()
+    try:
+        return default(value)
+    except TypeError:
+        return str(value)
+
+
+def csv_lines(rows: Iterable[List[Any]]) -> bytes:
+    """Rows (lists of cell values) encoded as CSV lines."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows([csv_value(value) for value in row] for row in rows)
+    return buffer.getvalue().encode()
@@ -1,4 +1,10 @@
+import functools
+import importlib
+import os
+from typing import Any, FrozenSet, Tuple
+
 from lark import Lark, Transformer
+from tortoise.expressions import Q
 
 # Define the grammar as a raw string
 
@@ -11,11 +17,23 @@ start: expr
      | or_expr
      | not_expr
      | assign_expr
+     | compare_expr
+     | in_expr
+     | between_expr
+     | null_expr
+     | not_null_expr
+     | startswith_expr
 
 and_expr: "and" "(" args ")"
 or_expr: "or" "(" args ")"
 not_expr: "not" "(" expr ")"
 assign_expr: NAME "=" ( list_value | value)
+compare_expr: NAME COMPARE_OP value
+in_expr: NAME "in" list_value
+between_expr: NAME "between" "(" value "," value ")"
+null_expr: NAME "is" "null"
+not_null_expr: NAME "is" "not" "null"
+startswith_expr: NAME "startswith" value
 
 args: (expr ("," expr)*)?
 
@@ -23,8 +41,9 @@ list_value: "[" (value ("," value)*)? "]"
 
 value: NUMBER | STRING | STRING_SQ | BOOLEAN
 
-NAME: /[a-zA-Z_][a-zA-Z0-9_]*/
-NUMBER: /[0-9]+/
+NAME: /[a-zA-Z_][a-zA-Z0-9_]*(\\.[a-zA-Z_][a-zA-Z0-9_]*)*/
+COMPARE_OP: ">=" | "<=" | ">" | "<"
+NUMBER: /-?[0-9]+(\\.[0-9]+)?/
 STRING: /"[^"]*"/
 STRING_SQ: /'[^']*'/
 BOOLEAN: "True" | "False"
@@ -33,7 +52,50 @@ BOOLEAN: "True" | "False"
 %ignore WS
 """
 
-parser = Lark(grammar, parser='lalr')
+# filter operators and the Tortoise lookups they are compiled to
+OPERATORS = {
+    '=': '',
+    '>': '__gt',
+    '>=': '__gte',
+    '<': '__lt',
+    '<=': '__lte',
+    'in': '__in',
+    'between': '__range',
+    'is null': '__isnull',
+    'startswith': '__startswith',
+}
+
+# compiled filters kept by compile_filter, STR2Q_CACHE_SIZE overrides it
+FILTER_CACHE_SIZE = int(os.getenv('STR2Q_CACHE_SIZE', 1024))
+
+# module generated by base4/scripts/gen_str2q_parser.py, used instead of building the parser if present
+STANDALONE_PARSER_MODULE = 'base4.utilities.parsers.str2q_standalone'
+
+_parser = None
+
+
+def get_parser():
+    """
+    Return the filter parser, building it on first use instead of at import time.
+
+    The standalone parser generated by gen_str2q_parser.py is used if it is installed,
+    otherwise Lark builds the LALR tables, caching them on disk (cache=True) so later
+    worker starts only load them.
+    """
+    global _parser
+    if _parser is None:
+        try:
+            _parser = importlib.import_module(STANDALONE_PARSER_MODULE).Lark_StandAlone()
+        except ImportError:
+            _parser = Lark(grammar, parser='lalr', cache=True)
+    return _parser
+
+
+def __getattr__(name):
+    # parser used to be built at import, keep it reachable as a module attribute
+    if name == 'parser':
+        return get_parser()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class QTransformer(Transformer):
@@ -54,6 +116,28 @@ class QTransformer(Transformer):
         value = items[1]
         return f"Q({name}={value})"
 
+    def compare_expr(self, items):
+        name, op, value = items
+        return f"Q({name}{OPERATORS[op]}={value})"
+
+    def in_expr(self, items):
+        name, value = items
+        return f"Q({name}__in={value})"
+
+    def between_expr(self, items):
+        name, low, high = items
+        return f"Q({name}__range=[{low},{high}])"
+
+    def null_expr(self, items):
+        return f"Q({items[0]}__isnull=True)"
+
+    def not_null_expr(self, items):
+        return f"Q({items[0]}__isnull=False)"
+
+    def startswith_expr(self, items):
+        name, value = items
+        return f"Q({name}__startswith={value})"
+
     def args(self, items):
         if items:
             return ",".join(items)
@@ -66,6 +150,9 @@ class QTransformer(Transformer):
         return items[0]
 
     def NAME(self, token):
+        return token.value.replace('.', '__')
+
+    def COMPARE_OP(self, token):
         return token.value
 
     def NUMBER(self, token):
@@ -79,10 +166,7 @@ class QTransformer(Transformer):
 
 
 def transform_filter_param_to_Q(s):
-    if not hasattr(transform_filter_param_to_Q, 'parser'):
-        transform_filter_param_to_Q.parser = Lark(grammar, parser='lalr')
-
-    tree = transform_filter_param_to_Q.parser.parse(s)
+    tree = get_parser().parse(s)
     transformer = QTransformer()
     try:
         r = transformer.transform(tree)
@@ -91,3 +175,149 @@ def transform_filter_param_to_Q(s):
 
     res = r.children[0]
     return res
+
+
+class CompiledFilter:
+    """
+    Parsed filter string, immutable and shared between requests.
+
+    ast is a tree of tuples:
+        ('and', (node, ...)), ('or', (node, ...)), ('not', node), ('cmp', field, operator, value)
+    where field is the dotted path from the filter string, operator a key of OPERATORS and
+    list values are tuples. as_q() builds a new Q on every call, so callers are free to
+    combine the result with other Q objects.
+
+    lookups holds the (field, operator) pairs used, fields just the fields.
+    """
+
+    __slots__ = ('source', 'ast', 'lookups', 'fields')
+
+    def __init__(self, source: str, ast: Tuple):
+        object.__setattr__(self, 'source', source)
+        object.__setattr__(self, 'ast', ast)
+        object.__setattr__(self, 'lookups', _lookups(ast))
+        object.__setattr__(self, 'fields', frozenset(field for field, _ in self.lookups))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompiledFilter is immutable")
+
+    def __repr__(self):
+        return f'CompiledFilter({self.source!r})'
+
+    def as_q(self) -> Q:
+        return _to_q(self.ast)
+
+    def check(self, profile_schema: Any, strict: bool = False):
+        """
+        Check that the profile allows every lookup of the filter.
+
+        A field can be used with a comparison, in, between, is null or startswith operator, or
+        through a dotted path, only if profile_schema.filter_properties() enables its column
+        (the last path segment), and if the properties list 'operators', only with those.
+        Plain '=' lookups are checked too when strict is set.
+
+        Raises:
+            ValueError: naming the first lookup which is not allowed
+        """
+        for field, operator in sorted(self.lookups):
+            if operator == '=' and '.' not in field and not strict:
+                continue
+
+            column = field.split('.')[-1]
+            properties = profile_schema.filter_properties(column) if hasattr(profile_schema, 'filter_properties') else False
+
+            if not properties or (isinstance(properties, dict) and not properties.get('enabled', True)):
+                raise ValueError(f"Filtering by {field} is not allowed")
+
+            if isinstance(properties, dict) and 'operators' in properties and operator not in properties['operators']:
+                raise ValueError(f"Operator {operator} is not allowed for {field}")
+
+
+def _lookups(node) -> FrozenSet[Tuple[str, str]]:
+    if node[0] in ('and', 'or'):
+        return frozenset().union(*(_lookups(child) for child in node[1]))
+    if node[0] == 'not':
+        return _lookups(node[1])
+    return frozenset(((node[1], node[2]),))
+
+
+def _to_q(node) -> Q:
+    kind = node[0]
+    if kind == 'and':
+        return Q(*(_to_q(child) for child in node[1]), join_type='AND')
+    if kind == 'or':
+        return Q(*(_to_q(child) for child in node[1]), join_type='OR')
+    if kind == 'not':
+        return ~Q(_to_q(node[1]))
+
+    _, field, operator, value = node
+    return Q(**{field.replace('.', '__') + OPERATORS[operator]: list(value) if isinstance(value, tuple) else value})
+
+
+def _token_value(token) -> Any:
+    if token.type == 'NUMBER':
+        return float(token.value) if '.' in token.value else int(token.value)
+    if token.type in ('STRING', 'STRING_SQ'):
+        return token.value[1:-1]
+    if token.type == 'BOOLEAN':
+        return token.value == 'True'
+    return token.value
+
+
+def _value(tree) -> Any:
+    return _token_value(tree.children[0])
+
+
+def _list_value(tree) -> Tuple:
+    return tuple(_value(v) for v in tree.children)
+
+
+def _ast(tree) -> Tuple:
+    """
+    Build the ast of a parse tree.
+
+    Walks tree.data / tree.children instead of using a lark Transformer, so trees produced
+    by the standalone parser (which has its own Tree class) are handled the same way.
+    """
+    data = tree.data
+    if data == 'start':
+        return _ast(tree.children[0])
+    if data in ('and_expr', 'or_expr'):
+        args = tree.children[0]
+        return data[:-5], tuple(_ast(child) for child in args.children)
+    if data == 'not_expr':
+        return 'not', _ast(tree.children[0])
+    if data == 'assign_expr':
+        name, value = tree.children
+        if value.data == 'list_value':
+            return 'cmp', name.value, '=', _list_value(value)
+        return 'cmp', name.value, '=', _value(value)
+    if data == 'compare_expr':
+        name, operator, value = tree.children
+        return 'cmp', name.value, operator.value, _value(value)
+    if data == 'in_expr':
+        name, value = tree.children
+        return 'cmp', name.value, 'in', _list_value(value)
+    if data == 'between_expr':
+        name, low, high = tree.children
+        return 'cmp', name.value, 'between', (_value(low), _value(high))
+    if data == 'null_expr':
+        return 'cmp', tree.children[0].value, 'is null', True
+    if data == 'not_null_expr':
+        return 'cmp', tree.children[0].value, 'is null', False
+    if data == 'startswith_expr':
+        name, value = tree.children
+        return 'cmp', name.value, 'startswith', _value(value)
+
+    raise ValueError(f"Unexpected filter node {data}")
+
+
+@functools.lru_cache(maxsize=FILTER_CACHE_SIZE)
+def compile_filter(s: str) -> CompiledFilter:
+    """
+    Parse a filters string into a CompiledFilter.
+
+    Results are kept in an LRU cache keyed by the filter string, so a filter resent by
+    dashboards is parsed once. Raises lark errors for invalid filters (which are not cached).
+    """
+    return CompiledFilter(s, _ast(get_parser().parse(s)))
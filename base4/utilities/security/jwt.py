@@ -1,8 +1,11 @@
+import hashlib
 import os
+import threading
 import time
 import uuid
+from collections import OrderedDict
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Any, Dict, Optional
 
 import jwt
 import pydantic
@@ -21,6 +24,10 @@ from fastapi import Depends, HTTPException
 private_key = read_file('security/private_key.pem')
 public_key = read_file('security/public_key.pem')
 
+# verify with the public key parsed once, instead of PyJWT parsing the PEM string on every decode
+use_preparsed_public_key = os.getenv('JWT_PREPARSED_PUBLIC_KEY', 'true').lower() in ('true', '1')
+_public_key_object = None
+
 
 class DecodedToken(pydantic.BaseModel):
     user_id: uuid.UUID
@@ -50,10 +57,89 @@ def create_token(request: CreateTokenRequest) -> str:
     return jwt.encode(payload, private_key, algorithm='RS256')
 
 
-def decode_token(token: str) -> DecodedToken:
-    global public_key
+class TokenCache:
+    """
+    Bounded LRU cache of verified tokens.
+
+    Keyed by the sha256 digest of the token, an entry is kept until the token exp, so a
+    token is verified once instead of on every request. Safe to use from the threadpool
+    sync dependencies (verify_token) run in.
+    """
+
+    def __init__(self, maxsize: int = 10_000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict[bytes, tuple[float, DecodedToken]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, key: bytes) -> Optional[DecodedToken]:
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                if entry[0] > time.time():
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._items[key]
+
+            self.misses += 1
+            return None
+
+    def set(self, key: bytes, decoded: DecodedToken, exp: float):
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._items[key] = (exp, decoded)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._items), 'maxsize': self.maxsize}
+
+
+token_cache = TokenCache(int(os.getenv('JWT_TOKEN_CACHE_SIZE', 10_000)))
+
+
+def verification_key():
+    global _public_key_object
+    if not use_preparsed_public_key:
+        return public_key
+
+    if _public_key_object is None:
+        from cryptography.hazmat.primitives.serialization import load_pem_public_key
+
+        _public_key_object = load_pem_public_key(public_key.encode() if isinstance(public_key, str) else public_key)
+
+    return _public_key_object
+
+
+def decode_token(token: str, use_cache: bool = True) -> DecodedToken:
+    """
+    Verify token and return its claims.
+
+    Verified tokens are kept in token_cache until they expire, the returned DecodedToken
+    may be shared between requests and should not be modified.
+    """
+    if use_cache:
+        key = TokenCache.key(token)
+        decoded = token_cache.get(key)
+        if decoded is not None:
+            return decoded
+
     try:
-        decoded_payload = jwt.decode(token, public_key, algorithms=['RS256'])
+        decoded_payload = jwt.decode(token, verification_key(), algorithms=['RS256'])
     except Exception as e:
         raise
     if 'exp' in decoded_payload:
@@ -61,7 +147,7 @@ def decode_token(token: str) -> DecodedToken:
     else:
         exp = int(time.time()) + 24 * 60 * 60  # forever
 
-    return DecodedToken(
+    decoded = DecodedToken(
         user_id=decoded_payload['id_user'],
         tenant_id=decoded_payload['id_tenant'],
         #        tenant_id='3acd0b70-6bdd-4519-8b8b-851f0114c89c', #decoded_payload['id_tenant']
@@ -69,6 +155,11 @@ def decode_token(token: str) -> DecodedToken:
         expired=int(time.time()) > exp,
     )
 
+    if use_cache and not decoded.expired:
+        token_cache.set(key, decoded, exp)
+
+    return decoded
+
 
 def verify_token(token: str = Depends(oauth2_scheme)) -> DecodedToken:
 
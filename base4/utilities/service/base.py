@@ -13,10 +13,12 @@ import tortoise
 import tortoise.timezone
 import ujson as json
 from base4.schemas.base import NOT_SET
-from base4.utilities.db.redis import RedisClientHandler
+from base4.utilities.db.redis import AsyncRedisClientHandler, RedisClientHandler
 from base4.utilities.files import get_project_root
 from base4.utilities.security.jwt import decode_token
+from base4.utilities.service.response_cache import ResponseCache
 from base4.utilities.service.startup import service as app
+from base4.utilities.service.uid import BaseServiceUidUtils
 from base4.utilities.ws import emit, sio_client_manager
 from fastapi import APIRouter, FastAPI, File, Form, HTTPException, Query, Request, Response, UploadFile, status
 
@@ -27,6 +29,8 @@ SchemaType = TypeVar('SchemaType', bound=pydantic.BaseModel)
 ModelType = TypeVar('ModelType', bound=tortoise.models.Model)
 
 rdb = RedisClientHandler().redis_client
+ardb = AsyncRedisClientHandler()
+response_cache = ResponseCache(ardb)
 
 
 class BaseServiceUtils:
@@ -118,12 +122,15 @@ class BaseServiceUtils:
 			The SchemaType is expected to potentially have 'unique_id' and 'id' attributes.
 		"""
 		if hasattr(payload, 'unique_id') and (not payload.unique_id or payload.unique_id == NOT_SET):
-			payload.unique_id = await BaseServiceUtils.generate_unique_id(
-				model=base_service_instance.model,
-				uid_prefix=base_service_instance.uid_prefix,
-				uid_alphabet=base_service_instance.uid_alphabet,
-				uid_total_length=base_service_instance.uid_total_length,
-			)
+			if getattr(base_service_instance, 'uid_redis_pool_size', 0):
+				payload.unique_id = (await BaseServiceUtils.generate_unique_ids(base_service_instance, 1))[0]
+			else:
+				payload.unique_id = await BaseServiceUtils.generate_unique_id(
+					model=base_service_instance.model,
+					uid_prefix=base_service_instance.uid_prefix,
+					uid_alphabet=base_service_instance.uid_alphabet,
+					uid_total_length=base_service_instance.uid_total_length,
+				)
 		
 		if hasattr(payload, 'id') and getattr(payload, 'id') != NOT_SET:
 			_id: uuid.UUID = getattr(payload, 'id')
@@ -132,6 +139,90 @@ class BaseServiceUtils:
 		
 		return _id
 	
+	@staticmethod
+	async def update_payloads_with_ids(
+			base_service_instance: Any,
+			payloads: List[SchemaType],
+	) -> List[uuid.UUID]:
+		"""
+		Bulk variant of update_payload_with_ids.
+
+		Unique IDs for all payloads which need one are allocated together with
+		generate_unique_ids, so the whole batch costs a single existence check
+		(or Redis pool reservation) instead of one per payload.
+
+		Args:
+			base_service_instance (Any): An instance of the base service class.
+			payloads (List[SchemaType]): The payload objects to be updated.
+
+		Returns:
+			List[uuid.UUID]: The IDs for the payloads, in payload order.
+		"""
+		missing = [
+			payload for payload in payloads
+			if hasattr(payload, 'unique_id') and (not payload.unique_id or payload.unique_id == NOT_SET)
+		]
+		
+		if missing:
+			unique_ids = await BaseServiceUtils.generate_unique_ids(base_service_instance, len(missing))
+			for payload, unique_id in zip(missing, unique_ids):
+				payload.unique_id = unique_id
+		
+		ids = []
+		for payload in payloads:
+			if hasattr(payload, 'id') and getattr(payload, 'id') != NOT_SET:
+				ids.append(getattr(payload, 'id'))
+			else:
+				ids.append(uuid.uuid4())
+		
+		return ids
+	
+	@staticmethod
+	async def generate_unique_ids(
+			base_service_instance: Any,
+			count: int,
+	) -> List[str]:
+		"""
+		Generate count unique IDs for the model of a service.
+
+		If the service sets uid_redis_pool_size, IDs are taken from a pool pre-reserved
+		in Redis (see BaseServiceUidUtils.allocate), otherwise, or if Redis is not
+		reachable, they are generated with the model's gen_unique_ids method.
+
+		Args:
+			base_service_instance (Any): An instance of the base service class.
+			count (int): Number of unique IDs to generate.
+
+		Returns:
+			List[str]: The generated unique IDs.
+		"""
+		model = base_service_instance.model
+		
+		if getattr(base_service_instance, 'uid_redis_pool_size', 0):
+			try:
+				return await BaseServiceUidUtils.allocate(
+					ardb.redis_client,
+					model,
+					count,
+					prefix=base_service_instance.uid_prefix,
+					alphabet=base_service_instance.uid_alphabet,
+					total_length=base_service_instance.uid_total_length,
+					pool_size=base_service_instance.uid_redis_pool_size,
+					ttl=base_service_instance.uid_redis_reservation_ttl,
+				)
+			except HTTPException:
+				raise
+			except Exception as e:
+				print(f"Unique id pool error: {e}")
+		
+		return await model.gen_unique_ids(
+			count,
+			prefix=base_service_instance.uid_prefix,
+			alphabet=base_service_instance.uid_alphabet,
+			total_length=base_service_instance.uid_total_length,
+			max_attempts=10,
+		)
+	
 	@staticmethod
 	async def generate_unique_id(
 			model: ModelType,
@@ -328,8 +419,30 @@ async def api_accesslog(request, response, session, start_time, accesslog, exc=N
 # rdb.lpush(f'ACCESSLOG-{config.PROJECT_NAME}', json_dumps(payload, usepickle=True))
 
 
+def response_cache_tags(handler: Any, request: Request, cache_tags: Optional[List[str] | Callable] = None) -> List[str]:
+	"""
+	Tags of a cached api response.
+	
+	cache_tags is a list of tags, formatted with the path parameters ('tickets:{ticket_id}'),
+	or a callable returning them for (handler, request). Without cache_tags the response is
+	tagged with the table of the handler's model, if it has one.
+	"""
+	if callable(cache_tags):
+		return list(cache_tags(handler, request))
+	
+	if cache_tags is not None:
+		return [tag.format(**request.path_params) for tag in cache_tags]
+	
+	model = getattr(handler, 'model', None)
+	if model is not None and hasattr(model, '_meta'):
+		return ResponseCache.table_tags(model._meta.db_table)
+	
+	return []
+
+
 def api(roles: Optional[List[str]] = None, cache: int = 0, exposed: bool = True, accesslog: bool = True,
-		headers: Optional[dict] = None,
+		headers: Optional[dict] = None, cache_tags: Optional[List[str] | Callable] = None, cache_stale: int = 0,
+		cache_lock_timeout: float = 0,
 		upload_allowed_file_types: Optional[List[str]] = None, upload_max_file_size: Optional[int] = None,
 		upload_max_files: Optional[int] = None, **route_kwargs):
 	
@@ -337,6 +450,9 @@ def api(roles: Optional[List[str]] = None, cache: int = 0, exposed: bool = True,
 		func.route_kwargs = route_kwargs
 		func.roles = roles
 		func.cache = cache
+		func.cache_tags = cache_tags
+		func.cache_stale = cache_stale
+		func.cache_lock_timeout = cache_lock_timeout
 		func.exposed = exposed
 		func.accesslog = accesslog
 		func.headers = headers
@@ -407,22 +523,23 @@ def api(roles: Optional[List[str]] = None, cache: int = 0, exposed: bool = True,
 			#####################################
 			if 'GET' in route_kwargs.get('methods', ['GET']) and cache:
 				cache_key = f"cache:{request.method}{self.session.user_id if self.session else ''}{request.url.path}?{request.url.query}"
+				tags = response_cache_tags(self, request, cache_tags)
+				session = self.session
 				
-				try:
-					cached_response = rdb.get(cache_key)
-					if cached_response:
-						return json.loads(cached_response)
-				except Exception as e:
-					print(f"Redis cache error: {e}")
+				async def compute():
+					# a background refresh runs after other requests set their session on the handler
+					self.session = session
+					# todo, uhvati exc ako se desi na api i to da udje u accesslog na exc
+					response = await func(self, **request.path_params)
+					await api_accesslog(request, response, session, start_time, accesslog, exc=None)
+					return response
 				
-				# todo, uhvati exc ako se desi na api i to da udje u accesslog na exc
-				response = await func(self, **request.path_params)
-				await api_accesslog(request, response, self.session, start_time, accesslog, exc=None)
-				try:
-					rdb.setex(cache_key, cache, json.dumps(response))
-				except Exception as e:
-					print(f"Redis set error: {e}")
-				return response
+				# handlers read the session from the shared handler, a refresh running after this request
+				# would see the session of another one, so stale values are only served to anonymous requests
+				stale = 0 if session else cache_stale
+				
+				# concurrent misses share one handler call, see ResponseCache.cached
+				return await response_cache.cached(cache_key, compute, cache, tags, stale=stale, lock_timeout=cache_lock_timeout)
 			
 			#####################################
 			# call api handler that not have cache
@@ -468,6 +585,23 @@ class BaseAPIHandler(object):
 					pass
 				route_kwargs = attribute.route_kwargs
 				self.router.add_api_route(endpoint=attribute,**route_kwargs)
+				
+				if attribute.cache:
+					response_cache.track(*self.cached_tables(attribute.cache_tags))
+	
+	def cached_tables(self, cache_tags: Optional[List[str] | Callable] = None) -> List[str]:
+		"""Tables of the responses of a cached route, callable cache_tags are tracked by the handler (see ResponseCache.track)."""
+		if callable(cache_tags):
+			return []
+		
+		if cache_tags is not None:
+			return [ResponseCache.table_of_tag(tag) for tag in cache_tags]
+		
+		model = getattr(self, 'model', None)
+		if model is not None and hasattr(model, '_meta'):
+			return [model._meta.db_table]
+		
+		return []
 		
 	@api(
 		method='GET',
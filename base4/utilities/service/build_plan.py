@@ -0,0 +1,107 @@
+import datetime
+import uuid
+from typing import Any, Dict, List, Tuple, get_origin
+
+from base4.utilities.accessors import compile_accessor
+
+PRIMITIVE_TYPES = (str, bool, int, float, uuid.UUID, dict, datetime.date, datetime.datetime)
+
+# step kinds
+LIST, NESTED, VALUE = 'list', 'nested', 'value'
+
+
+class BuildPlan:
+    """
+    Precomputed recipe for building a schema payload from a model item.
+
+    steps: (kind, field, getter, schema class) for each schema field, where kind is one of
+           LIST (related items built with the element schema), NESTED (schema built from the
+           same item) or VALUE (taken directly from the item)
+    prefetch: relation paths ('tags', 'tags__owners', ...) that have to be fetched before
+              the item can be built without touching the database
+    """
+
+    __slots__ = ('schema', 'steps', 'prefetch')
+
+    def __init__(self, schema, steps: Tuple[Tuple[str, str, Any, Any], ...], prefetch: Tuple[str, ...]):
+        self.schema = schema
+        self.steps = steps
+        self.prefetch = prefetch
+
+
+_build_plans: Dict[Any, BuildPlan] = {}
+
+
+def get_build_plan(schema) -> BuildPlan:
+    """
+    Return the build plan for schema, walking schema_class_loc()/model_loc() only the first time.
+    """
+    try:
+        return _build_plans[schema]
+    except KeyError:
+        pass
+
+    schema_class_loc = schema.schema_class_loc()
+    model_loc = schema.model_loc() if hasattr(schema, 'model_loc') else {}
+
+    steps = []
+    prefetch: List[str] = []
+
+    for field in schema.model_fields:
+        if field not in schema_class_loc:
+            continue
+
+        cls = schema_class_loc[field]
+
+        if get_origin(cls) == list:
+            element_plan = get_build_plan(cls.__args__[0])
+            steps.append((LIST, field, compile_accessor(model_loc[field]), cls.__args__[0]))
+            prefetch.append(field)
+            prefetch.extend(f'{field}__{path}' for path in element_plan.prefetch)
+
+        elif cls not in PRIMITIVE_TYPES:
+            nested_plan = get_build_plan(cls)
+            steps.append((NESTED, field, compile_accessor(model_loc[field]), cls))
+            prefetch.extend(nested_plan.prefetch)
+
+        else:
+            if field not in model_loc:
+                raise NameError(f"Field {field} of {schema.__name__} is missing in model_loc")
+            steps.append((VALUE, field, compile_accessor(model_loc[field]), cls))
+
+    plan = BuildPlan(schema, tuple(steps), tuple(dict.fromkeys(prefetch)))
+    _build_plans[schema] = plan
+    return plan
+
+
+def build_prefetched(schema, item) -> Dict[str, Any]:
+    """
+    Build the schema payload from an item whose plan relations are already fetched.
+
+    Does not issue any queries, related lists are read from the prefetched relations.
+    """
+    res = {}
+
+    for kind, field, getter, cls in get_build_plan(schema).steps:
+        if kind == LIST:
+            res[field] = [build_prefetched(cls, _item) for _item in getter(item)]
+
+        elif kind == NESTED:
+            try:
+                getter(item)
+            except AttributeError:
+                continue
+
+            pl = build_prefetched(cls, item)
+            if set(pl.values()) == {None}:  # ako su svi None, preskoci
+                continue
+
+            res[field] = cls(**pl)
+
+        else:
+            try:
+                res[field] = getter(item)
+            except AttributeError:
+                continue
+
+    return res
@@ -0,0 +1,320 @@
+import abc
+import bisect
+import contextvars
+import functools
+import time
+from typing import Dict, Optional, Tuple
+
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+# seconds, upper bounds of the latency histogram buckets (the prometheus client defaults)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# phase recorded for a whole operation, its own phases are recorded next to it
+TOTAL = 'total'
+
+# client methods every ORM query goes through, wrapped to count queries (see BaseServiceMetricsUtils.count_queries)
+CLIENT_QUERY_METHODS = ('execute_insert', 'execute_query', 'execute_query_dict', 'execute_many', 'execute_script')
+
+_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('base4_metrics_span', default=None)
+_in_query: contextvars.ContextVar[bool] = contextvars.ContextVar('base4_metrics_in_query', default=False)
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsCollector(abc.ABC):
+    """
+    Receives what BaseServiceMetricsUtils measured, once per operation and once per phase of it.
+
+    Subclass it to forward measurements elsewhere (statsd, opentelemetry, logs, ...).
+    """
+
+    @abc.abstractmethod
+    def observe(self, service: str, operation: str, phase: str, seconds: float, queries: int, rows: int, error: bool):
+        pass
+
+
+class PhaseStats:
+    """Latency histogram and query / row / error counters of one (service, operation, phase)."""
+
+    __slots__ = ('count', 'seconds', 'max_seconds', 'buckets', 'queries', 'rows', 'errors')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        # one counter per bucket plus +Inf, not cumulative
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.queries = 0
+        self.rows = 0
+        self.errors = 0
+
+    def as_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'seconds': self.seconds,
+            'avg_seconds': self.seconds / self.count if self.count else 0.0,
+            'max_seconds': self.max_seconds,
+            'buckets': dict(zip(BUCKETS + (float('inf'),), self.buckets)),
+            'queries': self.queries,
+            'rows': self.rows,
+            'errors': self.errors,
+        }
+
+
+class InMemoryMetricsCollector(MetricsCollector):
+    """Keeps measurements in process, per (service, operation, phase)."""
+
+    def __init__(self):
+        self.stats: Dict[Tuple[str, str, str], PhaseStats] = {}
+
+    def observe(self, service: str, operation: str, phase: str, seconds: float, queries: int, rows: int, error: bool):
+        key = (service, operation, phase)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = PhaseStats()
+
+        stats.count += 1
+        stats.seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+        stats.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        stats.queries += queries
+        stats.rows += rows
+        stats.errors += error
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, Dict]]]:
+        """{service: {operation: {phase: stats}}}"""
+        res = {}
+        for (service, operation, phase), stats in sorted(self.stats.items()):
+            res.setdefault(service, {}).setdefault(operation, {})[phase] = stats.as_dict()
+        return res
+
+    def reset(self):
+        self.stats.clear()
+
+
+class PrometheusMetricsCollector(InMemoryMetricsCollector):
+    """In memory collector rendering its measurements in the Prometheus text exposition format."""
+
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, namespace: str = 'base4_service'):
+        super().__init__()
+        self.namespace = namespace
+
+    @staticmethod
+    def labels(service: str, operation: str, phase: str, **extra) -> str:
+        labels = dict(service=service, operation=operation, phase=phase, **extra)
+        return ','.join(f'{name}="{escape_label(str(value))}"' for name, value in labels.items())
+
+    def render(self) -> str:
+        """Metrics page, e.g. returned as PlainTextResponse(collector.render(), media_type=collector.content_type)."""
+        ns = self.namespace
+        items = sorted(self.stats.items())
+
+        lines = [f'# HELP {ns}_duration_seconds Latency of service operations and of their phases.', f'# TYPE {ns}_duration_seconds histogram']
+        for key, stats in items:
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float('inf'),), stats.buckets):
+                cumulative += count
+                lines.append(f'{ns}_duration_seconds_bucket{{{self.labels(*key, le="+Inf" if bound == float("inf") else repr(bound))}}} {cumulative}')
+            lines.append(f'{ns}_duration_seconds_sum{{{self.labels(*key)}}} {stats.seconds!r}')
+            lines.append(f'{ns}_duration_seconds_count{{{self.labels(*key)}}} {stats.count}')
+
+        for name, attribute, help_text in (
+            ('queries_total', 'queries', 'Database queries run by service operations and their phases.'),
+            ('rows_total', 'rows', 'Rows read by service operations and their phases.'),
+            ('errors_total', 'errors', 'Service operations and phases which raised.'),
+        ):
+            lines.append(f'# HELP {ns}_{name} {help_text}')
+            lines.append(f'# TYPE {ns}_{name} counter')
+            lines.extend(f'{ns}_{name}{{{self.labels(*key)}}} {getattr(stats, attribute)}' for key, stats in items)
+
+        return '\n'.join(lines) + '\n'
+
+
+class Span:
+    """
+    A running operation or phase, current in its context while it runs.
+
+    Queries and rows are added to the span and to the spans it runs in, so an operation
+    counts the queries of all its phases (and of the operations it calls).
+    """
+
+    __slots__ = ('collector', 'service', 'operation', 'phase', 'parent', 'queries', 'rows', 'start', 'token')
+
+    def __init__(self, collector: MetricsCollector, service: str, operation: str, phase: str, parent: Optional['Span']):
+        self.collector = collector
+        self.service = service
+        self.operation = operation
+        self.phase = phase
+        self.parent = parent
+        self.queries = 0
+        self.rows = 0
+
+    def __enter__(self):
+        self.token = _span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        _span.reset(self.token)
+        self.collector.observe(self.service, self.operation, self.phase, seconds, self.queries, self.rows, exc_type is not None)
+
+    def add_queries(self, n: int = 1):
+        span = self
+        while span is not None:
+            span.queries += n
+            span = span.parent
+
+    def add_rows(self, n: int):
+        span = self
+        while span is not None:
+            span.rows += n
+            span = span.parent
+
+
+class _NoSpan:
+    """Stands in for a Span while metrics are disabled, so callers do not check for it."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return None
+
+    def add_queries(self, n: int = 1):
+        pass
+
+    def add_rows(self, n: int):
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+class BaseServiceMetricsUtils:
+    """
+    Timing, query and row counts of BaseService operations, per service, operation and phase.
+
+    Disabled (collector is None) by default: timed operations then cost one attribute check,
+    phases one context variable lookup. Enable with
+
+        BaseServiceMetricsUtils.set_collector(PrometheusMetricsCollector())
+
+    and expose collector.render() (or InMemoryMetricsCollector.snapshot()) from an endpoint.
+    """
+
+    collector: Optional[MetricsCollector] = None
+
+    # client classes whose query methods are wrapped by count_queries
+    _instrumented: set = set()
+
+    @staticmethod
+    def set_collector(collector: Optional[MetricsCollector]):
+        """Start sending measurements to collector, None disables metrics."""
+        BaseServiceMetricsUtils.collector = collector
+        if collector is not None:
+            BaseServiceMetricsUtils.count_queries()
+
+    @staticmethod
+    def count_queries():
+        """
+        Wrap the query methods of the database client classes to count queries of the current span.
+
+        Done once (by set_collector): the loaded client classes are wrapped now, backends imported
+        later (when Tortoise is initialized) are wrapped when their classes are defined.
+        """
+        if BaseDBAsyncClient in BaseServiceMetricsUtils._instrumented:
+            return
+
+        pending = [BaseDBAsyncClient]
+        while pending:
+            cls = pending.pop()
+            pending.extend(cls.__subclasses__())
+            BaseServiceMetricsUtils._instrument(cls)
+
+        def init_subclass(cls, **kwargs):
+            super(BaseDBAsyncClient, cls).__init_subclass__(**kwargs)
+            BaseServiceMetricsUtils._instrument(cls)
+
+        BaseDBAsyncClient.__init_subclass__ = classmethod(init_subclass)
+
+    @staticmethod
+    def _instrument(cls):
+        if cls in BaseServiceMetricsUtils._instrumented:
+            return
+        BaseServiceMetricsUtils._instrumented.add(cls)
+
+        for name in CLIENT_QUERY_METHODS:
+            if name in cls.__dict__:
+                setattr(cls, name, BaseServiceMetricsUtils._counted(cls.__dict__[name]))
+
+    @staticmethod
+    def _counted(method):
+        @functools.wraps(method)
+        async def wrapped(*args, **kwargs):
+            span = _span.get()
+            # a client method calling another one (or super()) is one query
+            if span is None or _in_query.get():
+                return await method(*args, **kwargs)
+
+            span.add_queries()
+            token = _in_query.set(True)
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                _in_query.reset(token)
+
+        return wrapped
+
+    @staticmethod
+    def operation(service: str, operation: str) -> Span | _NoSpan:
+        """Span of a whole operation of service, recorded as its TOTAL phase."""
+        collector = BaseServiceMetricsUtils.collector
+        if collector is None:
+            return NO_SPAN
+        return Span(collector, service, operation, TOTAL, _span.get())
+
+    @staticmethod
+    def phase(name: str) -> Span | _NoSpan:
+        """Span of a phase of the current operation, no op outside of a timed operation."""
+        parent = _span.get()
+        if parent is None:
+            return NO_SPAN
+        return Span(parent.collector, parent.service, parent.operation, name, parent)
+
+    @staticmethod
+    def current() -> Span | _NoSpan:
+        """Current span (to add_rows to), NO_SPAN outside of a timed operation."""
+        return _span.get() or NO_SPAN
+
+    @staticmethod
+    def timed(operation: str):
+        """Decorator timing a BaseService coroutine method as operation of the service's class."""
+
+        def decorator(method):
+            @functools.wraps(method)
+            async def wrapped(self, *args, **kwargs):
+                if BaseServiceMetricsUtils.collector is None:
+                    return await method(self, *args, **kwargs)
+
+                with BaseServiceMetricsUtils.operation(type(self).__name__, operation):
+                    return await method(self, *args, **kwargs)
+
+            return wrapped
+
+        return decorator
+
+    @staticmethod
+    def snapshot() -> Dict:
+        """snapshot() of an in memory collector, {} for other collectors or when disabled."""
+        collector = BaseServiceMetricsUtils.collector
+        if isinstance(collector, InMemoryMetricsCollector):
+            return collector.snapshot()
+        return {}
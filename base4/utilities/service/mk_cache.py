@@ -0,0 +1,336 @@
+import ast
+import asyncio
+import importlib
+import operator
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+# rule keys holding python expressions evaluated against citem, item, request, ...
+EXPRESSION_KEYS = ('ipc', 'condition', 'function', 'source')
+
+# names available to rule expressions, in the order they are passed to compiled rules
+SCOPE = ('self', 'request', 'cache_type', 'citem', 'item', 'conn', 'lookups_module')
+
+_stages: Dict[type, Tuple[Tuple[Dict[str, Any], ...], ...]] = {}
+_plans: Dict[type, Tuple[Tuple['MkCacheRulePlan', ...], ...]] = {}
+
+
+def compile_expression(expression: str, namespace: Dict[str, Any], name: str) -> Callable:
+    """
+    Compile a rule expression into a function taking the SCOPE names as positional arguments.
+
+    The function globals are namespace, so expressions see the same module level names
+    (ipc, uuid, datetime, ...) they used to see when they were passed to eval().
+    """
+    code = compile(f'def {name}({", ".join(SCOPE)}):\n    return {expression}\n', f'<mk_cache {name}>', 'exec')
+    compiled = {}
+    exec(code, namespace, compiled)
+    return compiled[name]
+
+
+class MkCacheRulePlan:
+    """
+    A mk_cache rule compiled into a callable.
+
+    Expressions are compiled, service modules imported and attributes resolved once, so
+    evaluate() does no parsing, importing or attribute lookups by name.
+    """
+
+    __slots__ = ('rule', 'column', 'method', 'timeout', 'evaluate')
+
+    def __init__(self, rule: Dict[str, Any], namespace: Dict[str, Any]):
+        self.rule = rule
+        self.column = rule['column']
+        self.method = rule['method']
+        self.timeout = rule.get('timeout')
+
+        compile_method = getattr(self, f'_compile_{self.method}', None)
+        self.evaluate: Callable[[Tuple[Any, ...]], Awaitable[Tuple[bool, Any]]] = (
+            compile_method(rule, namespace) if compile_method else self._compile_unknown(rule, namespace)
+        )
+
+    def _expression(self, expression: str, namespace: Dict[str, Any], key: str) -> Callable:
+        return compile_expression(expression, namespace, f'{self.column}_{key}')
+
+    def _compile_unknown(self, rule, namespace):
+        async def evaluate(scope):
+            return True, None
+
+        return evaluate
+
+    def _compile_copy_from_base_table(self, rule, namespace):
+        if 'source_column' not in rule:
+            return self._compile_unknown(rule, namespace)
+
+        getter = operator.attrgetter(rule['source_column'])
+
+        async def evaluate(scope):
+            return False, getter(scope[4])
+
+        return evaluate
+
+    def _compile_copy_from_service_table(self, rule, namespace):
+        if 'service_module' not in rule:
+            raise NameError("service_module must be used")
+
+        if 'service_class' not in rule:
+            raise NameError("service_class must be used")
+
+        if 'service_class_method' not in rule:
+            raise NameError("service_class_method source must be used")
+
+        if 'args' not in rule:
+            raise NameError("args must be used")
+
+        service_module = importlib.import_module(rule['service_module'])
+        service_class = getattr(service_module, rule['service_class'])
+        service_class_method = getattr(service_class, rule['service_class_method'])
+
+        args = self._expression(f'({"".join(f"{x}, " for x in rule["args"])})', namespace, 'args')
+
+        async def evaluate(scope):
+            return False, await service_class_method(*args(*scope))
+
+        return evaluate
+
+    def _compile_async_method(self, rule, namespace):
+        if 'function' not in rule:
+            raise NameError("Function must be used")
+
+        function = self._expression(rule['function'], namespace, 'function')
+
+        async def evaluate(scope):
+            return False, await function(*scope)
+
+        return evaluate
+
+    def _compile_lookup(self, rule, namespace):
+        if 'target' not in rule:
+            raise NameError("Target must be used")
+        if 'source' not in rule:
+            raise NameError("Source must be used")
+        if rule['target'] not in ('code',):
+            raise NameError(f"Invalid target {rule['target']}")
+
+        source = operator.attrgetter(rule['source'])
+        target = rule['target']
+
+        async def evaluate(scope):
+            value = source(scope[3])
+            if not value:
+                return False, None
+
+            rlookup = scope[6].LookupsReversed.get_instance()
+            return False, rlookup[str(value)][target]
+
+        return evaluate
+
+    def _compile_ipc(self, rule, namespace):
+        if 'ipc' not in rule:
+            raise NameError("IPC must be used")
+
+        condition = self._expression(rule['condition'], namespace, 'condition') if 'condition' in rule else None
+        ipc = self._expression(rule['ipc'], namespace, 'ipc')
+        extract_key = rule.get('extract_key')
+
+        async def evaluate(scope):
+            if condition and not condition(*scope):
+                return True, None
+
+            new_value = await ipc(*scope)
+
+            if extract_key is not None and isinstance(new_value, dict):
+                new_value = new_value[extract_key] if extract_key in new_value else None
+
+            return False, new_value
+
+        return evaluate
+
+    # TODO: REMOVE THIS AND REPLACE WITH IPC
+    def _compile_svc_get(self, rule, namespace):
+        if 'service' not in rule:
+            raise NameError("Service must be used")
+        if 'uri' not in rule and 'ipc' not in rule:
+            raise NameError("Either uri or ipc must be used")
+        if 'uri' in rule and 'ipc' in rule:
+            raise NameError("Only one of uri or ipc can be used")
+        if 'source' not in rule:
+            raise NameError("Source must be used")
+
+        source = self._expression(rule['source'], namespace, 'source')
+        ipc = self._expression(rule['ipc'], namespace, 'ipc') if 'ipc' in rule else None
+
+        async def evaluate(scope):
+            if not source(*scope):
+                return False, None
+
+            if not ipc:
+                raise NameError("svc_get with uri is not supported, use ipc")
+
+            return False, await ipc(*scope)
+
+        return evaluate
+
+
+class BaseServiceMkCacheUtils:
+    @staticmethod
+    def expression_reads(expression: str) -> Optional[Set[str]]:
+        """
+        Cache columns an expression reads as citem.<column>.
+
+        None if the expression uses citem itself (ipc.f(citem), getattr(citem, name), citem.__dict__, ...)
+        or can not be parsed, as any column may be read then.
+        """
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError:
+            return None
+
+        columns = set()
+        attributes = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 'citem':
+                if node.attr.startswith('__'):
+                    return None
+                columns.add(node.attr)
+                attributes.add(id(node.value))
+
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and node.id == 'citem' and id(node) not in attributes:
+                return None
+
+        return columns
+
+    @staticmethod
+    def rule_reads(rule: Dict[str, Any]) -> Optional[Set[str]]:
+        """
+        Cache columns a mk_cache rule reads from citem, None if it may read any of them.
+
+        lookup rules read their source column, expression based rules read what their expressions
+        (including copy_from_service_table args) read, see expression_reads.
+        """
+        if rule['method'] == 'lookup':
+            return {rule['source'].split('.')[0]} if 'source' in rule else set()
+
+        expressions = [rule[key] for key in EXPRESSION_KEYS if isinstance(rule.get(key), str)]
+        expressions.extend(arg for arg in rule.get('args', []) if isinstance(arg, str))
+
+        columns = set()
+        for expression in expressions:
+            reads = BaseServiceMkCacheUtils.expression_reads(expression)
+            if reads is None:
+                return None
+            columns |= reads
+
+        return columns
+
+    @staticmethod
+    def stages(cache_model: type) -> Tuple[Tuple[Dict[str, Any], ...], ...]:
+        """
+        Group the mk_cache_rules of a cache model into stages of independent rules.
+
+        A rule runs after the earlier rules producing a column it reads and before the later ones,
+        so it sees the values it saw when rules ran one by one. A rule which may read any column
+        (see rule_reads) is ordered against every other rule. mk_cache_order (generated from
+        __mk_cache_order) chains the listed columns so each one runs after the previous.
+        Rules within a stage can be evaluated concurrently, stages run one after another.
+        Computed once per cache model class.
+        """
+        try:
+            return _stages[cache_model]
+        except KeyError:
+            pass
+
+        rules = [c for c in cache_model.mk_cache_rules if 'column' in c and 'method' in c]
+
+        producers: Dict[str, List[int]] = {}
+        for i, c in enumerate(rules):
+            producers.setdefault(c['column'], []).append(i)
+
+        depends_on: List[Set[int]] = [set() for _ in rules]
+        for i, c in enumerate(rules):
+            reads = BaseServiceMkCacheUtils.rule_reads(c)
+            if reads is None:
+                # citem used as a whole, any column may be read
+                read_from = set(range(len(rules)))
+            else:
+                read_from = {p for column in reads for p in producers.get(column, [])}
+
+            # as when rules ran sequentially, a rule sees what earlier rules produced and not what later ones do
+            depends_on[i] |= {p for p in read_from if p < i}
+            for p in read_from:
+                if p > i:
+                    depends_on[p].add(i)
+
+            # same column produced more than once, keep the original (last one wins) order
+            depends_on[i] |= {p for p in producers[c['column']] if p < i}
+
+        order = [column for column in getattr(cache_model, 'mk_cache_order', None) or [] if column in producers]
+        for previous, column in zip(order, order[1:]):
+            for i in producers[column]:
+                depends_on[i] |= set(producers[previous])
+
+        stages = []
+        done: Set[int] = set()
+        pending = list(range(len(rules)))
+        while pending:
+            ready = [i for i in pending if depends_on[i] <= done]
+            if not ready:
+                # dependency cycle, evaluate what is left sequentially in the original order
+                ready = pending[:1]
+            stages.append(tuple(rules[i] for i in ready))
+            done.update(ready)
+            pending = [i for i in pending if i not in done]
+
+        _stages[cache_model] = tuple(stages)
+        return _stages[cache_model]
+
+    @staticmethod
+    def plans(cache_model: type, namespace: Dict[str, Any]) -> Tuple[Tuple[MkCacheRulePlan, ...], ...]:
+        """
+        Compiled rule plans of a cache model, grouped in the same stages as stages().
+
+        Compiled once per cache model class. namespace provides the globals rule expressions
+        are evaluated with, shared.ipc is added to it as ipc.
+        """
+        try:
+            return _plans[cache_model]
+        except KeyError:
+            pass
+
+        namespace = dict(namespace)
+        try:
+            namespace['ipc'] = importlib.import_module('shared.ipc')
+        except ImportError:
+            pass
+
+        plans = tuple(tuple(MkCacheRulePlan(c, namespace) for c in rules) for rules in BaseServiceMkCacheUtils.stages(cache_model))
+        _plans[cache_model] = plans
+        return plans
+
+    @staticmethod
+    async def run_timed(plan: MkCacheRulePlan, scope: Tuple[Any, ...], stage: int, timings: Dict[str, Any], timeout: Optional[float] = None) -> Tuple[bool, Any]:
+        """
+        Evaluate one rule plan, recording its duration in timings under the rule column.
+
+        timeout (or the rule's own 'timeout' key) bounds the evaluation, a rule that times out
+        is skipped, leaving the cached column unchanged.
+
+        Returns:
+            Tuple[bool, Any]: (skip, new_value) as returned by the plan
+        """
+        timeout = plan.timeout or timeout
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            if timeout:
+                res = await asyncio.wait_for(plan.evaluate(scope), timeout)
+            else:
+                res = await plan.evaluate(scope)
+        except asyncio.TimeoutError:
+            print(f"mk_cache rule for {plan.column} timed out after {timeout}s")
+            timed_out = True
+            res = (True, None)
+
+        timings[plan.column] = {'method': plan.method, 'stage': stage, 'seconds': time.perf_counter() - start, 'timed_out': timed_out}
+        return res
@@ -0,0 +1,307 @@
+import base64
+import datetime
+import decimal
+import uuid
+from typing import Any, AsyncIterator, List, Optional, Tuple
+
+import ujson as json
+from base4.utilities.accessors import compile_accessor
+from tortoise.expressions import Q, RawSQL
+from tortoise.queryset import QuerySet
+
+COUNT_MODES = ('exact', 'window', 'estimated', 'none')
+
+WINDOW_COUNT_ANNOTATION = 'base4_total_count'
+
+# planner estimates are unreliable for small results, below this an exact count is cheap anyway
+ESTIMATED_COUNT_EXACT_BELOW = 10_000
+
+
+class BaseServicePaginationUtils:
+    @staticmethod
+    def resolve_count_mode(request: Any, profile_schema: Any) -> str:
+        """
+        Resolve how get_all obtains the total number of items.
+
+        The count_mode request parameter wins, then count_mode() declared on the profile
+        schema, and 'exact' is used when neither is set.
+
+        Modes:
+            exact:     separate COUNT(*) over the filtered query
+            window:    COUNT(*) OVER() selected together with the page, no extra round-trip
+            estimated: planner estimate (postgres only, falls back to exact elsewhere)
+            none:      no count at all, per_page + 1 rows are fetched to report has_next
+        """
+        count_mode = getattr(request, 'count_mode', None)
+        if not count_mode and hasattr(profile_schema, 'count_mode'):
+            count_mode = profile_schema.count_mode()
+
+        count_mode = count_mode or 'exact'
+        if count_mode not in COUNT_MODES:
+            raise NameError(f"Unknown count_mode: {count_mode}")
+
+        return count_mode
+
+    @staticmethod
+    def apply_count_mode(query: QuerySet, count_mode: str) -> QuerySet:
+        """Add the COUNT(*) OVER() column to the page query when counting with a window function."""
+        if count_mode == 'window':
+            return query.annotate(**{WINDOW_COUNT_ANNOTATION: RawSQL('COUNT(*) OVER()')})
+        return query
+
+    @staticmethod
+    def page_limit(per_page: int, count_mode: str, cursor_mode: bool = False) -> int:
+        """Number of rows to fetch for a page, one extra when has_next is detected by over-fetching."""
+        return per_page + 1 if count_mode == 'none' or cursor_mode else per_page
+
+    @staticmethod
+    def split_page(items: List[Any], per_page: int) -> tuple[List[Any], bool]:
+        """Trim an over-fetched page, returning the page items and has_next."""
+        return items[:per_page], len(items) > per_page
+
+    @staticmethod
+    async def count(cquery: QuerySet, items: List[Any], count_mode: str, offset: int) -> Optional[int]:
+        """
+        Total number of items matched by cquery, obtained according to count_mode.
+
+        Args:
+            cquery: filtered query without ordering, offset and limit
+            items: already fetched page
+            count_mode: one of COUNT_MODES
+            offset: offset of the fetched page
+
+        Returns:
+            Optional[int]: total count, None for count_mode 'none'
+        """
+        if count_mode == 'none':
+            return None
+
+        if count_mode == 'window':
+            if items:
+                return getattr(items[0], WINDOW_COUNT_ANNOTATION)
+            if offset == 0:
+                return 0
+            # page past the end, window has nothing to report
+            return await cquery.count()
+
+        if count_mode == 'estimated':
+            estimated = await BaseServicePaginationUtils.estimated_count(cquery)
+            if estimated is not None and estimated >= ESTIMATED_COUNT_EXACT_BELOW:
+                return estimated
+
+        return await cquery.count()
+
+    @staticmethod
+    async def estimated_count(cquery: QuerySet) -> Optional[int]:
+        """
+        Read the planner row estimate for cquery.
+
+        Returns None if the database is not postgres or the plan can not be read.
+        """
+        db = cquery._db or cquery.model._meta.db
+        if db.capabilities.dialect != 'postgres':
+            return None
+
+        try:
+            _, rows = await db.execute_query(f'EXPLAIN (FORMAT JSON) {cquery.sql()}')
+            plan = rows[0][0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+        except Exception as e:
+            print(f"Estimated count error: {e}")
+            return None
+
+    @staticmethod
+    def total_pages(count: Optional[int], per_page: int) -> Optional[int]:
+        if count is None:
+            return None
+        return (count + per_page - 1) // per_page
+
+    ##########################################################################################
+    # keyset (cursor) pagination
+
+    @staticmethod
+    def is_cursor_mode(request: Any) -> bool:
+        return bool(request.cursor or request.after or request.before)
+
+    @staticmethod
+    def split_order_by(order_by: str) -> Tuple[str, bool]:
+        """Split an order_by expression into (field, descending)."""
+        if order_by.startswith('-'):
+            return order_by[1:], True
+        return order_by, False
+
+    @staticmethod
+    def ordering(order_by: str) -> Tuple[str, ...]:
+        """order_by followed by id in the same direction, a total order so pages neither skip nor repeat rows."""
+        field, descending = BaseServicePaginationUtils.split_order_by(order_by)
+        if field == 'id':
+            return (order_by,)
+        return order_by, '-id' if descending else 'id'
+
+    @staticmethod
+    def encode_cursor(item: Any, order_by: str) -> str:
+        """
+        Build an opaque cursor pointing at item for the given order_by.
+
+        The cursor carries the order_by expression, the value of the ordering column
+        (typed, so it can be turned back into a filter value) and the item id.
+        """
+        field, _ = BaseServicePaginationUtils.split_order_by(order_by)
+        value = compile_accessor(field.replace('__', '.'))(item)
+
+        if isinstance(value, datetime.datetime):
+            value, type_ = value.isoformat(), 'datetime'
+        elif isinstance(value, datetime.date):
+            value, type_ = value.isoformat(), 'date'
+        elif isinstance(value, uuid.UUID):
+            value, type_ = str(value), 'uuid'
+        elif isinstance(value, decimal.Decimal):
+            value, type_ = str(value), 'decimal'
+        else:
+            type_ = None
+
+        payload = json.dumps({'o': order_by, 'v': value, 't': type_, 'id': str(item.id)})
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor: str, order_by: str) -> Tuple[Any, uuid.UUID]:
+        """
+        Decode a cursor created by encode_cursor into (order column value, id).
+
+        Raises:
+            ValueError: if the cursor is malformed or was issued for a different order_by
+        """
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            value, type_, _id = payload['v'], payload['t'], uuid.UUID(payload['id'])
+        except Exception:
+            raise ValueError("Malformed cursor")
+
+        if payload['o'] != order_by:
+            raise ValueError("Cursor was issued for a different order_by")
+
+        if value is not None:
+            if type_ == 'datetime':
+                value = datetime.datetime.fromisoformat(value)
+            elif type_ == 'date':
+                value = datetime.date.fromisoformat(value)
+            elif type_ == 'uuid':
+                value = uuid.UUID(value)
+            elif type_ == 'decimal':
+                value = decimal.Decimal(value)
+
+        return value, _id
+
+    @staticmethod
+    def seek_filter(field: str, value: Any, _id: uuid.UUID, ascending: bool, nulls_largest: bool = True) -> Q:
+        """
+        Q selecting rows strictly past (value, _id) when scanning in the given direction.
+
+        Args:
+            field: ordering column, may traverse relations (cache11__...)
+            value: value of the ordering column at the cursor
+            _id: id at the cursor, used as tie-breaker
+            ascending: True when scanning towards larger values
+            nulls_largest: True if NULLs sort after all values in ascending order (postgres)
+        """
+        lookup = '__gt' if ascending else '__lt'
+
+        if field == 'id':
+            return Q(**{f'id{lookup}': _id})
+
+        nulls_ahead = ascending == nulls_largest
+
+        if value is None:
+            q = Q(**{f'{field}__isnull': True, f'id{lookup}': _id})
+            if not nulls_ahead:
+                q |= Q(**{f'{field}__isnull': False})
+            return q
+
+        q = Q(**{f'{field}{lookup}': value}) | Q(**{field: value, f'id{lookup}': _id})
+        if nulls_ahead:
+            q |= Q(**{f'{field}__isnull': True})
+        return q
+
+    @staticmethod
+    def apply_keyset(query: QuerySet, request: Any, order_by: str) -> Tuple[QuerySet, bool]:
+        """
+        Turn the after/before cursor of the request into a seek predicate and a stable ordering.
+
+        Returns:
+            Tuple[QuerySet, bool]: ordered query, and True if the page is fetched backwards
+            (before cursor) and has to be reversed after fetching
+        """
+        field, descending = BaseServicePaginationUtils.split_order_by(order_by)
+        backward = bool(request.before)
+        scan_descending = descending != backward
+
+        cursor = request.before or request.after
+        if cursor:
+            value, _id = BaseServicePaginationUtils.decode_cursor(cursor, order_by)
+            db = query._db or query.model._meta.db
+            query = query.filter(
+                BaseServicePaginationUtils.seek_filter(
+                    field, value, _id, ascending=not scan_descending, nulls_largest=db.capabilities.dialect == 'postgres'
+                )
+            )
+
+        prefix = '-' if scan_descending else ''
+        return query.order_by(*BaseServicePaginationUtils.ordering(f'{prefix}{field}')), backward
+
+    @staticmethod
+    def cursors(items: List[Any], order_by: str, has_more: bool, backward: bool, from_cursor: bool) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Next and previous cursors for a fetched keyset page.
+
+        Args:
+            items: page items in presentation order
+            order_by: order_by expression the page was fetched with
+            has_more: True if a row past the page was found in the scan direction
+            backward: True if the page was fetched with a before cursor
+            from_cursor: True if the page was fetched with an after/before cursor
+        """
+        if not items:
+            return None, None
+
+        has_next = True if backward else has_more
+        has_previous = has_more if backward else from_cursor
+
+        next_cursor = BaseServicePaginationUtils.encode_cursor(items[-1], order_by) if has_next else None
+        previous_cursor = BaseServicePaginationUtils.encode_cursor(items[0], order_by) if has_previous else None
+
+        return next_cursor, previous_cursor
+
+    @staticmethod
+    async def chunks(query: QuerySet, order_by: str, chunk_size: int) -> AsyncIterator[List[Any]]:
+        """
+        Iterate over all rows of query in order_by order (id breaking ties), chunk_size rows at a time.
+
+        Every chunk is a separate query seeking past the last row of the previous chunk, so only one
+        chunk is held in memory and late chunks are read as fast as early ones.
+        """
+        field, descending = BaseServicePaginationUtils.split_order_by(order_by)
+        db = query._db or query.model._meta.db
+
+        ordered = query.order_by(*BaseServicePaginationUtils.ordering(order_by))
+        value_of = compile_accessor(field.replace('__', '.'))
+
+        last = None
+        while True:
+            chunk = ordered
+            if last is not None:
+                chunk = chunk.filter(
+                    BaseServicePaginationUtils.seek_filter(
+                        field, value_of(last), last.id, ascending=not descending, nulls_largest=db.capabilities.dialect == 'postgres'
+                    )
+                )
+
+            items = await chunk.limit(chunk_size)
+            if items:
+                yield items
+
+            if len(items) < chunk_size:
+                return
+
+            last = items[-1]
@@ -0,0 +1,453 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import ujson as json
+
+RESPONSE_CACHE_PREFIX = 'base4:rcache'
+INVALIDATION_CHANNEL = f'{RESPONSE_CACHE_PREFIX}:invalidate'
+
+# tag -> cached keys sets outlive the entries they list, refreshed on every set
+TAG_KEYS_TTL = 86400
+
+# seconds between checks for the value of the worker holding a key's lock
+LOCK_POLL_INTERVAL = 0.05
+
+
+class ResponseCache:
+    """
+    Two-tier cache of api responses, invalidated by tags.
+
+    Entries are stored in Redis as {'tags': [...], 'value': ...} under their key, and every tag
+    keeps the set of keys tagged with it. Tags name a table ('tickets') or an item of a table
+    ('tickets:<id>'), see table_tags; BaseService create / update / delete invalidate the tags
+    of the items they change, for the tables tracked by the cache only (see track).
+
+    A process local LRU of local_size entries sits in front of Redis and serves hot keys without
+    a round-trip. Invalidations are published on INVALIDATION_CHANNEL and dropped from the local
+    tier of every worker; local entries are only used while the subscription is up and live at
+    most local_ttl seconds, which bounds staleness if an invalidation is lost.
+    """
+
+    def __init__(self, redis_handler: Any, local_size: Optional[int] = None, local_ttl: Optional[float] = None):
+        """
+        :param redis_handler: AsyncRedisClientHandler
+        :param local_size: local tier entries, RESPONSE_CACHE_LOCAL_SIZE or 1024 if not set, 0 disables the local tier
+        :param local_ttl: seconds a local entry is served, RESPONSE_CACHE_LOCAL_TTL or 5 if not set
+        """
+        self.redis_handler = redis_handler
+        self.local_size = int(os.getenv('RESPONSE_CACHE_LOCAL_SIZE', 1024)) if local_size is None else local_size
+        self.local_ttl = float(os.getenv('RESPONSE_CACHE_LOCAL_TTL', 5)) if local_ttl is None else local_ttl
+
+        # key -> (expires, raw entry, tags)
+        self._local: OrderedDict[str, Tuple[float, str, Tuple[str, ...]]] = OrderedDict()
+        self._local_tags: Dict[str, Set[str]] = {}
+
+        # tables of cached responses, writes to other tables have nothing to invalidate
+        self.tables: Set[str] = set()
+
+        self._listener: Optional[asyncio.Task] = None
+        self._subscribed = False
+
+        # key -> future of the compute() in progress, see cached()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._refreshing: Set[asyncio.Task] = set()
+
+        self.stats = {'local_hits': 0, 'redis_hits': 0, 'stale_hits': 0, 'misses': 0, 'computed': 0, 'coalesced': 0, 'invalidations': 0}
+
+    @staticmethod
+    def table_tags(table: str, ids: Optional[Iterable[Any]] = None) -> List[str]:
+        """Tags of a table and of the items with ids in it."""
+        return [table] + [f'{table}:{_id}' for _id in ids or ()]
+
+    @staticmethod
+    def table_of_tag(tag: str) -> str:
+        return tag.split(':', 1)[0]
+
+    def track(self, *tables: str):
+        """
+        Invalidate responses of tables on writes through BaseService.
+
+        Tables of cached api routes are tracked when their handler registers its routes, tables
+        named by callable cache_tags, or written by processes not registering the routes, are tracked
+        with this.
+        """
+        self.tables.update(tables)
+
+    def tracks(self, table: str) -> bool:
+        return table in self.tables
+
+    @staticmethod
+    def key_of_tag(tag: str) -> str:
+        return f'{RESPONSE_CACHE_PREFIX}:tag:{tag}'
+
+    @staticmethod
+    def version_key(tag: str) -> str:
+        return f'{RESPONSE_CACHE_PREFIX}:version:{tag}'
+
+    ##########################################################################################
+    # local tier
+
+    def _local_get(self, key: str) -> Optional[str]:
+        try:
+            expires, raw, _ = self._local[key]
+        except KeyError:
+            return None
+
+        if expires < time.monotonic():
+            self._local_drop(key)
+            return None
+
+        self._local.move_to_end(key)
+        return raw
+
+    def _local_set(self, key: str, raw: str, tags: Iterable[str], ttl: float):
+        if not self.local_size or not self._subscribed:
+            return
+
+        self._local_drop(key)
+
+        tags = tuple(tags)
+        self._local[key] = (time.monotonic() + min(ttl, self.local_ttl), raw, tags)
+        for tag in tags:
+            self._local_tags.setdefault(tag, set()).add(key)
+
+        while len(self._local) > self.local_size:
+            self._local_drop(next(iter(self._local)))
+
+    def _local_drop(self, key: str):
+        entry = self._local.pop(key, None)
+        if entry is None:
+            return
+
+        for tag in entry[2]:
+            keys = self._local_tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._local_tags[tag]
+
+    def _local_invalidate(self, tags: Iterable[str]):
+        for tag in tags:
+            for key in list(self._local_tags.get(tag, ())):
+                self._local_drop(key)
+
+    def clear_local(self):
+        self._local.clear()
+        self._local_tags.clear()
+
+    ##########################################################################################
+    # invalidation channel
+
+    def _ensure_listener(self):
+        if not self.local_size or (self._listener is not None and not self._listener.done()):
+            return
+
+        try:
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+        except RuntimeError:
+            # no running loop, the local tier stays off
+            pass
+
+    async def _listen(self):
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.redis_handler.redis_client.pubsub()
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                self._subscribed = True
+
+                async for message in pubsub.listen():
+                    if message.get('type') == 'message':
+                        self._local_invalidate(json.loads(message['data'])['tags'])
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Response cache subscription error: {e}")
+            finally:
+                # invalidations may be missed from here on, local entries can not be trusted
+                self._subscribed = False
+                self.clear_local()
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+
+            await asyncio.sleep(1)
+
+    ##########################################################################################
+
+    async def lookup(self, key: str) -> Optional[Tuple[Any, bool]]:
+        """
+        Cached value of key and whether it is still fresh, None if it is not cached.
+
+        An entry stops being fresh after the ttl it was set with, and is kept for the stale seconds
+        passed to set() after that, see cached().
+
+        Raises:
+            Exception: if Redis can not be read
+        """
+        self._ensure_listener()
+
+        raw = self._local_get(key)
+        if raw is not None:
+            self.stats['local_hits'] += 1
+            entry = json.loads(raw)
+            return entry['value'], entry.get('fresh', float('inf')) > time.time()
+
+        pipe = self.redis_handler.pipeline()
+        pipe.get(key)
+        pipe.ttl(key)
+        raw, ttl = await pipe.execute()
+
+        if raw is None:
+            self.stats['misses'] += 1
+            return None
+
+        raw = raw.decode() if isinstance(raw, bytes) else raw
+        entry = json.loads(raw)
+
+        if ttl and ttl > 0:
+            self._local_set(key, raw, entry['tags'], ttl)
+
+        self.stats['redis_hits'] += 1
+        return entry['value'], entry.get('fresh', float('inf')) > time.time()
+
+    async def get(self, key: str) -> Any:
+        """
+        Fresh cached value of key, None if it is not cached or stale.
+
+        Raises:
+            Exception: if Redis can not be read
+        """
+        hit = await self.lookup(key)
+        if hit is None or not hit[1]:
+            return None
+        return hit[0]
+
+    async def versions(self, tags: List[str], key: Optional[str] = None) -> List[Optional[bytes]]:
+        """
+        Invalidation counters of tags, passed to set() to detect invalidations while a response was computed.
+
+        key is added to the keys of the tags before it is cached, so invalidations of the tags while
+        it is computed find it and bump the counters.
+        """
+        if not tags:
+            return []
+
+        if key is None:
+            return await self.redis_handler.redis_client.mget([ResponseCache.version_key(tag) for tag in tags])
+
+        pipe = self.redis_handler.pipeline()
+        for tag in tags:
+            pipe.sadd(ResponseCache.key_of_tag(tag), key)
+            pipe.expire(ResponseCache.key_of_tag(tag), TAG_KEYS_TTL)
+        pipe.mget([ResponseCache.version_key(tag) for tag in tags])
+        return (await pipe.execute())[-1]
+
+    async def set(self, key: str, value: Any, ttl: int, tags: List[str], versions: Optional[List[Optional[bytes]]] = None, stale: int = 0) -> bool:
+        """
+        Cache value under key for ttl seconds, tagged with tags, and keep it stale seconds longer.
+
+        If versions (from versions(), read before computing value) is given and any of the tags
+        was invalidated since, value may be stale and is not cached.
+
+        Returns:
+            bool: True if the value was cached
+
+        Raises:
+            Exception: if Redis can not be written
+        """
+        if versions is not None and await self.versions(tags) != versions:
+            return False
+
+        raw = json.dumps({'tags': tags, 'value': value, 'fresh': time.time() + ttl})
+
+        pipe = self.redis_handler.pipeline()
+        pipe.set(key, raw, ex=ttl + stale)
+        for tag in tags:
+            pipe.sadd(ResponseCache.key_of_tag(tag), key)
+            pipe.expire(ResponseCache.key_of_tag(tag), max(ttl + stale, TAG_KEYS_TTL))
+        await pipe.execute()
+
+        self._local_set(key, raw, tags, ttl + stale)
+        return True
+
+    async def invalidate(self, tags: List[str]):
+        """
+        Drop all entries tagged with any of tags, in Redis and in the local tier of every worker.
+
+        Tags without cached keys (nor keys being computed, see versions) are left alone, if none of
+        the tags has any this is one Redis round-trip. Redis errors are printed, not raised, so
+        writes do not fail because of the cache.
+        """
+        if not tags:
+            return
+
+        self._local_invalidate(tags)
+
+        try:
+            pipe = self.redis_handler.pipeline()
+            for tag in tags:
+                pipe.smembers(ResponseCache.key_of_tag(tag))
+            members = await pipe.execute()
+
+            tags = [tag for tag, keys in zip(tags, members) if keys]
+            if not tags:
+                return
+
+            self.stats['invalidations'] += 1
+
+            pipe = self.redis_handler.pipeline()
+            pipe.delete(*set().union(*members))
+            pipe.delete(*[ResponseCache.key_of_tag(tag) for tag in tags])
+            for tag in tags:
+                pipe.incr(ResponseCache.version_key(tag))
+                pipe.expire(ResponseCache.version_key(tag), TAG_KEYS_TTL)
+            pipe.publish(INVALIDATION_CHANNEL, json.dumps({'tags': tags}))
+            await pipe.execute()
+        except Exception as e:
+            print(f"Response cache invalidation error: {e}")
+
+    ##########################################################################################
+    # single-flight
+
+    async def cached(
+        self, key: str, compute: Callable[[], Awaitable[Any]], ttl: int, tags: List[str], stale: int = 0, lock_timeout: float = 0
+    ) -> Any:
+        """
+        Cached value of key, computed with compute() and cached for ttl seconds on a miss.
+
+        Concurrent misses of a key in a process share one compute() call (single-flight). With
+        lock_timeout set, workers also take a Redis lock on the key; the ones not getting it wait up
+        to lock_timeout seconds for the holder's value instead of computing it again. With stale
+        set, a value up to stale seconds past its ttl is returned right away while one background
+        compute() refreshes it (stale-while-revalidate).
+
+        Cache errors are printed, compute() is called as if the value was not cached.
+        """
+        try:
+            hit = await self.lookup(key)
+        except Exception as e:
+            print(f"Redis cache error: {e}")
+            hit = None
+
+        if hit is not None:
+            value, fresh = hit
+            if not fresh:
+                self.stats['stale_hits'] += 1
+                self._refresh(key, compute, ttl, tags, stale, lock_timeout)
+            return value
+
+        return await self._single_flight(key, compute, ttl, tags, stale, lock_timeout)
+
+    def _refresh(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: int, tags: List[str], stale: int, lock_timeout: float):
+        if key in self._inflight:
+            return
+
+        async def refresh():
+            try:
+                await self._single_flight(key, compute, ttl, tags, stale, lock_timeout)
+            except Exception as e:
+                print(f"Response cache refresh error: {e}")
+
+        task = asyncio.get_running_loop().create_task(refresh())
+        self._refreshing.add(task)
+        task.add_done_callback(self._refreshing.discard)
+
+    async def _single_flight(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: int, tags: List[str], stale: int, lock_timeout: float) -> Any:
+        while key in self._inflight:
+            future = self._inflight[key]
+            self.stats['coalesced'] += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # computing request was cancelled, compute here unless this request is the one cancelled
+                if not future.cancelled():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._compute(key, compute, ttl, tags, stale, lock_timeout)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # waiters re-raise it, without waiters it must not be reported as never retrieved
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            del self._inflight[key]
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: int, tags: List[str], stale: int, lock_timeout: float) -> Any:
+        versions = None
+        try:
+            versions = await self.versions(tags, key)
+        except Exception as e:
+            print(f"Redis cache error: {e}")
+
+        lock_key, token = f'{RESPONSE_CACHE_PREFIX}:lock:{key}', None
+        if lock_timeout:
+            try:
+                token = uuid.uuid4().hex
+                if not await self.redis_handler.redis_client.set(lock_key, token, nx=True, px=int(lock_timeout * 1000)):
+                    token = None
+                    value = await self._wait_for_lock_holder(key, lock_key, lock_timeout)
+                    if value is not None:
+                        return value
+            except Exception as e:
+                print(f"Response cache lock error: {e}")
+
+        try:
+            self.stats['computed'] += 1
+            value = await compute()
+
+            try:
+                await self.set(key, value, ttl, tags, versions, stale)
+            except Exception as e:
+                print(f"Redis set error: {e}")
+
+            return value
+        finally:
+            if token:
+                try:
+                    # released only if still ours, a lock which timed out may be held by another worker by now
+                    if await self.redis_handler.redis_client.get(lock_key) in (token, token.encode()):
+                        await self.redis_handler.redis_client.delete(lock_key)
+                except Exception as e:
+                    print(f"Response cache lock error: {e}")
+
+    async def _wait_for_lock_holder(self, key: str, lock_key: str, lock_timeout: float) -> Any:
+        """Fresh value cached by the worker holding the lock, None if it did not cache one within lock_timeout."""
+        deadline = time.monotonic() + lock_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+            hit = await self.lookup(key)
+            if hit is not None and hit[1]:
+                self.stats['coalesced'] += 1
+                return hit[0]
+
+            if not await self.redis_handler.redis_client.exists(lock_key):
+                return None
+
+        return None
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._listener = None
@@ -0,0 +1,233 @@
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from pypika.terms import Term, ValueWrapper
+from tortoise.expressions import Expression, Q, ResolveResult, Subquery
+from tortoise.queryset import QuerySet
+
+# request language (BaseCache1n.language) to postgres text search configuration
+LANGUAGE_CONFIGS = {
+    'da': 'danish',
+    'de': 'german',
+    'en': 'english',
+    'es': 'spanish',
+    'fi': 'finnish',
+    'fr': 'french',
+    'hu': 'hungarian',
+    'it': 'italian',
+    'nl': 'dutch',
+    'no': 'norwegian',
+    'pt': 'portuguese',
+    'ro': 'romanian',
+    'ru': 'russian',
+    'sv': 'swedish',
+    'tr': 'turkish',
+}
+
+DEFAULT_SEARCH_CONFIG = 'simple'
+
+SEARCH_VECTOR_COLUMN = 'search_vector'
+
+SEARCH_MATCH_ANNOTATION = 'base4_search_match'
+SEARCH_RANK_ANNOTATION = 'base4_search_rank'
+
+
+class SQLTerm(Term):
+    """
+    SQL with {0}, {1}, ... placeholders for values, which are rendered as pypika values
+    (as the values of any tortoise filter are) when the query is built.
+    """
+
+    def __init__(self, sql: str, values: List[Any]):
+        super().__init__()
+        self.sql = sql
+        self.values = values
+
+    def get_sql(self, **kwargs: Any) -> str:
+        return self.sql.format(*[ValueWrapper(value).get_sql(**kwargs) for value in self.values])
+
+
+class SQLExpression(Expression):
+    """
+    SQLTerm usable in annotate() and order_by().
+
+    Tortoise 0.22 can not order by a RawSQL annotation, an Expression resolving to a term it can.
+    """
+
+    def __init__(self, sql: str, values: List[Any]):
+        self.sql = sql
+        self.values = values
+
+    def resolve(self, resolve_context) -> ResolveResult:
+        return ResolveResult(term=SQLTerm(self.sql, self.values))
+
+
+class BaseServiceSearchUtils:
+    @staticmethod
+    def param(values: List[Any], value: Any) -> str:
+        """
+        Placeholder ({n}) for value, appended to values.
+
+        SQL built by this class never contains values, they are passed separately: bound to the
+        statement by refresh, rendered by pypika in the search expression (see SQLTerm).
+        """
+        values.append(value)
+        return f'{{{len(values) - 1}}}'
+
+    @staticmethod
+    def targets(service: Any) -> List[Tuple[str, Any, Dict[str, Any], Optional[str]]]:
+        """
+        Tables of a service with a search_config (generated by gen_model from __search).
+
+        Returns:
+            List of (kind, model, search_config, column referencing the base table) where kind is
+            'base', 'cache11' or 'cache1n', the column is None for the base table itself
+        """
+        targets = []
+
+        if getattr(service.model, 'search_config', None):
+            targets.append(('base', service.model, service.model.search_config, None))
+
+        for kind, model, related_to in (('cache11', service.c11, service.c11_related_to), ('cache1n', service.c1n, service.c1n_related_to)):
+            if not model or not getattr(model, 'search_config', None):
+                continue
+
+            source_field = getattr(model._meta.fields_map[related_to], 'source_field', None)
+            if not source_field:
+                # many to many cache tables are not searchable
+                continue
+
+            targets.append((kind, model, model.search_config, source_field))
+
+        return targets
+
+    @staticmethod
+    def language_sql(kind: str, search_config: Dict[str, Any], values: List[Any], column: Optional[str] = None, language: Optional[str] = None) -> str:
+        """
+        regconfig expression for a search target, configuration names are added to values (see param).
+
+        cache1n rows are indexed and searched in their own language: with column set, a CASE over
+        the language column is returned, with language set, the configuration of that language.
+        """
+        param = BaseServiceSearchUtils.param
+        default = search_config.get('language', DEFAULT_SEARCH_CONFIG)
+
+        if kind == 'cache1n':
+            languages = {**LANGUAGE_CONFIGS, **search_config.get('languages', {})}
+
+            if column:
+                cases = ' '.join(f'WHEN {param(values, k)} THEN {param(values, v)}' for k, v in languages.items())
+                return f'(CASE {column} {cases} ELSE {param(values, default)} END)::text::regconfig'
+
+            if language:
+                return f'{param(values, languages.get(language, default))}::text::regconfig'
+
+        return f'{param(values, default)}::text::regconfig'
+
+    @staticmethod
+    def vector_sql(kind: str, search_config: Dict[str, Any], table: str, values: List[Any]) -> str:
+        """Weighted tsvector over the search columns of a row of table, configuration names and weights are added to values."""
+        param = BaseServiceSearchUtils.param
+        language = BaseServiceSearchUtils.language_sql(kind, search_config, values, column=f'"{table}"."language"')
+
+        return ' || '.join(
+            f'setweight(to_tsvector({language}, coalesce("{table}"."{column}"::text, \'\')), {param(values, weight)}::text::"char")'
+            for column, weight in search_config['columns'].items()
+        )
+
+    @staticmethod
+    async def refresh(service: Any, ids: List[uuid.UUID], conn=None):
+        """
+        Recompute search_vector of the base, cache11 and cache1n rows of the items with ids.
+
+        Called after items are created or updated. Does nothing on databases other than
+        postgres, search falls back to icontains there.
+        """
+        targets = BaseServiceSearchUtils.targets(service)
+        if not targets or not ids:
+            return
+
+        db = conn or service.model._meta.db
+        if db.capabilities.dialect != 'postgres':
+            return
+
+        for kind, model, search_config, source_field in targets:
+            table = model._meta.db_table
+            values = []
+            vector = BaseServiceSearchUtils.vector_sql(kind, search_config, table, values)
+            in_ids = ', '.join(BaseServiceSearchUtils.param(values, _id) for _id in ids)
+
+            sql = f'UPDATE "{table}" SET "{SEARCH_VECTOR_COLUMN}" = {vector} WHERE "{table}"."{source_field or "id"}" IN ({in_ids})'
+            await db.execute_query(sql.format(*[f'${i + 1}' for i in range(len(values))]), values)
+
+    @staticmethod
+    def apply(service: Any, query: QuerySet, search: str, language: Optional[str] = None) -> Tuple[QuerySet, bool]:
+        """
+        Restrict query to items matching search.
+
+        On postgres, search_vector columns of all search targets are matched with plainto_tsquery
+        and the query is annotated with the summed ts_rank_cd as base4_search_rank. cache1n rows
+        are matched in language (all languages if not set). Elsewhere the search columns are
+        matched with icontains. Services without search_config keep the display_name icontains search.
+
+        Returns:
+            Tuple[QuerySet, bool]: filtered query, and True if it can be ordered by base4_search_rank
+        """
+        targets = BaseServiceSearchUtils.targets(service)
+
+        if not targets:
+            if 'display_name' in service.model._meta.fields_map.keys():
+                query = query.filter(display_name__icontains=search)
+            return query, False
+
+        db = query._db or service.model._meta.db
+        if db.capabilities.dialect != 'postgres':
+            q = None
+            for kind, model, search_config, source_field in targets:
+                for column in search_config['columns']:
+                    if kind == 'base':
+                        match = Q(**{f'{column}__icontains': search})
+                    elif kind == 'cache11':
+                        match = Q(**{f'cache11__{column}__icontains': search})
+                    else:
+                        rows = model.filter(**{f'{column}__icontains': search})
+                        if language:
+                            rows = rows.filter(language=language)
+                        match = Q(id__in=Subquery(rows.values(source_field)))
+                    q = match if q is None else q | match
+            return query.filter(q) if q is not None else query, False
+
+        base_table = service.model._meta.db_table
+        matches, ranks = [], []
+        # the match and rank expressions share the placeholders, the term and the language once each
+        values = []
+        param = BaseServiceSearchUtils.param
+        search_term = param(values, str(search).replace('\x00', ''))
+
+        for kind, model, search_config, source_field in targets:
+            table = model._meta.db_table
+            tsquery = f'plainto_tsquery({BaseServiceSearchUtils.language_sql(kind, search_config, values, language=language)}, {search_term})'
+
+            if kind == 'base':
+                matches.append(f'"{base_table}"."{SEARCH_VECTOR_COLUMN}" @@ {tsquery}')
+                ranks.append(f'ts_rank_cd("{base_table}"."{SEARCH_VECTOR_COLUMN}", {tsquery})')
+                continue
+
+            where = f'"{table}"."{source_field}" = "{base_table}"."id"'
+            if kind == 'cache1n':
+                if language:
+                    where += f' AND "{table}"."language" = {param(values, language)}'
+                else:
+                    row_language = BaseServiceSearchUtils.language_sql(kind, search_config, values, column=f'"{table}"."language"')
+                    tsquery = f'plainto_tsquery({row_language}, {search_term})'
+
+            matches.append(f'EXISTS (SELECT 1 FROM "{table}" WHERE {where} AND "{table}"."{SEARCH_VECTOR_COLUMN}" @@ {tsquery})')
+            ranks.append(f'COALESCE((SELECT MAX(ts_rank_cd("{table}"."{SEARCH_VECTOR_COLUMN}", {tsquery})) FROM "{table}" WHERE {where}), 0)')
+
+        query = query.annotate(
+            **{
+                SEARCH_MATCH_ANNOTATION: SQLExpression(f'({" OR ".join(matches)})', values),
+                SEARCH_RANK_ANNOTATION: SQLExpression(f'({" + ".join(ranks)})', values),
+            }
+        )
+        return query.filter(**{SEARCH_MATCH_ANNOTATION: True}), True
@@ -0,0 +1,72 @@
+from typing import Any, List
+
+UID_POOL_KEY = 'base4:uid_pool'
+
+
+class BaseServiceUidUtils:
+    @staticmethod
+    def pool_key(model: Any, prefix: str, total_length: int) -> str:
+        return f'{UID_POOL_KEY}:{model._meta.db_table}:{prefix}:{total_length}'
+
+    @staticmethod
+    async def reserve(redis_client: Any, key: str, unique_ids: List[str], ttl: int, existing: bool = False) -> List[str]:
+        """
+        Reserve unique ids in Redis (redis.asyncio client), returning the ones reserved by this call.
+
+        Every id gets its own {key}:{unique_id} key. New reservations are made with SET NX, so
+        an id is handed to one worker only; existing=True refreshes reservations with SET XX,
+        dropping ids whose reservation already expired.
+        """
+        pipe = redis_client.pipeline(transaction=False)
+        for unique_id in unique_ids:
+            pipe.set(f'{key}:{unique_id}', 1, ex=ttl, nx=not existing, xx=existing)
+        return [unique_id for unique_id, reserved in zip(unique_ids, await pipe.execute()) if reserved]
+
+    @staticmethod
+    async def allocate(
+        redis_client: Any,
+        model: Any,
+        count: int,
+        prefix: str,
+        alphabet: str,
+        total_length: int,
+        pool_size: int,
+        ttl: int = 3600,
+        max_attempts: int = 10,
+    ) -> List[str]:
+        """
+        Allocate count unique ids from a pool of ids pre-reserved in Redis.
+
+        The pool is a Redis list per table/prefix/length. When it runs short, count + pool_size
+        ids are generated with model.gen_unique_ids (one IN query per block), reserved with
+        SET NX so concurrent workers never get the same id, and the ones not needed right
+        away are pushed to the pool. Reservations expire after ttl seconds, by then the ids
+        are stored in the table and the IN check rejects them.
+
+        Only services allocating through the same pool are protected from each other,
+        ids generated directly with gen_unique_id(s) are checked against the table only.
+        """
+        key = BaseServiceUidUtils.pool_key(model, prefix, total_length)
+
+        popped = await redis_client.lpop(key, count) or []
+        unique_ids = await BaseServiceUidUtils.reserve(redis_client, key, [uid.decode() if isinstance(uid, bytes) else uid for uid in popped], ttl, existing=True)
+
+        for attempt in range(max_attempts):
+            missing = count - len(unique_ids)
+            if missing <= 0:
+                break
+
+            candidates = await model.gen_unique_ids(missing + pool_size, prefix=prefix, alphabet=alphabet, total_length=total_length, max_attempts=max_attempts)
+            reserved = await BaseServiceUidUtils.reserve(redis_client, key, [uid for uid in candidates if uid not in unique_ids], ttl)
+
+            unique_ids.extend(reserved[:missing])
+            if reserved[missing:]:
+                pipe = redis_client.pipeline(transaction=False)
+                pipe.rpush(key, *reserved[missing:])
+                pipe.expire(key, ttl)
+                await pipe.execute()
+
+        if len(unique_ids) < count:
+            raise NameError(f"Failed to reserve {count} unique ids in {max_attempts} attempts")
+
+        return unique_ids
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+from tortoise import Tortoise
+
+
+class Item:
+    async def compute_total(self):
+        await asyncio.sleep(0.01)
+        return 3
+
+    async def describe(self, citem):
+        return f'total={citem.total}'
+
+
+class CacheItem:
+    mk_cache_rules = [
+        {'column': 'total', 'method': 'async_method', 'function': 'item.compute_total()'},
+        {'column': 'summary', 'method': 'async_method', 'function': 'item.describe(citem)'},
+    ]
+
+    def __init__(self):
+        self.total = None
+        self.summary = None
+
+
+@pytest.fixture
+def item():
+    """Base item whose cache item summary rule reads the total written by the rule before it."""
+    return Item()
+
+
+@pytest.fixture
+def cache_item():
+    return CacheItem()
+
+
+@pytest_asyncio.fixture
+async def sqlite_db():
+    """Initialize Tortoise with an in memory sqlite database for the models of the given modules."""
+
+    async def init(*modules: str):
+        await Tortoise.init(db_url='sqlite://:memory:', modules={'models': list(modules)})
+        await Tortoise.generate_schemas()
+
+    yield init
+
+    await Tortoise.close_connections()
+    Tortoise.apps = {}
+    Tortoise._inited = False
@@ -0,0 +1,54 @@
+import types
+
+import pytest
+from base4.utilities.service import base as service_base
+from fastapi import Request
+
+
+class Handler:
+    @service_base.api(method='GET', path='/items', cache=60, cache_stale=60)
+    async def items(self, request: Request):
+        return {'user_id': self.session.user_id if self.session else None}
+
+
+def mk_request(token=None):
+    headers = [(b'authorization', f'Bearer {token}'.encode())] if token else []
+    return Request({'type': 'http', 'method': 'GET', 'path': '/items', 'query_string': b'', 'headers': headers, 'path_params': {}})
+
+
+@pytest.fixture
+def cached_calls(monkeypatch):
+    """(stale, compute) of every response_cache.cached call, compute is not called"""
+    calls = []
+
+    async def cached(key, compute, ttl, tags, stale=0, lock_timeout=0):
+        calls.append((stale, compute))
+
+    async def accesslog(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(service_base.response_cache, 'cached', cached)
+    monkeypatch.setattr(service_base, 'decode_token', lambda token: types.SimpleNamespace(user_id=token))
+    monkeypatch.setattr(service_base, 'api_accesslog', accesslog)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_stale_responses_are_served_to_anonymous_requests_only(cached_calls):
+    handler = Handler()
+
+    await handler.items(request=mk_request())
+    await handler.items(request=mk_request('u1'))
+
+    assert [stale for stale, _ in cached_calls] == [60, 0]
+
+
+@pytest.mark.asyncio
+async def test_refresh_of_an_anonymous_response_does_not_see_the_session_of_a_later_request(cached_calls):
+    handler = Handler()
+
+    await handler.items(request=mk_request())
+    await handler.items(request=mk_request('u1'))
+
+    assert await cached_calls[0][1]() == {'user_id': None}
+    assert await cached_calls[1][1]() == {'user_id': 'u1'}
@@ -0,0 +1,42 @@
+import pytest
+from base4.utilities.db.base import BaseServiceDbUtils
+from tortoise import Tortoise, fields
+from tortoise.models import Model
+
+
+class Tag(Model):
+    id = fields.IntField(pk=True)
+    name = fields.CharField(32)
+
+
+class Post(Model):
+    id = fields.IntField(pk=True)
+    tags = fields.ManyToManyField('models.Tag', related_name='posts')
+
+
+@pytest.mark.asyncio
+async def test_bulk_m2m_relations_insert_through_rows_in_batches(sqlite_db, monkeypatch):
+    await sqlite_db(__name__)
+
+    tags = [await Tag.create(name=name) for name in 'abc']
+    await Post.bulk_create([Post(id=i) for i in (1, 2, 3)])
+    posts = await Post.all().order_by('id')
+
+    db = Tortoise.get_connection('default')
+    inserts = []
+    execute_query = type(db).execute_query
+
+    async def counted(self, query, values=None):
+        inserts.append(query)
+        return await execute_query(self, query, values)
+
+    monkeypatch.setattr(type(db), 'execute_query', counted)
+
+    relations = [{'tags': [tags[0], tags[1], tags[0]]}, {}, {'tags': [tags[2]]}]
+    await BaseServiceDbUtils._handle_bulk_m2m_relations(Post, posts, relations, None, batch_size=2)
+
+    # three distinct rows, two rows per query
+    assert len(inserts) == 2
+
+    monkeypatch.undo()
+    assert [sorted(tag.name for tag in await post.tags) for post in posts] == [['a', 'b'], [], ['c']]
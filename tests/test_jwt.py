@@ -0,0 +1,55 @@
+import time
+import uuid
+
+import pytest
+from base4.utilities.security import jwt as security
+
+
+@pytest.fixture
+def token():
+    security.token_cache.clear()
+    yield security.create_token(security.CreateTokenRequest(uuid.uuid4(), uuid.uuid4(), ttl=60))
+    security.token_cache.clear()
+
+
+@pytest.fixture
+def verified(monkeypatch):
+    """Tokens verified with jwt.decode, in order."""
+    tokens = []
+    decode = security.jwt.decode
+
+    def counted(token, *args, **kwargs):
+        tokens.append(token)
+        return decode(token, *args, **kwargs)
+
+    monkeypatch.setattr(security.jwt, 'decode', counted)
+    return tokens
+
+
+def test_cached_token_is_evicted_once_it_expires(token, verified, monkeypatch):
+    decoded = security.decode_token(token)
+    assert security.decode_token(token) is decoded
+    assert len(verified) == 1
+
+    expire_at = decoded.expire_at.timestamp()
+    monkeypatch.setattr(time, 'time', lambda: expire_at + 1)
+
+    assert security.token_cache.get(security.TokenCache.key(token)) is None
+    assert security.token_cache.stats()['size'] == 0
+
+    # verified again, and not cached as it has expired
+    assert security.decode_token(token).expired
+    assert len(verified) == 2
+    assert security.token_cache.stats()['size'] == 0
+
+
+def test_use_cache_false_bypasses_the_cache(token, verified):
+    security.decode_token(token, use_cache=False)
+    security.decode_token(token, use_cache=False)
+
+    assert len(verified) == 2
+    assert security.token_cache.stats() == {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': security.token_cache.maxsize}
+
+    cached = security.decode_token(token)
+    assert security.decode_token(token, use_cache=False) is not cached
+    assert len(verified) == 4
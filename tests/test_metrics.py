@@ -0,0 +1,31 @@
+import pytest
+from base4.service.base import BaseService
+from base4.utilities.service.metrics import BaseServiceMetricsUtils, InMemoryMetricsCollector
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+
+@pytest.fixture
+def collector():
+    collector = InMemoryMetricsCollector()
+    BaseServiceMetricsUtils.set_collector(collector)
+    yield collector
+    BaseServiceMetricsUtils.set_collector(None)
+
+
+def test_clients_defined_after_set_collector_are_instrumented(collector):
+    class LateClient(BaseDBAsyncClient):
+        async def execute_query(self, query, values=None):
+            return 0, []
+
+    assert LateClient in BaseServiceMetricsUtils._instrumented
+    assert LateClient.__dict__['execute_query'].__wrapped__ is not None
+
+
+@pytest.mark.asyncio
+async def test_mk_cache_records_rules_once(collector, item, cache_item):
+    service = BaseService.__new__(BaseService)
+
+    await service.mk_cache(None, 'c11', cache_item, item, save=False)
+
+    phases = collector.snapshot()['BaseService']['mk_cache']
+    assert {phase: stats['count'] for phase, stats in phases.items()} == {'total': 1, 'rules': 1}
@@ -0,0 +1,38 @@
+import pytest
+from base4.service.base import BaseService
+from base4.utilities.service.mk_cache import BaseServiceMkCacheUtils
+
+
+def test_rule_reading_citem_as_a_whole_runs_after_earlier_rules(cache_item):
+    stages = BaseServiceMkCacheUtils.stages(type(cache_item))
+
+    assert [[rule['column'] for rule in stage] for stage in stages] == [['total'], ['summary']]
+
+
+def test_rule_reads():
+    assert BaseServiceMkCacheUtils.rule_reads({'column': 'x', 'method': 'ipc', 'ipc': 'ipc.f(citem.a, citem.b)'}) == {'a', 'b'}
+    assert BaseServiceMkCacheUtils.rule_reads({'column': 'x', 'method': 'ipc', 'ipc': 'ipc.f(citem)'}) is None
+    assert BaseServiceMkCacheUtils.rule_reads({'column': 'x', 'method': 'ipc', 'ipc': 'getattr(citem, name)'}) is None
+    assert BaseServiceMkCacheUtils.rule_reads({'column': 'x', 'method': 'ipc', 'ipc': 'ipc.f(**citem.__dict__)'}) is None
+    assert BaseServiceMkCacheUtils.rule_reads({'column': 'x', 'method': 'ipc', 'ipc': 'ipc.f(citem.'}) is None
+
+
+@pytest.mark.asyncio
+async def test_mk_cache_passes_citem_with_columns_of_earlier_rules(item, cache_item):
+    service = BaseService.__new__(BaseService)
+
+    await service.mk_cache(None, 'c11', cache_item, item, save=False)
+
+    assert cache_item.total == 3
+    assert cache_item.summary == 'total=3'
+
+
+@pytest.mark.asyncio
+async def test_mk_cache_returns_timings_of_the_call(item, cache_item):
+    service = BaseService.__new__(BaseService)
+
+    timings = await service.mk_cache(None, 'c11', cache_item, item, save=False)
+
+    assert set(timings) == {'total', 'summary'}
+    assert (timings['total']['stage'], timings['summary']['stage']) == (0, 1)
+    assert not hasattr(service, 'mk_cache_timings')
@@ -0,0 +1,59 @@
+import pytest
+from base4.schemas.universal_table import UniversalTableGetRequest
+from base4.scripts import gen_tables
+from base4.service.base import BaseService
+from fastapi import HTTPException
+
+MODEL_YAML = '''
+tickets:
+  __meta: {table_name: tickets, app: tickets}
+  title: {field: "fields.CharField(128, index=True)"}
+  __cache11:
+    __meta: {table_name: tickets_c11, app: tickets}
+    ticket: {field: "fields.OneToOneField('tickets.Tickets', related_name='cache11')"}
+    sla_deadline_for_open: {field: "fields.DatetimeField(null=True, index=True)"}
+    sla_deadline_for_resolve: {field: "fields.DatetimeField(null=True, index=True)"}
+'''
+
+TABLES_YAML = '''
+profiles:
+  default:
+    model: tickets
+    columns:
+      - title: {sortable: true}
+      - sla_deadline_for_open: {sortable: true}
+      - sla_deadline_for_resolve: {}
+'''
+
+
+@pytest.fixture
+def profile_schema(tmp_path):
+    (tmp_path / 'model.yaml').write_text(MODEL_YAML)
+    (tmp_path / 'tables.yaml').write_text(TABLES_YAML)
+
+    namespace = {}
+    exec(gen_tables.generate('tickets', str(tmp_path / 'tables.yaml'), str(tmp_path / 'model.yaml')), namespace)
+    return namespace['TicketsDefaultSchema']
+
+
+def test_generated_profile_orders_cache11_columns_through_cache11(profile_schema):
+    assert profile_schema.order_map()['sla_deadline_for_open'] == 'cache11.sla_deadline_for_open'
+
+    assert BaseService.resolve_order_by(UniversalTableGetRequest(order_by='-sla_deadline_for_open'), profile_schema) == '-cache11__sla_deadline_for_open'
+    assert BaseService.resolve_order_by(UniversalTableGetRequest(order_by='title'), profile_schema) == 'title'
+
+
+def test_profile_generated_with_self_mapped_sla_column_still_orders_through_cache11(profile_schema):
+    class LegacySchema(profile_schema):
+        @staticmethod
+        def order_map():
+            return {'title': 'title', 'sla_deadline_for_open': 'sla_deadline_for_open'}
+
+    assert BaseService.resolve_order_by(UniversalTableGetRequest(order_by='sla_deadline_for_open'), LegacySchema) == 'cache11__sla_deadline_for_open'
+
+
+def test_generated_profile_rejects_columns_not_sortable(profile_schema):
+    with pytest.raises(HTTPException) as e:
+        BaseService.resolve_order_by(UniversalTableGetRequest(order_by='sla_deadline_for_resolve'), profile_schema)
+
+    assert e.value.status_code == 400
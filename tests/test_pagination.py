@@ -0,0 +1,149 @@
+import datetime
+import decimal
+import types
+import uuid
+
+import pytest
+import pytest_asyncio
+from base4.utilities.service.pagination import BaseServicePaginationUtils as Pagination
+from tortoise import fields
+from tortoise.models import Model
+
+
+class Row(Model):
+    id = fields.UUIDField(pk=True)
+    rank = fields.IntField(null=True)
+
+
+# ranks with duplicates and NULLs, ordered pages must break ties by id and place NULLs consistently
+RANKS = [3, None, 1, 2, None, 2, 1, 3, None, 2]
+
+
+@pytest_asyncio.fixture
+async def rows(sqlite_db):
+    await sqlite_db(__name__)
+    await Row.bulk_create([Row(id=uuid.uuid4(), rank=rank) for rank in RANKS])
+    return await Row.all()
+
+
+def expected_ids(rows, order_by):
+    """ids of rows in order_by order with sqlite NULL ordering (NULLs smallest), id breaking ties"""
+    field, descending = Pagination.split_order_by(order_by)
+    key = lambda row: (getattr(row, field) is not None, getattr(row, field) or 0, str(row.id))
+    return [row.id for row in sorted(rows, key=key, reverse=descending)]
+
+
+def mk_request(cursor=False, after=None, before=None):
+    return types.SimpleNamespace(cursor=cursor, after=after, before=before)
+
+
+async def page(request, order_by, per_page):
+    """A keyset page fetched as get_all fetches it: (items, next_cursor, previous_cursor)"""
+    query, backward = Pagination.apply_keyset(Row.all(), request, order_by)
+    items = await query.limit(Pagination.page_limit(per_page, 'exact', cursor_mode=True))
+
+    items, has_more = Pagination.split_page(items, per_page)
+    if backward:
+        items.reverse()
+
+    next_cursor, previous_cursor = Pagination.cursors(items, order_by, has_more=has_more, backward=backward, from_cursor=bool(request.after or request.before))
+    return items, next_cursor, previous_cursor
+
+
+def test_resolve_count_mode():
+    class Profile:
+        @staticmethod
+        def count_mode():
+            return 'window'
+
+    assert Pagination.resolve_count_mode(types.SimpleNamespace(count_mode=None), object) == 'exact'
+    assert Pagination.resolve_count_mode(types.SimpleNamespace(count_mode=None), Profile) == 'window'
+    assert Pagination.resolve_count_mode(types.SimpleNamespace(count_mode='none'), Profile) == 'none'
+
+    with pytest.raises(NameError):
+        Pagination.resolve_count_mode(types.SimpleNamespace(count_mode='approximate'), object)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('count_mode', ['exact', 'window', 'estimated'])
+async def test_count_modes_report_the_total(rows, count_mode):
+    query = Pagination.apply_count_mode(Row.all(), count_mode).order_by('id')
+
+    items = await query.limit(3)
+    assert await Pagination.count(Row.all(), items, count_mode, offset=0) == len(RANKS)
+
+    # a page past the end has no window column to read the count from
+    assert await Pagination.count(Row.all(), await query.offset(100).limit(3), count_mode, offset=100) == len(RANKS)
+
+
+@pytest.mark.asyncio
+async def test_count_mode_none_detects_next_page_by_over_fetching(rows):
+    limit = Pagination.page_limit(4, 'none')
+    assert limit == 5
+
+    items, has_next = Pagination.split_page(await Row.all().order_by('id').offset(8).limit(limit), 4)
+    assert (len(items), has_next) == (2, False)
+    assert await Pagination.count(Row.all(), items, 'none', offset=8) is None
+
+
+@pytest.mark.parametrize(
+    'value', [None, 7, 'text', datetime.datetime(2024, 5, 1, 12, 30), datetime.date(2024, 5, 1), uuid.uuid4(), decimal.Decimal('1.50')]
+)
+def test_cursor_round_trip(value):
+    item = types.SimpleNamespace(id=uuid.uuid4(), value=value)
+
+    assert Pagination.decode_cursor(Pagination.encode_cursor(item, '-value'), '-value') == (value, item.id)
+
+
+def test_cursor_is_bound_to_its_order_by():
+    cursor = Pagination.encode_cursor(types.SimpleNamespace(id=uuid.uuid4(), value=1), 'value')
+
+    with pytest.raises(ValueError):
+        Pagination.decode_cursor(cursor, '-value')
+
+    with pytest.raises(ValueError):
+        Pagination.decode_cursor('not a cursor', 'value')
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('order_by', ['rank', '-rank', 'id'])
+async def test_cursor_pages_walk_all_rows_once_with_null_ordering_values(rows, order_by):
+    ids = expected_ids(rows, order_by)
+
+    pages = []
+    items, next_cursor, previous_cursor = await page(mk_request(cursor=True), order_by, 3)
+    assert previous_cursor is None
+    pages.append(items)
+
+    while next_cursor:
+        items, next_cursor, previous_cursor = await page(mk_request(after=next_cursor), order_by, 3)
+        assert previous_cursor is not None
+        pages.append(items)
+
+    assert [item.id for items in pages for item in items] == ids
+    # the last page is at the end of the data, there is no next page
+    assert [len(items) for items in pages] == [3, 3, 3, 1]
+
+    # going back from the last page returns the page before it
+    items, next_cursor, previous_cursor = await page(mk_request(before=Pagination.encode_cursor(pages[-1][0], order_by)), order_by, 3)
+    assert [item.id for item in items] == [item.id for item in pages[-2]]
+    assert next_cursor is not None and previous_cursor is not None
+
+
+@pytest.mark.asyncio
+async def test_previous_page_at_the_start_of_the_data(rows):
+    ids = expected_ids(rows, 'rank')
+    first = next(row for row in rows if row.id == ids[0])
+
+    items, next_cursor, previous_cursor = await page(mk_request(before=Pagination.encode_cursor(first, 'rank')), 'rank', 3)
+
+    assert (items, next_cursor, previous_cursor) == ([], None, None)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('order_by', ['rank', '-rank'])
+async def test_export_chunks_read_all_rows_once(rows, order_by):
+    chunks = [chunk async for chunk in Pagination.chunks(Row.all(), order_by, 4)]
+
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    assert [item.id for chunk in chunks for item in chunk] == expected_ids(rows, order_by)
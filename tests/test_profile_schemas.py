@@ -0,0 +1,48 @@
+import sys
+import types
+
+import pytest
+from base4.api import crud
+from base4.schemas.universal_table import UniversalTableResponseBaseSchema
+from base4.service.base import BaseService
+from fastapi import APIRouter, HTTPException
+
+
+class TicketsDefaultSchema(UniversalTableResponseBaseSchema):
+    pass
+
+
+class TicketsCompactSchema(UniversalTableResponseBaseSchema):
+    pass
+
+
+@pytest.fixture
+def schemas_module(monkeypatch):
+    module = types.ModuleType('services.tickets.schemas')
+    module.TicketsDefaultSchema = TicketsDefaultSchema
+    module.TicketsCompactSchema = TicketsCompactSchema
+    monkeypatch.setitem(sys.modules, 'services.tickets.schemas', module)
+    monkeypatch.setattr(crud, '_profile_schemas', {})
+    return module
+
+
+def mk_endpoints():
+    crud.create_endpoints(APIRouter(), {'/tickets': {'service': BaseService, 'schema': None}}, 'tickets', 'ticket', 'tickets', functions={'get'})
+
+
+def test_profile_schemas_are_resolved_when_routes_are_created(schemas_module):
+    mk_endpoints()
+
+    assert crud._profile_schemas['tickets'] == {'Default': TicketsDefaultSchema, 'Compact': TicketsCompactSchema}
+    assert crud.get_profile_schema('tickets', 'compact') is TicketsCompactSchema
+
+    with pytest.raises(HTTPException) as e:
+        crud.get_profile_schema('tickets', 'missing')
+    assert e.value.status_code == 400
+
+
+def test_missing_default_profile_fails_when_routes_are_created(schemas_module):
+    del schemas_module.TicketsDefaultSchema
+
+    with pytest.raises(NameError):
+        mk_endpoints()
@@ -0,0 +1,71 @@
+import asyncio
+
+import fakeredis
+import pytest
+from base4.utilities.db.redis import AsyncRedisClientHandler
+from base4.utilities.service.response_cache import ResponseCache
+
+
+class CountingHandler(AsyncRedisClientHandler):
+    def __init__(self, redis_instance):
+        super().__init__(redis_instance)
+        self.pipelines = 0
+
+    def pipeline(self, transaction: bool = False):
+        self.pipelines += 1
+        return super().pipeline(transaction)
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache(CountingHandler(fakeredis.aioredis.FakeRedis()), local_size=0)
+
+
+@pytest.mark.asyncio
+async def test_invalidating_tags_without_cached_keys_is_one_round_trip(cache):
+    await cache.invalidate(ResponseCache.table_tags('tickets', [1]))
+
+    assert cache.redis_handler.pipelines == 1
+    assert cache.stats['invalidations'] == 0
+    assert await cache.versions(['tickets']) == [None]
+
+
+@pytest.mark.asyncio
+async def test_invalidate_drops_cached_keys(cache):
+    async def compute():
+        return {'n': 1}
+
+    await cache.cached('k', compute, 60, ResponseCache.table_tags('tickets', [1]))
+    assert await cache.get('k') == {'n': 1}
+
+    await cache.invalidate(ResponseCache.table_tags('tickets', [2]))
+
+    assert await cache.get('k') is None
+    assert await cache.versions(['tickets', 'tickets:2']) == [b'1', None]
+
+
+@pytest.mark.asyncio
+async def test_response_computed_while_invalidated_is_not_cached(cache):
+    async def compute():
+        await cache.invalidate(['tickets'])
+        return {'n': 1}
+
+    assert await cache.cached('k', compute, 60, ['tickets']) == {'n': 1}
+    assert await cache.get('k') is None
+
+
+@pytest.mark.asyncio
+async def test_invalidate_does_not_raise_if_redis_is_down():
+    server = fakeredis.FakeServer()
+    server.connected = False
+    cache = ResponseCache(AsyncRedisClientHandler(fakeredis.aioredis.FakeRedis(server=server)), local_size=0)
+
+    await cache.invalidate(['tickets'])
+
+
+def test_tracked_tables():
+    cache = ResponseCache(None, local_size=0)
+    cache.track(ResponseCache.table_of_tag('tickets:{ticket_id}'))
+
+    assert cache.tracks('tickets')
+    assert not cache.tracks('users')
@@ -0,0 +1,44 @@
+import pytest
+from base4.api.crud import _services, get_service
+from base4.service.base import BaseService, _cache_relations
+from tortoise import fields
+from tortoise.models import Model
+
+
+class Ticket(Model):
+    id = fields.IntField(pk=True)
+
+
+class TicketCache11(Model):
+    id = fields.IntField(pk=True)
+    ticket = fields.OneToOneField('models.Ticket', related_name='cache11')
+
+
+class SharedService(BaseService):
+    def __init__(self):
+        # no model, only the instance identity is used
+        pass
+
+
+def test_get_service_returns_the_same_instance():
+    _services.pop(SharedService, None)
+
+    service = get_service(SharedService)
+
+    assert isinstance(service, SharedService)
+    assert get_service(SharedService) is service
+    assert get_service(SharedService) is service
+
+
+@pytest.mark.asyncio
+async def test_cache_relations_reflect_cache_models_once(sqlite_db):
+    await sqlite_db(__name__)
+    _cache_relations.pop((TicketCache11, None), None)
+    reflection_count = BaseService.reflection_count + 1
+
+    assert BaseService.cache_relations(TicketCache11, None) == ('ticket', None)
+    assert BaseService.reflection_count == reflection_count
+
+    assert BaseService.cache_relations(TicketCache11, None) == ('ticket', None)
+    assert BaseService.cache_relations(TicketCache11, None) == ('ticket', None)
+    assert BaseService.reflection_count == reflection_count
@@ -0,0 +1,103 @@
+import pytest
+import pytest_asyncio
+from base4.utilities.parsers.str2q import OPERATORS, compile_filter
+from tortoise import fields
+from tortoise.models import Model
+
+
+class Doc(Model):
+    id = fields.IntField(pk=True)
+    name = fields.CharField(32)
+    inbox = fields.IntField()
+    is_x = fields.BooleanField()
+    score = fields.IntField(null=True)
+
+
+@pytest_asyncio.fixture
+async def docs(sqlite_db):
+    await sqlite_db(__name__)
+    await Doc.bulk_create(
+        [
+            Doc(id=1, name='alpha', inbox=1, is_x=True, score=10),
+            Doc(id=2, name='beta', inbox=2, is_x=False, score=None),
+            Doc(id=3, name='alps', inbox=3, is_x=False, score=30),
+        ]
+    )
+
+
+async def ids(s):
+    return sorted(doc.id for doc in await Doc.filter(compile_filter(s).as_q()))
+
+
+def test_compile_filter_builds_the_ast():
+    assert compile_filter('and(name="a", or(inbox>2, not(inbox=[1, 2])))').ast == (
+        'and',
+        (('cmp', 'name', '=', 'a'), ('or', (('cmp', 'inbox', '>', 2), ('not', ('cmp', 'inbox', '=', (1, 2)))))),
+    )
+
+
+def test_field_names_starting_with_keywords_are_names():
+    assert compile_filter('is_x=True').ast == ('cmp', 'is_x', '=', True)
+    assert compile_filter('inbox=2').ast == ('cmp', 'inbox', '=', 2)
+    assert compile_filter("notes.in_progress='y'").ast == ('cmp', 'notes.in_progress', '=', 'y')
+
+
+def test_compiled_filters_are_cached_and_immutable():
+    compiled = compile_filter('inbox=1')
+
+    assert compile_filter('inbox=1') is compiled
+    with pytest.raises(AttributeError):
+        compiled.ast = ()
+
+
+@pytest.mark.asyncio
+async def test_as_q_filters_rows(docs):
+    assert await ids('and(is_x=False, inbox>=2)') == [2, 3]
+    assert await ids("or(name='alpha', not(inbox<3))") == [1, 3]
+
+
+@pytest.mark.asyncio
+async def test_range_in_null_and_startswith_operators(docs):
+    assert await ids('inbox between (2, 3)') == [2, 3]
+    assert await ids('inbox in [1, 3]') == [1, 3]
+    assert await ids('score is null') == [2]
+    assert await ids('score is not null') == [1, 3]
+    assert await ids("name startswith 'alp'") == [1, 3]
+
+
+def test_lookups_name_the_operators_used():
+    compiled = compile_filter('and(score is not null, inbox between (1, 2), name startswith "a", is_x=True)')
+
+    assert compiled.lookups == {('score', 'is null'), ('inbox', 'between'), ('name', 'startswith'), ('is_x', '=')}
+    assert {operator for _, operator in compiled.lookups} <= set(OPERATORS)
+
+
+class Profile:
+    @staticmethod
+    def filter_properties(column):
+        return {'score': {'operators': ['>', 'is null']}, 'name': True, 'inbox': {'enabled': False}}.get(column, False)
+
+
+def test_check_allows_enabled_columns_and_operators():
+    compile_filter('and(score > 1, score is null, name startswith "a", is_x=True)').check(Profile)
+
+
+@pytest.mark.parametrize(
+    'filters, message',
+    [
+        ('score between (1, 2)', 'Operator between is not allowed for score'),
+        ('inbox > 1', 'Filtering by inbox is not allowed'),
+        ('is_x in [True]', 'Filtering by is_x is not allowed'),
+        ('owner.score=1', 'Operator = is not allowed for owner.score'),
+    ],
+)
+def test_check_rejects_disallowed_lookups(filters, message):
+    with pytest.raises(ValueError, match=message):
+        compile_filter(filters).check(Profile)
+
+
+def test_check_strict_covers_plain_equality():
+    compile_filter('is_x=True').check(Profile)
+
+    with pytest.raises(ValueError):
+        compile_filter('is_x=True').check(Profile, strict=True)